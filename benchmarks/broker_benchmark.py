@@ -0,0 +1,116 @@
+"""
+End-to-end benchmark with real MQTT clients: synthetic Wiren Board capture is published to in-process broker
+and App bridges it to second broker. Measures time until last states reach Home Assistant side,
+with injected broker latency and after dropping connections of App several times (reconnect storm).
+
+Usage: python benchmarks/broker_benchmark.py [--devices N] [--controls N] [--rounds N] [--latency SECONDS] [--drops N]
+"""
+import asyncio
+import json
+import logging
+import optparse
+import os
+import sys
+import tempfile
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gmqtt.client import Client as MQTTClient
+from benchmarks.common import generate_wb_input
+from ha_wb_discovery.app import App
+from ha_wb_discovery.config import config_schema_builder, general_config
+from ha_wb_discovery.homeassistant import HomeAssistantDiscoveryCustomizer
+from ha_wb_discovery.mqtt_conn.local_broker import LocalMQTTBroker
+
+def read_messages(path: str) -> list[tuple[str, str]]:
+    with open(path, 'rt') as f:
+        return [(m['topic'], m['payload']) for m in map(json.loads, f)]
+
+async def wait_states(received: dict[str, bytes], expected: dict[str, bytes], timeout: float = 120):
+    deadline = time.monotonic() + timeout
+    while any(received.get(topic) != payload for topic, payload in expected.items()):
+        if time.monotonic() > deadline:
+            raise TimeoutError("last states are not received in time")
+        await asyncio.sleep(0.01)
+
+async def connect(client_id: str, broker: LocalMQTTBroker) -> MQTTClient:
+    client = MQTTClient(client_id)
+    client.set_config({'reconnect_delay': 0.1})
+    await client.connect('127.0.0.1', broker.port)
+    return client
+
+async def run(messages: list[tuple[str, str]], latency: float, drops: int):
+    wb_broker = LocalMQTTBroker(latency=latency)
+    ha_broker = LocalMQTTBroker(latency=latency, topic_alias_maximum=100, receive_maximum=100)
+    await wb_broker.start()
+    await ha_broker.start()
+    states = {topic: payload.encode('utf-8') for topic, payload in messages if '/meta' not in topic}
+
+    ha = await connect('home-assistant', ha_broker)
+    received: dict[str, bytes] = {}
+    ha.on_message = lambda c, topic, payload, qos, properties: received.__setitem__(topic, payload)
+    ha.subscribe('/devices/#')
+    cfg = config_schema_builder({})({
+        "homeassistant": {'broker_host': '127.0.0.1', 'broker_port': ha_broker.port,
+                          'config_first_publish_delay': 0, 'topic_alias_maximum': 100},
+        "wirenboard": {'broker_host': '127.0.0.1', 'broker_port': wb_broker.port},
+        "general.watchdog_interval": 0,
+    })
+    app_wb, app_ha = MQTTClient('app-wb'), MQTTClient('app-ha')
+    for client in (app_wb, app_ha):
+        client.set_config({'reconnect_delay': 0.1})
+    app = App(cfg["homeassistant"], cfg["wirenboard"], app_ha, app_wb, HomeAssistantDiscoveryCustomizer(),
+              general_config(cfg))
+    app_task = asyncio.get_running_loop().create_task(app.run())
+    device = await connect('wb', wb_broker)
+    await asyncio.sleep(0.5)
+
+    started = time.monotonic()
+    for topic, payload in messages:
+        device.publish(topic, payload, qos=0, retain='/meta' in topic)
+    await wait_states(received, states)
+    elapsed = time.monotonic() - started
+    print(f"replay: {len(messages):,} messages in {elapsed:.3f}s, {len(messages) / elapsed:,.0f} msg/s")
+
+    # Every drop makes App reconnect, resubscribe and receive all retained meta again
+    started = time.monotonic()
+    for _ in range(drops):
+        wb_broker.drop_connections('app-wb')
+        ha_broker.drop_connections('app-ha')
+        await asyncio.sleep(0.01)
+    updated = {topic: b'1' if payload != b'1' else b'0' for topic, payload in states.items()}
+    while {'app-wb'} - set(wb_broker.client_ids) or {'app-ha'} - set(ha_broker.client_ids):
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.2)
+    for topic, state in updated.items():
+        device.publish(topic, state, qos=0)
+    await wait_states(received, updated)
+    elapsed = time.monotonic() - started
+    print(f"reconnect storm: {drops} drops, {len(updated):,} states delivered after reconnect in {elapsed:.3f}s")
+
+    await app.stop()
+    await app_task
+    await device.disconnect()
+    await ha.disconnect()
+    await wb_broker.stop()
+    await ha_broker.stop()
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("--devices", type=int, default=20, help="Number of synthetic devices")
+    parser.add_option("--controls", type=int, default=20, help="Number of controls per device")
+    parser.add_option("--rounds", type=int, default=10, help="Number of state updates per control")
+    parser.add_option("--latency", type=float, default=0.001, help="Latency of every packet sent by brokers, seconds")
+    parser.add_option("--drops", type=int, default=10, help="Number of connection drops in reconnect storm")
+    opts, _ = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    with tempfile.TemporaryDirectory() as workdir:
+        wb_input_file = os.path.join(workdir, 'wb.input.txt')
+        generate_wb_input(wb_input_file, opts.devices, opts.controls, opts.rounds)
+        messages = read_messages(wb_input_file)
+    print(f"{opts.devices} devices x {opts.controls} controls, {opts.rounds} rounds, {opts.latency * 1000:g}ms broker latency")
+    asyncio.run(run(messages, opts.latency, opts.drops))
+
+if __name__ == "__main__":
+    main()
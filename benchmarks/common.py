@@ -0,0 +1,88 @@
+import asyncio
+import json
+import os
+import sys
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ha_wb_discovery.app import App
+from ha_wb_discovery.config import config_schema_builder, general_config
+from ha_wb_discovery.event_loop import EventLoopType, new_event_loop
+from ha_wb_discovery.homeassistant import HomeAssistantDiscoveryCustomizer
+from ha_wb_discovery.mqtt_conn.local_mqtt import LocalMQTTClient
+
+# Control types with values, which are used to generate synthetic devices.
+CONTROL_TYPES = [
+    ('switch', '0', '1'),
+    ('temperature', '21.5', '21.6'),
+    ('power', '120', '121'),
+    ('value', '1', '2'),
+]
+
+def generate_wb_input(path: str, devices: int, controls: int, rounds: int) -> int:
+    """
+    Write synthetic Wiren Board MQTT capture to the file: meta of every device and control
+    followed by `rounds` state updates of every control. Returns number of written messages.
+    """
+    count = 0
+    with open(path, 'wt') as f:
+        def write(topic: str, payload: str):
+            nonlocal count
+            f.write(json.dumps({'topic': topic, 'payload': payload}) + '\n')
+            count += 1
+
+        for d in range(devices):
+            device_id = f'wb-bench_{d}'
+            write(f'/devices/{device_id}/meta/name', f'Bench {d}')
+            for c in range(controls):
+                control_type, _, _ = CONTROL_TYPES[c % len(CONTROL_TYPES)]
+                write(f'/devices/{device_id}/controls/Control {c}/meta/type', control_type)
+                write(f'/devices/{device_id}/controls/Control {c}/meta/error', '')
+        for r in range(rounds):
+            for d in range(devices):
+                for c in range(controls):
+                    _, even, odd = CONTROL_TYPES[c % len(CONTROL_TYPES)]
+                    write(f'/devices/wb-bench_{d}/controls/Control {c}', odd if r % 2 else even)
+    return count
+
+def run_app(workdir: str, wb_input_file: str, loop_type: EventLoopType = EventLoopType.asyncio, options: dict | None = None) -> float:
+    """Replay WB input through App with local MQTT clients. Returns elapsed wall time in seconds."""
+    if options is None:
+        options = {
+            "homeassistant": {'broker_host': 'localhost', 'config_first_publish_delay': 0},
+            "wirenboard": {'broker_host': 'localhost'},
+        }
+    cfg = config_schema_builder({})(options)
+    ha_input_file = os.path.join(workdir, 'ha.input.txt')
+    if not os.path.exists(ha_input_file):
+        open(ha_input_file, 'wt').close()
+
+    loop = new_event_loop(loop_type)
+    asyncio.set_event_loop(loop)
+    try:
+        wb_mqtt_client = LocalMQTTClient(wb_input_file, os.path.join(workdir, 'wb.output.txt'))
+        ha_mqtt_client = LocalMQTTClient(ha_input_file, os.path.join(workdir, 'ha.output.txt'))
+        app = App(
+            cfg["homeassistant"],
+            cfg["wirenboard"],
+            ha_mqtt_client, wb_mqtt_client,
+            HomeAssistantDiscoveryCustomizer(),
+            general_config(cfg),
+        )
+
+        completed = 0
+        async def on_disconnect(a, b):
+            nonlocal completed
+            completed += 1
+            if completed == 2:
+                await app.stop()
+
+        wb_mqtt_client.on_disconnect = on_disconnect
+        ha_mqtt_client.on_disconnect = on_disconnect
+
+        started = time.perf_counter()
+        loop.run_until_complete(app.run())
+        return time.perf_counter() - started
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
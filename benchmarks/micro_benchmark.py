@@ -0,0 +1,252 @@
+"""
+Microbenchmarks of per-message hot functions: router dispatch, Wiren Board handlers, type mapping,
+identifiers, discovery payload build and local MQTT replay.
+Every case processes fixed synthetic fixture kept in memory, cost per message is best of several repeats,
+median and relative standard deviation of repeats show noise of measurement.
+Cost of every case is divided by cost of calibration loop of plain Python code over same messages,
+so baseline file keeps relative costs, which are comparable between machines.
+Relative costs are compared with baseline and reported as percentage deltas.
+
+Usage: python benchmarks/micro_benchmark.py [--case NAME] [--repeat N] [--baseline FILE] [--save-baseline] [--max-regression PCT]
+"""
+import json
+import logging
+import optparse
+import os
+import statistics
+import sys
+import tempfile
+import timeit
+from typing import Callable
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.common import generate_wb_input
+from ha_wb_discovery import mappers
+from ha_wb_discovery.homeassistant import HomeAssistant, HomeAssistantDiscoveryCustomizer, format_entity_id, prepare_ha_identifier
+from ha_wb_discovery.metrics import MetricsRegistry
+from ha_wb_discovery.mqtt_conn.local_mqtt import LocalMQTTClient
+from ha_wb_discovery.mqtt_conn.mqtt_client import MQTTRouter
+from ha_wb_discovery.wirenboard import Wirenboard
+from ha_wb_discovery.wirenboard_registry import WirenBoardDeviceRegistry
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'micro_baseline.json')
+
+# Fixture size is fixed, baseline is comparable only for same fixture
+_DEVICES = 50
+_CONTROLS = 20
+
+def _null_router(name: str) -> MQTTRouter:
+    return MQTTRouter(LocalMQTTClient(os.devnull, os.devnull), name, metrics_registry=MetricsRegistry())
+
+def _deliver(router, messages):
+    for topic, payload in messages:
+        router._on_message(None, topic, payload, 0, {})
+
+class _NullHass:
+    def publish_device_config(self, device):
+        pass
+
+    def publish_control_config(self, device, control):
+        pass
+
+    def publish_control_state(self, device, control, state=None):
+        pass
+
+    def publish_availability(self, device, control):
+        pass
+
+    def remove_control(self, device, control):
+        pass
+
+    def remove_device(self, device):
+        pass
+
+class Fixture:
+    """Synthetic Wiren Board messages and registry with all devices of capture."""
+    device_meta: list[tuple[str, bytes]]
+    control_meta: list[tuple[str, bytes]]
+    control_meta_json: list[tuple[str, bytes]]
+    states: list[tuple[str, bytes]]
+    registry: WirenBoardDeviceRegistry
+
+    def __init__(self, workdir: str):
+        input_file = os.path.join(workdir, 'wb.input.txt')
+        # Two rounds, so every control state changes
+        generate_wb_input(input_file, _DEVICES, _CONTROLS, 2)
+        self.device_meta, self.control_meta, self.states = [], [], []
+        with open(input_file) as f:
+            for line in f:
+                msg = json.loads(line)
+                topic, payload = msg['topic'], msg['payload'].encode('utf-8')
+                if '/controls/' not in topic:
+                    self.device_meta.append((topic, payload))
+                elif '/meta/' in topic:
+                    self.control_meta.append((topic, payload))
+                else:
+                    self.states.append((topic, payload))
+        control_types: dict[str, str] = {}
+        for topic, payload in self.control_meta:
+            if topic.endswith('/meta/type'):
+                control_types[topic.removesuffix('/type')] = payload.decode('utf-8')
+        self.control_meta_json = [
+            (topic, json.dumps({'type': control_type, 'readonly': False, 'order': 1}).encode('utf-8'))
+            for topic, control_type in control_types.items()
+        ]
+        self.registry = WirenBoardDeviceRegistry()
+        _deliver(self.wirenboard(self.registry)._router, self.device_meta + self.control_meta + self.states)
+
+    def wirenboard(self, registry: WirenBoardDeviceRegistry | None = None) -> Wirenboard:
+        wb = Wirenboard(_null_router('wirenboard'), registry or self.registry, _NullHass(), metrics_registry=MetricsRegistry())
+        wb.on_connect()
+        return wb
+
+    def controls(self) -> list:
+        return [(device, control) for device in self.registry.devices().values() for control in device.controls.values()]
+
+# Case setup returns function, which processes batch, and number of messages in batch
+Case = Callable[[Fixture], tuple[Callable[[], None], int]]
+
+def router_dispatch(fixture: Fixture):
+    router = _null_router('wirenboard')
+    for topic in ('/devices/+/meta/+', '/devices/+/controls/+/meta/+', '/devices/+/controls/+/meta', '/devices/+/controls/+'):
+        router.subscribe(topic, lambda topic, payload: None)
+    messages = fixture.device_meta + fixture.control_meta + fixture.states
+    def run():
+        _deliver(router, messages)
+    return run, len(messages)
+
+def _handler_case(messages: Callable[[Fixture], list[tuple[str, bytes]]], handler: Callable[[Wirenboard], Callable[[str, bytes], None]]) -> Case:
+    def setup(fixture: Fixture):
+        batch = messages(fixture)
+        handle = handler(fixture.wirenboard())
+        def run():
+            for topic, payload in batch:
+                handle(topic, payload)
+        return run, len(batch)
+    return setup
+
+def wiren_to_hass_type(fixture: Fixture):
+    controls = [control for _, control in fixture.controls()]
+    def run():
+        for control in controls:
+            mappers.wiren_to_hass_type(control)
+    return run, len(controls)
+
+def identifiers(fixture: Fixture):
+    ids = [(device.device_id, control.id) for device, control in fixture.controls()]
+    def run():
+        for device_id, control_id in ids:
+            prepare_ha_identifier(device_id)
+            format_entity_id(device_id, control_id)
+    return run, len(ids)
+
+def ha_config_build(fixture: Fixture):
+    ha = HomeAssistant(_null_router('homeassistant'), fixture.registry, HomeAssistantDiscoveryCustomizer(), 0, 0, metrics_registry=MetricsRegistry())
+    controls = fixture.controls()
+    def run():
+        for device, control in controls:
+            ha._build_control_config(device, control)
+    return run, len(controls)
+
+def local_mqtt_replay(fixture: Fixture):
+    # Messages are delivered from memory, so file reading and JSON parsing do not add noise
+    client = LocalMQTTClient(os.devnull, os.devnull)
+    router = MQTTRouter(client, 'wirenboard', metrics_registry=MetricsRegistry())
+    router.subscribe('#', lambda topic, payload: None)
+    messages = fixture.device_meta + fixture.control_meta + fixture.states
+    def run():
+        for topic, payload in messages:
+            client.deliver(topic, payload)
+    return run, len(messages)
+
+def calibration(fixture: Fixture):
+    """Plain Python work per message, which does not depend on code of project: unit of relative costs."""
+    messages = fixture.device_meta + fixture.control_meta + fixture.states
+    def run():
+        seen = {}
+        for topic, payload in messages:
+            seen[topic.split('/')[2]] = payload.decode('utf-8')
+    return run, len(messages)
+
+CASES: dict[str, Case] = {
+    'router_dispatch': router_dispatch,
+    'wb_device_meta_handler': _handler_case(lambda f: f.device_meta, lambda wb: wb._device_meta_handler),
+    'wb_control_meta_handler': _handler_case(lambda f: f.control_meta, lambda wb: wb._control_meta_handler),
+    'wb_control_meta_json_handler': _handler_case(lambda f: f.control_meta_json, lambda wb: wb._control_meta_json_handler),
+    'wb_control_state_handler': _handler_case(lambda f: f.states, lambda wb: wb._control_state_handler),
+    'wiren_to_hass_type': wiren_to_hass_type,
+    'identifiers': identifiers,
+    'ha_config_build': ha_config_build,
+    'local_mqtt_replay': local_mqtt_replay,
+}
+
+class Result:
+    """Time per message in nanoseconds: best and median of repeats, relative standard deviation in percent."""
+    best: float
+    median: float
+    stdev: float
+
+    def __init__(self, times: list[float]):
+        self.best = min(times)
+        self.median = statistics.median(times)
+        self.stdev = statistics.stdev(times) / statistics.mean(times) * 100 if len(times) > 1 else 0
+
+def measure(case: Case, fixture: Fixture, repeat: int) -> Result:
+    run, messages = case(fixture)
+    # Warm up caches before measurement
+    run()
+    timer = timeit.Timer(run)
+    # Batch is repeated, so one measurement takes at least 200ms
+    number, _ = timer.autorange()
+    times = timer.repeat(repeat=repeat, number=number)
+    return Result([t / number / messages * 1e9 for t in times])
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("--case", action="append", default=[], help="Case to run, all by default: " + ", ".join(CASES))
+    parser.add_option("--repeat", type=int, default=7, help="Number of repeats, best one is compared with baseline")
+    parser.add_option("--baseline", default=DEFAULT_BASELINE, help="Baseline file with relative costs")
+    parser.add_option("--save-baseline", action="store_true", default=False, help="Write relative costs to baseline file")
+    parser.add_option("--max-regression", type=float, default=None, help="Fail when any case is slower than baseline by more percent")
+    opts, _ = parser.parse_args()
+
+    unknown = [name for name in opts.case if name not in CASES]
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(unknown)}")
+    names = opts.case or list(CASES)
+    logging.basicConfig(level=logging.ERROR)
+    baseline: dict[str, float] = {}
+    if os.path.exists(opts.baseline):
+        with open(opts.baseline) as f:
+            baseline = json.load(f)
+
+    relative: dict[str, float] = {}
+    regressions = []
+    with tempfile.TemporaryDirectory() as workdir:
+        fixture = Fixture(workdir)
+        unit = measure(calibration, fixture, opts.repeat)
+        print(f"calibration: {unit.best:.0f} ns/msg, median {unit.median:.0f}, stdev {unit.stdev:.1f}%")
+        print(f"{'case':<30} {'ns/msg':>10} {'median':>10} {'stdev':>7} {'relative':>9} {'baseline':>9} {'delta':>8}")
+        for name in names:
+            result = measure(CASES[name], fixture, opts.repeat)
+            relative[name] = result.best / unit.best
+            line = f"{name:<30} {result.best:>10.0f} {result.median:>10.0f} {result.stdev:>6.1f}% {relative[name]:>9.2f}"
+            if name in baseline:
+                delta = (relative[name] - baseline[name]) / baseline[name] * 100
+                line += f" {baseline[name]:>9.2f} {delta:>+7.1f}%"
+                if opts.max_regression is not None and delta > opts.max_regression:
+                    regressions.append(name)
+                    line += " REGRESSION"
+            print(line)
+
+    if opts.save_baseline:
+        with open(opts.baseline, 'wt') as f:
+            json.dump(baseline | {name: round(cost, 3) for name, cost in relative.items()}, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"baseline is saved to {opts.baseline}")
+    if regressions:
+        print(f"slower than baseline by more than {opts.max_regression}%: {', '.join(regressions)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
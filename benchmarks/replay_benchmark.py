@@ -0,0 +1,42 @@
+"""
+End-to-end throughput benchmark: synthetic Wiren Board capture is replayed through App
+with local MQTT clients on every available event loop implementation.
+
+Usage: python benchmarks/replay_benchmark.py [--devices N] [--controls N] [--rounds N] [--loop asyncio|uvloop]
+"""
+import logging
+import optparse
+import os
+import sys
+import tempfile
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.common import generate_wb_input, run_app
+from ha_wb_discovery.event_loop import EventLoopType, available_loop_types
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("--devices", type=int, default=50, help="Number of synthetic devices")
+    parser.add_option("--controls", type=int, default=20, help="Number of controls per device")
+    parser.add_option("--rounds", type=int, default=10, help="Number of state updates per control")
+    parser.add_option("--loop", action="append", default=[], help="Event loop to benchmark, all available by default")
+    opts, _ = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    available = available_loop_types()
+    requested = [EventLoopType(l) for l in opts.loop] or list(EventLoopType)
+    loop_types = [t for t in requested if t in available]
+    skipped = [t.value for t in requested if t not in available]
+    if skipped:
+        print(f"not installed, skipped: {', '.join(skipped)}")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        wb_input_file = os.path.join(workdir, 'wb.input.txt')
+        messages = generate_wb_input(wb_input_file, opts.devices, opts.controls, opts.rounds)
+        print(f"{messages} messages, {opts.devices} devices x {opts.controls} controls, {opts.rounds} rounds")
+        for loop_type in loop_types:
+            elapsed = run_app(workdir, wb_input_file, loop_type)
+            print(f"{loop_type.value:>8}: {elapsed:.3f}s, {messages / elapsed:,.0f} msg/s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Memory soak test: synthetic Wiren Board traffic is replayed through one long running App
+in phases of state updates with device churn (removed and new devices, unknown control types).
+After every phase memory allocated by Python is measured with tracemalloc.
+Fails with exit code 1, when memory grows after warmup phases more than budget.
+
+Usage: python benchmarks/soak_benchmark.py [--devices N] [--controls N] [--rounds N] [--phases N] [--churn N] [--budget-kb N]
+"""
+import asyncio
+import gc
+import json
+import logging
+import optparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.common import CONTROL_TYPES
+from ha_wb_discovery.app import App
+from ha_wb_discovery.config import config_schema_builder, general_config
+from ha_wb_discovery.homeassistant import HomeAssistantDiscoveryCustomizer
+from ha_wb_discovery.mqtt_conn.local_mqtt import LocalMQTTClient
+
+# Unknown type is included to check that unknown types are not accumulated
+_CONTROL_TYPES = CONTROL_TYPES + [('wb_soak_unknown', 'a', 'b')]
+
+def write_phase_input(path: str, device_ids: list[str], removed_ids: list[str], added_ids: list[str], controls: int, rounds: int) -> int:
+    """
+    Write one phase of synthetic capture: removal of devices, meta of new devices
+    and `rounds` state updates of every control. Returns number of written messages.
+    """
+    count = 0
+    with open(path, 'wt') as f:
+        def write(topic: str, payload: str):
+            nonlocal count
+            f.write(json.dumps({'topic': topic, 'payload': payload}) + '\n')
+            count += 1
+
+        for device_id in removed_ids:
+            # Wiren Board clears retained meta of deleted controls
+            for c in range(controls):
+                write(f'/devices/{device_id}/controls/Control {c}/meta/type', '')
+                write(f'/devices/{device_id}/controls/Control {c}', '')
+            write(f'/devices/{device_id}/meta/name', '')
+        for device_id in added_ids:
+            write(f'/devices/{device_id}/meta/name', f'Soak {device_id}')
+            for c in range(controls):
+                control_type, _, _ = _CONTROL_TYPES[c % len(_CONTROL_TYPES)]
+                write(f'/devices/{device_id}/controls/Control {c}/meta/type', control_type)
+                write(f'/devices/{device_id}/controls/Control {c}/meta/error', '')
+        for r in range(rounds):
+            for device_id in device_ids:
+                for c in range(controls):
+                    _, even, odd = _CONTROL_TYPES[c % len(_CONTROL_TYPES)]
+                    write(f'/devices/{device_id}/controls/Control {c}', odd if r % 2 else even)
+    return count
+
+async def soak(workdir: str, opts) -> bool:
+    options = {
+        "homeassistant": {'broker_host': 'localhost', 'config_first_publish_delay': 0},
+        "wirenboard": {'broker_host': 'localhost'},
+    }
+    cfg = config_schema_builder({})(options)
+    ha_input_file = os.path.join(workdir, 'ha.input.txt')
+    open(ha_input_file, 'wt').close()
+    phase_file = os.path.join(workdir, 'wb.input.txt')
+
+    device_ids = [f'wb-soak_{d}' for d in range(opts.devices)]
+    write_phase_input(phase_file, device_ids, [], device_ids, opts.controls, 1)
+
+    wb_mqtt_client = LocalMQTTClient(phase_file, os.devnull)
+    ha_mqtt_client = LocalMQTTClient(ha_input_file, os.devnull)
+    app = App(
+        cfg["homeassistant"],
+        cfg["wirenboard"],
+        ha_mqtt_client, wb_mqtt_client,
+        HomeAssistantDiscoveryCustomizer(),
+        general_config(cfg) | {'watchdog_interval': 0},
+    )
+    async def on_disconnect(a, b):
+        pass
+    wb_mqtt_client.on_disconnect = on_disconnect
+    ha_mqtt_client.on_disconnect = on_disconnect
+
+    ok = True
+
+    async def drive():
+        nonlocal ok
+        try:
+            ok = await run_phases(wb_mqtt_client, phase_file, device_ids, opts)
+        finally:
+            await app.stop()
+
+    # App.run returns only after stop, so phases are driven by separate task
+    asyncio.get_running_loop().create_task(drive())
+    await app.run()
+    return ok
+
+async def run_phases(wb_mqtt_client: LocalMQTTClient, phase_file: str, device_ids: list[str], opts) -> bool:
+    next_device = opts.devices
+    tracemalloc.start()
+    # Initial capture is replayed on connect
+    await asyncio.sleep(0.1)
+
+    baseline = None
+    baseline_size = 0
+    total_messages = 0
+    ok = True
+    started = time.perf_counter()
+    for phase in range(opts.phases):
+        removed_ids = device_ids[:opts.churn]
+        added_ids = [f'wb-soak_{next_device + i}' for i in range(len(removed_ids))]
+        next_device += len(added_ids)
+        device_ids = device_ids[len(removed_ids):] + added_ids
+        total_messages += write_phase_input(phase_file, device_ids, removed_ids, added_ids, opts.controls, opts.rounds)
+        await wb_mqtt_client.replay(phase_file)
+        # Let pending publish tasks complete
+        await asyncio.sleep(0.05)
+
+        gc.collect()
+        size, _ = tracemalloc.get_traced_memory()
+        if phase + 1 == opts.warmup:
+            baseline = tracemalloc.take_snapshot()
+            baseline_size = size
+        growth = size - baseline_size if baseline is not None else 0
+        print(f"phase {phase + 1:>4}: {total_messages:>10,} messages, {size / 1024:>8.0f} KiB traced, {growth / 1024:>+8.0f} KiB since warmup")
+        if baseline is not None and growth > opts.budget_kb * 1024:
+            print(f"memory grew by {growth / 1024:.0f} KiB, budget is {opts.budget_kb} KiB. Top allocations since warmup:")
+            for stat in tracemalloc.take_snapshot().compare_to(baseline, 'lineno')[:10]:
+                print(f"  {stat}")
+            ok = False
+            break
+
+    elapsed = time.perf_counter() - started
+    print(f"{total_messages:,} messages in {elapsed:.1f}s, {total_messages / elapsed:,.0f} msg/s")
+    tracemalloc.stop()
+    return ok
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("--devices", type=int, default=100, help="Number of synthetic devices")
+    parser.add_option("--controls", type=int, default=20, help="Number of controls per device")
+    parser.add_option("--rounds", type=int, default=10, help="Number of state updates per control in phase")
+    parser.add_option("--phases", type=int, default=50, help="Number of phases")
+    parser.add_option("--churn", type=int, default=10, help="Number of devices replaced with new ones in every phase")
+    parser.add_option("--warmup", type=int, default=3, help="Number of phases before memory baseline is taken")
+    parser.add_option("--budget-kb", type=int, default=512, help="Allowed memory growth after warmup in KiB")
+    opts, _ = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    with tempfile.TemporaryDirectory() as workdir:
+        ok = asyncio.run(soak(workdir, opts))
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -28,6 +28,9 @@ def write_schema(docs: TextIOWrapper):
                     line,
                     {
                         "Coerce(ConfigLogLevel)": "DEBUG | INFO | WARNING | WARN | ERROR | FATAL",
+                        "Coerce(EventLoopType)": "asyncio | uvloop",
+                        "Coerce(WirenControlType)": "str",
+                        "All(str, _id_rule)": "str",
                         "__invalid_qos_msg": '"Invalid QoS: must be 0, 1 or 2"',
                     },
                 )
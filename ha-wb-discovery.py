@@ -1,21 +1,64 @@
+import time
+started = time.perf_counter()
+
 import asyncio
 import json
 import optparse
 import logging
+import re
 import signal
-import yaml
+from typing import TYPE_CHECKING, Callable
 from voluptuous import MultipleInvalid
 
-from ha_wb_discovery.config import config_schema_builder, LOGLEVEL_MAPPER
+from ha_wb_discovery.config import config_schema_builder, general_config, wirenboard_configs, LOGLEVEL_MAPPER
+from ha_wb_discovery.event_loop import new_event_loop
 from ha_wb_discovery.homeassistant import HomeAssistantDiscoveryCustomizer
 from gmqtt.client import Client as MQTTClient
-from ha_wb_discovery.app import App
+from ha_wb_discovery.app import App, MQTTClientType
+from ha_wb_discovery.mqtt_conn.inflight import InflightStorage
+from ha_wb_discovery.startup import StartupTimer
+
+if TYPE_CHECKING:
+    from ha_wb_discovery.sharding import ShardedApp
+
+imports_done = time.perf_counter()
 
 logging.getLogger().setLevel(logging.INFO)  # root
 
 logger = logging.getLogger(__name__)
 
-def main(cfg):
+class ConfigError(Exception):
+    pass
+
+def load_config(config_file: str, program_args: dict) -> dict:
+    try:
+        with open(config_file) as f:
+            config_file_content = f.read()
+    except OSError as e:
+        raise ConfigError(f'Could not open config file "{config_file}: {e}"')
+
+    config = None
+    if config_file.endswith(".json"):
+        config = json.loads(config_file_content)
+    elif config_file.endswith(".yaml") or config_file.endswith(".yml"):
+        # yaml is slow to import on controllers, add-on itself uses json config
+        import yaml
+        try:
+            config = yaml.load(config_file_content, Loader=yaml.FullLoader)
+        except yaml.YAMLError as e:
+            # Raised as ConfigError, so yaml is not imported by callers, e.g. by SIGHUP reload handler
+            raise ConfigError(f'Invalid YAML in config file "{config_file}": {e}')
+    else:
+        raise ConfigError(f'Unsupported config file extension: "{config_file}"')
+    if not config:
+        raise ConfigError(f'Empty config "{config_file}"')
+
+    try:
+        return config_schema_builder(program_args)(config)
+    except MultipleInvalid as e:
+        raise ConfigError(f"Config validation error: {e}")
+
+def setup_logging(cfg):
     logging.basicConfig(
         level=LOGLEVEL_MAPPER[cfg["general.loglevel"]],
         format="%(asctime)s %(levelname)s [%(name)s] %(message)s",
@@ -23,38 +66,54 @@ def main(cfg):
     )
     logging.getLogger("gmqtt").setLevel(LOGLEVEL_MAPPER[cfg["mqtt.loglevel"]])
 
+def main(cfg, reload_config: Callable[[], dict], startup: StartupTimer):
     wb_cfg = cfg["wirenboard"]
     ha_cfg = cfg["homeassistant"] if "homeassistant" in cfg else {}
+    general_cfg = general_config(cfg)
 
     logger.info("Starting")
-    wb_mqtt_client = MQTTClient(client_id=wb_cfg["mqtt_client_id"])
-    if wb_cfg.get('username') and wb_cfg.get('password'):
-        wb_mqtt_client.set_auth_credentials(
-            wb_cfg["username"],
-            wb_cfg["password"]
-        )
-    ha_mqtt_client = MQTTClient(client_id=ha_cfg["mqtt_client_id"])
+    loop = new_event_loop(cfg["general.event_loop"])
+    asyncio.set_event_loop(loop)
+
+    wb_mqtt_clients: list[MQTTClientType] = []
+    for wb_controller_cfg in wirenboard_configs(wb_cfg):
+        wb_mqtt_client = MQTTClient(client_id=wb_controller_cfg["mqtt_client_id"])
+        if wb_controller_cfg.get('username') and wb_controller_cfg.get('password'):
+            wb_mqtt_client.set_auth_credentials(
+                wb_controller_cfg["username"],
+                wb_controller_cfg["password"]
+            )
+        wb_mqtt_clients.append(wb_mqtt_client)
+    # Storage tracks messages in flight for `homeassistant.max_inflight` and ack latency metrics
+    ha_mqtt_client = MQTTClient(client_id=ha_cfg["mqtt_client_id"], persistent_storage=InflightStorage('homeassistant'))
     if ha_cfg.get("username") and ha_cfg.get("password"):
         ha_mqtt_client.set_auth_credentials(
             ha_cfg["username"],
             ha_cfg["password"]
         )
-    ha_customizer = HomeAssistantDiscoveryCustomizer(
-        splitted_device_ids=cfg["homeassistant.splitted_device_ids"],
-        combined_devices=cfg["homeassistant.combined_devices"],
-        ignored_device_ids=cfg["homeassistant.ignored_device_ids"],
-        ignored_device_control_ids=cfg["homeassistant.ignored_device_control_ids"],
-        enable_default_combined_devices=cfg["homeassistant.enable_default_combined_devices"],
-    )
-    app = App(ha_cfg, wb_cfg, ha_mqtt_client, wb_mqtt_client, ha_customizer)
-
-    loop = asyncio.get_event_loop()
+    app: 'App | ShardedApp'
+    if general_cfg["workers"] > 1:
+        from ha_wb_discovery.sharding import ShardedApp
+        app = ShardedApp(cfg, ha_mqtt_client, wb_mqtt_clients)
+    else:
+        ha_customizer = HomeAssistantDiscoveryCustomizer.from_config(cfg)
+        app = App(ha_cfg, wb_cfg, ha_mqtt_client, wb_mqtt_clients, ha_customizer, general_cfg, startup)
 
     def stop_app():
         loop.create_task(app.stop())
 
+    def reload_customizer():
+        # Only customization rules are applied, other options require restart
+        try:
+            customizer = HomeAssistantDiscoveryCustomizer.from_config(reload_config())
+        except (ConfigError, ValueError, re.error) as e:
+            logger.error(f"Config is not reloaded: {e}")
+            return
+        app.reload_customizer(customizer)
+
     loop.add_signal_handler(signal.SIGINT, stop_app)
     loop.add_signal_handler(signal.SIGTERM, stop_app)
+    loop.add_signal_handler(signal.SIGHUP, reload_customizer)
 
     loop.run_until_complete(app.run())
 
@@ -74,28 +133,15 @@ if __name__ == "__main__":
         exit(1)
 
     try:
-        with open(config_file) as f:
-            config_file_content = f.read()
-    except OSError as e:
-        logger.error(f'Could not open config file "{config_file}: {e}"')
+        config = load_config(config_file, vars(opts))
+    except ConfigError as e:
+        logger.error(str(e))
         exit(1)
 
-    config = None
-    if config_file.endswith(".json"):
-        config = json.loads(config_file_content)
-    elif config_file.endswith(".yaml") or config_file.endswith(".yml"):
-        config = yaml.load(config_file_content, Loader=yaml.FullLoader)
-    else:
-        logger.error(f'Unsupported config file extension: "{config_file}"')
-        exit(1)
-    if not config:
-        logger.error(f'Empty config "{config_file}"')
-        exit(1)
-
-    try:
-        config = config_schema_builder(vars(opts))(config)
-    except MultipleInvalid as e:
-        logger.error(f"Config validation error: {e}")
-        exit(1)
+    config_done = time.perf_counter()
 
-    main(config)
\ No newline at end of file
+    setup_logging(config)
+    startup = StartupTimer(started)
+    startup.mark('imports', imports_done)
+    startup.mark('config validation', config_done)
+    main(config, lambda: load_config(config_file, vars(opts)), startup)
@@ -0,0 +1,178 @@
+import logging
+from enum import Enum
+
+from ha_wb_discovery.control_rules import ControlRules
+from ha_wb_discovery.homeassistant import format_entity_id
+from ha_wb_discovery.mappers import WirenControlType
+from ha_wb_discovery.metrics import metrics, Counter, MetricsRegistry
+from ha_wb_discovery.timer_wheel import TimerWheel
+from ha_wb_discovery.wirenboard import IHomeAssistant
+from ha_wb_discovery.wirenboard_registry import WirenControl, WirenDevice
+
+logger = logging.getLogger(__name__)
+
+class AggregationFunction(Enum):
+    mean = "mean"
+    min = "min"
+    max = "max"
+    last = "last"
+
+class AggregationRule:
+    """Controls of type or with entity ID matching pattern are published once per window."""
+    control_type: WirenControlType | None
+    entity_id: str | None
+    window: float
+    function: AggregationFunction
+
+    def __init__(self, window: float, function: AggregationFunction = AggregationFunction.mean,
+                 control_type: WirenControlType | None = None, entity_id: str | None = None):
+        self.window = window
+        self.function = function
+        self.control_type = control_type
+        self.entity_id = entity_id
+
+    @classmethod
+    def from_config(cls, cfg: dict) -> 'AggregationRule':
+        return cls(
+            cfg['window'],
+            AggregationFunction(cfg.get('function', 'mean')),
+            cfg.get('control_type'),
+            cfg.get('entity_id'),
+        )
+
+class _Window:
+    __slots__ = ('device', 'control', 'function', 'count', 'total', 'min', 'max', 'min_state', 'max_state', 'last_state')
+
+    device: WirenDevice
+    control: WirenControl
+    function: AggregationFunction
+    count: int
+    total: float
+    min: float
+    max: float
+    # Original payloads are published for min, max and last
+    min_state: bytes
+    max_state: bytes
+    last_state: bytes
+
+    def __init__(self, device: WirenDevice, control: WirenControl, function: AggregationFunction):
+        self.device = device
+        self.control = control
+        self.function = function
+        self.count = 0
+        self.total = 0
+
+    def add(self, value: float, state: bytes):
+        if self.count == 0 or value < self.min:
+            self.min, self.min_state = value, state
+        if self.count == 0 or value > self.max:
+            self.max, self.max_state = value, state
+        self.count += 1
+        self.total += value
+        self.last_state = state
+
+    def result(self) -> bytes:
+        if self.function == AggregationFunction.mean:
+            # Shortest representation, which keeps precision of value
+            return repr(self.total / self.count).removesuffix('.0').encode('utf-8')
+        if self.function == AggregationFunction.min:
+            return self.min_state
+        if self.function == AggregationFunction.max:
+            return self.max_state
+        return self.last_state
+
+class Aggregator:
+    """
+    Stage between Wiren Board and Home Assistant, which publishes one aggregated state per window
+    for controls matched by rules, instead of every sample. Other calls are passed to Home Assistant as is.
+    Windows of all entities are closed by one timer wheel.
+    Non-numeric states of matched controls are published immediately.
+    Last published state of matched controls is passed to `HomeAssistant.state_of`, so configs are published
+    with aggregated state, not with current sample.
+    """
+    _hass: IHomeAssistant
+    _rules: ControlRules[AggregationRule]
+    # entity ID -> open window
+    _windows: dict[str, _Window]
+    # entity ID -> last published state of matched control
+    _last_states: dict[str, bytes]
+    _wheel: TimerWheel[str]
+    _samples: Counter
+    _publishes: Counter
+
+    def __init__(self, hass: IHomeAssistant, rules: list[AggregationRule], tick: float = 0.1, registry: MetricsRegistry = metrics):
+        self._hass = hass
+        self._rules = ControlRules(rules)
+        self._windows = {}
+        self._last_states = {}
+        self._wheel = TimerWheel(self._close_window, tick)
+        self._samples = registry.counter('aggregation_samples')
+        self._publishes = registry.counter('aggregation_publishes')
+
+    def publish_control_state(self, device: WirenDevice, control: WirenControl, state: bytes | None = None):
+        entity_id = format_entity_id(device.device_id, control.id)
+        rule = self._rules.find(entity_id, control)
+        if state is None:
+            state = control.state
+        if rule is None or state is None:
+            self._hass.publish_control_state(device, control, state)
+            return
+        try:
+            # float parses ASCII payload without decoding
+            value = float(state)
+        except ValueError:
+            self._close_window(entity_id)
+            self._last_states[entity_id] = state
+            self._hass.publish_control_state(device, control, state)
+            return
+        self._samples.inc()
+        window = self._windows.get(entity_id)
+        if window is None:
+            window = self._windows[entity_id] = _Window(device, control, rule.function)
+            self._wheel.schedule(entity_id, rule.window)
+        window.add(value, state)
+
+    def _close_window(self, entity_id: str):
+        self._wheel.cancel(entity_id)
+        window = self._windows.pop(entity_id, None)
+        if window is None:
+            return
+        self._publishes.inc()
+        state = self._last_states[entity_id] = window.result()
+        self._hass.publish_control_state(window.device, window.control, state)
+
+    def state_of(self, device: WirenDevice, control: WirenControl) -> bytes | None:
+        """Last aggregated state of control, current state until first window is closed or for control without rule."""
+        state = self._last_states.get(format_entity_id(device.device_id, control.id))
+        return state if state is not None else control.state
+
+    def flush(self):
+        """Publish all open windows, e.g. before stop."""
+        for entity_id in list(self._windows):
+            self._close_window(entity_id)
+        self._wheel.close()
+
+    def _forget(self, device: WirenDevice, control: WirenControl):
+        entity_id = format_entity_id(device.device_id, control.id)
+        self._wheel.cancel(entity_id)
+        self._windows.pop(entity_id, None)
+        self._last_states.pop(entity_id, None)
+        self._rules.forget(entity_id)
+
+    def publish_device_config(self, device: WirenDevice):
+        self._hass.publish_device_config(device)
+
+    def publish_control_config(self, device: WirenDevice, control: WirenControl):
+        self._hass.publish_control_config(device, control)
+
+    def publish_availability(self, device: WirenDevice, control: WirenControl):
+        self._hass.publish_availability(device, control)
+
+    def remove_control(self, device: WirenDevice, control: WirenControl):
+        self._forget(device, control)
+        self._hass.remove_control(device, control)
+
+    def remove_device(self, device: WirenDevice):
+        for control in device.controls.values():
+            self._forget(device, control)
+        self._hass.remove_device(device)
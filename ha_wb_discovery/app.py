@@ -1,45 +1,124 @@
 import asyncio
 import logging
-from typing import Union
+import time
+from typing import TYPE_CHECKING, Union
+from ha_wb_discovery.config import wirenboard_configs
+from ha_wb_discovery.flapping import FlapGuard
 from ha_wb_discovery.homeassistant import HomeAssistant, HomeAssistantDiscoveryCustomizer
-from ha_wb_discovery.mqtt_conn.local_mqtt import LocalMQTTClient
 from gmqtt import Client as MQTTClient
 from ha_wb_discovery.mqtt_conn.mqtt_client import MQTTRouter
-from ha_wb_discovery.wirenboard import Wirenboard
+from ha_wb_discovery.publish_policy import PublishPolicyRule
+from ha_wb_discovery.sampled_log import configure_sampling
+from ha_wb_discovery.startup import StartupTimer
+from ha_wb_discovery.watchdog import LoopWatchdog
+from ha_wb_discovery.wirenboard import IHomeAssistant, Wirenboard
 from ha_wb_discovery.wirenboard_registry import WirenBoardDeviceRegistry
 
+if TYPE_CHECKING:
+    # Test and sharded mode clients, debug endpoint and aggregation are not imported on regular startup
+    from ha_wb_discovery.aggregation import Aggregator
+    from ha_wb_discovery.debug_server import DebugServer
+    from ha_wb_discovery.mqtt_conn.local_mqtt import LocalMQTTClient
+    from ha_wb_discovery.mqtt_conn.shard_mqtt import ShardMQTTClient
+
 logger = logging.getLogger(__name__)
 
+MQTTClientType = Union['LocalMQTTClient', 'ShardMQTTClient', MQTTClient]
+
+def wirenboard_client_name(index: int, count: int) -> str:
+    return "wirenboard" if count == 1 else f"wirenboard_{index}"
+
+class WirenboardController:
+    """Connection to one Wiren Board controller."""
+    name: str
+    config: dict
+    mqtt_client: MQTTClientType
+    router: MQTTRouter
+    wb: Wirenboard
+
+    def __init__(self, name: str, config: dict, mqtt_client: MQTTClientType, router: MQTTRouter, wb: Wirenboard):
+        self.name = name
+        self.config = config
+        self.mqtt_client = mqtt_client
+        self.router = router
+        self.wb = wb
+
 class App:
     _ha_mqtt_router: MQTTRouter
-    _wb_mqtt_router: MQTTRouter
-    _ha_mqtt_client: Union[LocalMQTTClient, MQTTClient]
-    _wb_mqtt_client: Union[LocalMQTTClient, MQTTClient]
-    _wb: Wirenboard
+    _ha_mqtt_client: MQTTClientType
+    _controllers: list[WirenboardController]
+    _controllers_by_prefix: list[WirenboardController]
     _ha: HomeAssistant
     _ha_config: dict
-    _wb_config: dict
+    _general_config: dict
+    # None, when watchdog is disabled, so handlers and tasks are not wrapped
+    _watchdog: LoopWatchdog | None
+    _registry: WirenBoardDeviceRegistry
+    _stale_device_timeout: float
+    _stale_devices_task: asyncio.Task | None
+    _startup: StartupTimer
+    _startup_task: asyncio.Task | None
+    _bootstrap_task: asyncio.Task | None
+    _debug_server: 'DebugServer | None'
+    _aggregator: 'Aggregator | None'
+    _flap_guard: FlapGuard | None
+    # First stage of Home Assistant publishing pipeline, which is used by Wiren Board controllers
+    _hass: IHomeAssistant
+    # Pending connection attempts, stop can be called from one of them, e.g. by local client on replay end
+    _connect_tasks: list[asyncio.Task]
+    # Time in seconds to publish pending messages and disconnect on stop
+    _shutdown_timeout: float
+    _stopping: bool
     _stoper: asyncio.Event
 
     def __init__(self,
                 ha_config: dict,
-                wb_config: dict,
-                ha_mqtt_client: Union[LocalMQTTClient, MQTTClient],
-                wb_mqtt_client: Union[LocalMQTTClient, MQTTClient],
+                wb_config: dict | list[dict],
+                ha_mqtt_client: MQTTClientType,
+                wb_mqtt_client: MQTTClientType | list[MQTTClientType],
                 ha_customizer: HomeAssistantDiscoveryCustomizer,
+                general_config: dict | None = None,
+                startup: StartupTimer | None = None,
                 ):
+        """
+        Several Wiren Board controllers can be bridged by one App:
+        pass lists of configs and MQTT clients in same order.
+        """
         self._stoper = asyncio.Event()
+        self._startup = startup or StartupTimer()
+        self._startup_task = None
+        self._bootstrap_task = None
+        self._debug_server = None
+        self._connect_tasks = []
+        self._stopping = False
+        wb_configs = wirenboard_configs(wb_config)
+        wb_mqtt_clients = wb_mqtt_client if isinstance(wb_mqtt_client, list) else [wb_mqtt_client]
+        assert len(wb_configs) == len(wb_mqtt_clients)
         assert 'broker_host' in ha_config
         assert 'broker_port' in ha_config
-        assert 'broker_host' in wb_config
-        assert 'broker_port' in wb_config
+        for c in wb_configs:
+            assert 'broker_host' in c
+            assert 'broker_port' in c
         self._ha_config = ha_config
-        self._wb_config = wb_config
+        self._general_config = general_config or {}
+        configure_sampling(self._general_config.get('debug_log_sampling', {}))
+        self._watchdog = None
+        if self._general_config.get('watchdog_interval', 1) > 0:
+            self._watchdog = LoopWatchdog(
+                self._general_config.get('watchdog_interval', 1),
+                self._general_config.get('slow_callback_threshold', 0.1),
+            )
         self._ha_mqtt_client = ha_mqtt_client
-        self._wb_mqtt_client = wb_mqtt_client
-        self._ha_mqtt_router = MQTTRouter(self._ha_mqtt_client, 'homeassistant')
-        self._wb_mqtt_router = MQTTRouter(self._wb_mqtt_client, 'wirenboard')
+        self._ha_mqtt_router = MQTTRouter(
+            self._ha_mqtt_client, 'homeassistant', self._watchdog, ha_config.get('topic_alias_maximum', 0),
+            max_inflight=ha_config.get('max_inflight', 0),
+        )
+        self._stale_device_timeout = self._general_config.get('stale_device_timeout', 0)
+        self._stale_devices_task = None
+        self._shutdown_timeout = self._general_config.get('shutdown_timeout', 5)
+        # All controllers share one registry, devices are separated by device ID prefix
         device_registry = WirenBoardDeviceRegistry()
+        self._registry = device_registry
         self._ha = HomeAssistant(
             self._ha_mqtt_router,
             device_registry,
@@ -53,64 +132,204 @@ class App:
             ha_config.get('config_retain', True),
             ha_config.get('state_qos', 1),
             ha_config.get('state_retain', True),
+            self._watchdog,
+            ha_config.get('suppress_command_echo', False),
+            ha_config.get('bootstrap_timeout', 0) > 0,
+            publish_policy=[PublishPolicyRule.from_config(rule) for rule in ha_config.get('publish_policy', [])],
+            publish_quantum=ha_config.get('fair_scheduling', {}).get('quantum', 1),
+            publish_batch=ha_config.get('fair_scheduling', {}).get('batch', 100),
+            origin_name=ha_config.get('mqtt_client_id', 'ha-wb-discovery'),
         )
-        self._wb = Wirenboard(
-            self._wb_mqtt_router,
-            device_registry,
-            None, # setup later
-            wb_config.get('subscribe_qos', 1),
-            wb_config.get('publish_qos', 1),
-            wb_config.get('publish_retain', False),
-        )
-        self._wb.hass = self._ha
+        # States of Wiren Board controls pass through aggregation and flapping detection stages, when they are configured.
+        # Aggregated states are published once per window, so they do not look like flapping.
+        self._hass = self._ha
+        self._flap_guard = None
+        flapping = ha_config.get('flapping', {})
+        if flapping.get('rate', 10) > 0:
+            self._flap_guard = FlapGuard(self._hass, flapping.get('rate', 10), flapping.get('burst', 100), flapping.get('interval', 5))
+            self._hass = self._flap_guard
+        self._aggregator = None
+        if ha_config.get('aggregation'):
+            from ha_wb_discovery.aggregation import AggregationRule, Aggregator
+            self._aggregator = Aggregator(self._hass, [AggregationRule.from_config(rule) for rule in ha_config['aggregation']])
+            self._hass = self._aggregator
+            self._ha.state_of = self._aggregator.state_of
+        self._controllers = []
+        for i, (config, client) in enumerate(zip(wb_configs, wb_mqtt_clients)):
+            name = wirenboard_client_name(i, len(wb_configs))
+            router = MQTTRouter(client, name, self._watchdog, config.get('topic_alias_maximum', 0))
+            wb = Wirenboard(
+                router,
+                device_registry,
+                self._hass,
+                config.get('subscribe_qos', 1),
+                config.get('publish_qos', 1),
+                config.get('publish_retain', False),
+                config.get('device_id_prefix', ''),
+            )
+            client.on_connect = wb.on_connect
+            self._controllers.append(WirenboardController(name, config, client, router, wb))
         self._ha_mqtt_client.on_connect = self._ha.on_connect
-        self._wb_mqtt_client.on_connect = self._wb.on_connect
-        self._ha.on_control_set_state = self._wb.on_control_set_state
+        # Longest prefix first: controller without prefix matches any device
+        self._controllers_by_prefix = sorted(self._controllers, key=lambda c: len(c.wb.device_id_prefix), reverse=True)
+        if len(self._controllers) == 1:
+            self._ha.on_control_set_state = self._controllers[0].wb.on_control_set_state
+        else:
+            self._ha.on_control_set_state = self._on_control_set_state
 
-    async def run(self):
-        async with asyncio.TaskGroup() as tg:
-            tg.create_task(self._connect_mqtt(
-                name="wirenboard",
-                client=self._wb_mqtt_client,
-                host=self._wb_config['broker_host'],
-                port=self._wb_config['broker_port'],
-            ))
-            tg.create_task(self._connect_mqtt(
-                name="homeassistant",
-                client=self._ha_mqtt_client,
-                host=self._ha_config['broker_host'],
-                port=self._ha_config['broker_port'],
-            ))
-        await self._stoper.wait()
-        while True:
-            pending = asyncio.all_tasks()
-            pending.remove(asyncio.current_task())
-            if len(pending) == 0:
-                break
-            try:
-                await asyncio.gather(*pending)
-            except asyncio.CancelledError:
-                pass
+    def _find_controller(self, device_id: str) -> WirenboardController | None:
+        for controller in self._controllers_by_prefix:
+            if device_id.startswith(controller.wb.device_id_prefix):
+                return controller
+        return None
+
+    def _on_control_set_state(self, device_id: str, control_id: str, control_state: bytes):
+        controller = self._find_controller(device_id)
+        if controller is None:
+            logger.warning(f"no Wiren Board controller for device {device_id}")
+            return
+        controller.wb.on_control_set_state(device_id, control_id, control_state)
 
-    async def _connect_mqtt(self, name: str, client: Union[LocalMQTTClient, MQTTClient], host: str, port: int):
-        # infinite loop of reconnections
-        trynum = 0
+    def reload_customizer(self, customizer: HomeAssistantDiscoveryCustomizer):
+        self._ha.reload_customizer(customizer)
+
+    async def _remove_stale_devices(self):
+        # Device is removed between timeout and timeout + check interval after its last message
+        interval = min(self._stale_device_timeout, 60)
         while True:
-            try:
-                await client.connect(host, port)
-                logger.info(f"[{name}] connected to MQTT")
-                break
-            except ConnectionRefusedError as e:
-                # backoff
-                trynum = min(trynum + 6, 30)
-                logger.error(f"[{name}] error connecting to MQTT: {e}; next try in {trynum} seconds")
-                await asyncio.sleep(trynum)
-            except Exception as e:
-                logger.error(f"[{name}] MQTT: error connecting: {e}")
-                raise
+            await asyncio.sleep(interval)
+            for device in self._registry.stale_devices(time.monotonic() - self._stale_device_timeout):
+                logger.warning(f"[{device.debug_id}] no messages for {self._stale_device_timeout}s, removing device")
+                controller = self._find_controller(device.device_id)
+                if controller is not None:
+                    controller.wb.evict_device(device)
+                else:
+                    self._hass.remove_device(device)
+                    self._registry.remove_device(device.device_id)
+
+    def debug_state(self) -> dict:
+        from ha_wb_discovery.debug_server import lazy_list
+        return {
+            'devices_count': len(self._registry.devices()),
+            'devices': lazy_list(self._registry.devices().values(), lambda device: {
+                'device_id': device.device_id,
+                'controls_count': len(device.controls),
+                'last_seen_ago': round(time.monotonic() - device.last_seen, 3),
+                'controls': {
+                    control.id: {'type': control.type.value if control.type else None, 'error': control.error,
+                              'state': control.state.decode('utf-8', 'replace') if control.state is not None else None}
+                    for control in list(device.controls.values())
+                },
+            }),
+            'homeassistant': self._ha.debug_state(),
+        }
+
+    async def _start_debug_server(self):
+        endpoint = self._general_config.get('debug_endpoint', '')
+        if not endpoint:
+            return
+        from ha_wb_discovery.debug_server import DebugServer
+        self._debug_server = DebugServer(endpoint, self.debug_state)
+        await self._debug_server.start()
+
+    async def _finish_bootstrap(self):
+        # Retained messages of both brokers are received right after connect
+        await asyncio.sleep(self._ha_config['bootstrap_timeout'])
+        self._ha.finish_bootstrap()
+
+    async def _wait_first_config_published(self):
+        await self._ha.config_published.wait()
+        self._startup.mark('first discovery publish')
+
+    def _connect_all(self) -> list[asyncio.Task]:
+        loop = asyncio.get_running_loop()
+        clients = [(c.name, c.mqtt_client, c.config) for c in self._controllers]
+        clients.append(("homeassistant", self._ha_mqtt_client, self._ha_config))
+        return [
+            loop.create_task(connect_mqtt(name=name, client=client, host=config['broker_host'], port=config['broker_port']))
+            for name, client, config in clients
+        ]
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self._startup_task = loop.create_task(self._wait_first_config_published())
+        if self._watchdog is not None:
+            self._watchdog.start()
+        await self._start_debug_server()
+        if self._stale_device_timeout > 0:
+            self._stale_devices_task = loop.create_task(self._remove_stale_devices())
+        if self._stopping:
+            return
+        # Connection attempts are retried forever, so pending ones are cancelled by stop
+        self._connect_tasks = self._connect_all()
+        results = await asyncio.gather(*self._connect_tasks, return_exceptions=True)
+        self._connect_tasks = []
+        if not self._stopping:
+            for result in results:
+                if isinstance(result, BaseException):
+                    raise result
+            self._startup.mark('connect')
+            if self._ha_config.get('bootstrap_timeout', 0) > 0:
+                self._bootstrap_task = loop.create_task(self._finish_bootstrap())
+        await self._stoper.wait()
 
     async def stop(self):
+        """
+        Cancel pending delayed discovery, publish pending states and disconnect
+        within `general.shutdown_timeout`. Last states are published, when they can be delivered before deadline:
+        disconnect waits for acknowledgements of messages in flight and for ones above `homeassistant.max_inflight`.
+        """
+        if self._stopping:
+            return
+        self._stopping = True
         logger.info("Stopping app")
-        await self._wb_mqtt_client.disconnect()
-        await self._ha_mqtt_client.disconnect()
-        self._stoper.set()
\ No newline at end of file
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self._shutdown_timeout
+        if self._watchdog is not None:
+            self._watchdog.stop()
+        for task in self._connect_tasks:
+            # Task, which calls stop, must not be cancelled, otherwise stop is not completed
+            if task is not asyncio.current_task():
+                task.cancel()
+        if self._startup_task is not None:
+            self._startup_task.cancel()
+            self._startup_task = None
+        if self._bootstrap_task is not None:
+            self._bootstrap_task.cancel()
+            self._bootstrap_task = None
+        if self._stale_devices_task is not None:
+            self._stale_devices_task.cancel()
+            self._stale_devices_task = None
+        if self._debug_server is not None:
+            await self._debug_server.stop()
+            self._debug_server = None
+        if self._aggregator is not None:
+            # Last samples are published before disconnect
+            self._aggregator.flush()
+        if self._flap_guard is not None:
+            self._flap_guard.flush()
+        await self._ha.drain(max(deadline - loop.time(), 0))
+        for name, client in [(c.name, c.mqtt_client) for c in self._controllers] + [('homeassistant', self._ha_mqtt_client)]:
+            try:
+                await asyncio.wait_for(client.disconnect(), max(deadline - loop.time(), 0))
+            except TimeoutError:
+                logger.warning(f"[{name}] disconnect is not completed in {self._shutdown_timeout}s")
+        logger.info(f"App is stopped in {self._shutdown_timeout - (deadline - loop.time()):.3f}s")
+        self._stoper.set()
+
+async def connect_mqtt(name: str, client: MQTTClientType, host: str, port: int):
+    # infinite loop of reconnections
+    trynum = 0
+    while True:
+        try:
+            await client.connect(host, port)
+            logger.info(f"[{name}] connected to MQTT")
+            break
+        except ConnectionRefusedError as e:
+            # backoff
+            trynum = min(trynum + 6, 30)
+            logger.error(f"[{name}] error connecting to MQTT: {e}; next try in {trynum} seconds")
+            await asyncio.sleep(trynum)
+        except Exception as e:
+            logger.error(f"[{name}] MQTT: error connecting: {e}")
+            raise
@@ -1,6 +1,11 @@
 from enum import Enum
 import logging
-from voluptuous import Schema, Optional, Required, Coerce, Range
+import re
+from voluptuous import Schema, Optional, Required, Coerce, Range, All, Any, Invalid
+
+from ha_wb_discovery.event_loop import EventLoopType
+from ha_wb_discovery.id_matcher import id_pattern_regex, is_id_pattern
+from ha_wb_discovery.mappers import WirenControlType
 
 class ConfigLogLevel(Enum):
     FATAL = "FATAL"
@@ -21,34 +26,110 @@ LOGLEVEL_MAPPER = {
 
 __invalid_qos_msg = "Invalid QoS: must be 0, 1 or 2"
 
+def general_config(cfg: dict) -> dict:
+    """Extract `general.*` options from validated config without prefix."""
+    return {k.removeprefix("general."): v for k, v in cfg.items() if k.startswith("general.")}
+
+def wirenboard_configs(wb_config: dict | list[dict]) -> list[dict]:
+    """`wirenboard` option accepts one broker or list of brokers, returns list in both cases."""
+    return wb_config if isinstance(wb_config, list) else [wb_config]
+
+def _unique_device_id_prefixes(wb_configs: list[dict]) -> list[dict]:
+    prefixes = [c.get("device_id_prefix", "") for c in wb_configs]
+    if len(set(prefixes)) != len(prefixes):
+        raise Invalid("device_id_prefix must be unique for every Wiren Board controller")
+    return wb_configs
+
+def _id_rule(rule: str) -> str:
+    if is_id_pattern(rule):
+        try:
+            re.compile(id_pattern_regex(rule))
+        except re.error as e:
+            raise Invalid(f"invalid pattern {rule}: {e}")
+    return rule
+
+def _control_rule(rule: dict) -> dict:
+    if ("control_type" in rule) == ("entity_id" in rule):
+        raise Invalid("rule must have either control_type or entity_id")
+    return rule
+
 # config_schema_builder should be last function in this file because it used in docs_builder.py
 def config_schema_builder(program_args: dict) -> Schema:
+    # Wiren Board broker configuration
+    wirenboard_schema = {
+        # Wiren Board MQTT broker host
+        Required("broker_host"): str,
+        # Wiren Board MQTT broker port
+        Optional("broker_port", default=1883): int,
+        # Wiren Board MQTT broker username. Pass empty if mqtt without authentication.
+        Optional("username"): str,
+        # Wiren Board MQTT broker password. Pass empty if mqtt without authentication.
+        Optional("password"): str,
+        # MQTT client ID, required by MQTT protocol.
+        # By default used same client ID for both MQTT clients.
+        Required("mqtt_client_id", default="ha-wb-discovery"): str,
+        # Wiren Board MQTT subscribe QoS. For more details check MQTT spec.
+        Optional("subscribe_qos", default=1): Range(min=0, max=2, msg=__invalid_qos_msg),
+        # Wiren Board MQTT publish QoS. For more details check MQTT spec.
+        Optional("publish_qos", default=1): Range(min=0, max=2, msg=__invalid_qos_msg),
+        # Wiren Board MQTT publish retain flag. For more details check MQTT spec.
+        Optional("publish_retain", default=False): bool,
+        # Prefix for IDs of all devices of this controller, e.g. `kitchen_`.
+        # Required when several controllers are configured, because device IDs like `wb-gpio` are same on every controller.
+        # Prefixed device ID is used in Home Assistant entity IDs, topics and customization options.
+        Optional("device_id_prefix", default=""): str,
+        # Maximum number of MQTT 5 topic aliases for most published topics, actual number is limited by broker.
+        # Aliases are used only for QoS 0 messages. MQTT 3.1.1 brokers receive full topics. Set 0 to disable.
+        Optional("topic_alias_maximum", default=100): Range(min=0, max=65535),
+    }
     return Schema(
         {
             # Logger level for this addon
             Optional("general.loglevel", default=ConfigLogLevel.INFO): Coerce(ConfigLogLevel),
             # Logger level for both MQTT clients: Home Assistant and Wiren Board
             Optional("mqtt.loglevel", default=ConfigLogLevel.ERROR): Coerce(ConfigLogLevel),
-            # Wiren Board part configuration
-            Required("wirenboard"): {
-                # Wiren Board MQTT broker host
-                Required("broker_host"): str,
-                # Wiren Board MQTT broker port
-                Optional("broker_port", default=1883): int,
-                # Wiren Board MQTT broker username. Pass empty if mqtt without authentication.
-                Optional("username"): str,
-                # Wiren Board MQTT broker password. Pass empty if mqtt without authentication.
-                Optional("password"): str,
-                # MQTT client ID, required by MQTT protocol.
-                # By default used same client ID for both MQTT clients.
-                Required("mqtt_client_id", default="ha-wb-discovery"): str,
-                # Wiren Board MQTT subscribe QoS. For more details check MQTT spec.
-                Optional("subscribe_qos", default=1): Range(min=0, max=2, msg=__invalid_qos_msg),
-                # Wiren Board MQTT publish QoS. For more details check MQTT spec.
-                Optional("publish_qos", default=1): Range(min=0, max=2, msg=__invalid_qos_msg),
-                # Wiren Board MQTT publish retain flag. For more details check MQTT spec.
-                Optional("publish_retain", default=False): bool,
+            # Sample rate of per-message debug logs by subsystem: `mqtt` (received and published messages),
+            # `wirenboard` (Wiren Board meta messages), `homeassistant` (availability and state publishing).
+            # For example, `mqtt: 100` logs every 100th message with number of skipped ones. By default every message is logged.
+            # Makes `DEBUG` log level usable on busy installations.
+            Optional("general.debug_log_sampling", default={}): {
+                Optional("mqtt"): All(int, Range(min=1)),
+                Optional("wirenboard"): All(int, Range(min=1)),
+                Optional("homeassistant"): All(int, Range(min=1)),
             },
+            # Interval in seconds between event loop lag measurements. Set 0 to disable watchdog with slow callback reports,
+            # then handlers and tasks are not timed at all.
+            # Measured lag is reported to logs when it exceeds `general.slow_callback_threshold`.
+            Optional("general.watchdog_interval", default=1): Range(min=0),
+            # Threshold in seconds for MQTT message handlers and internal tasks.
+            # Handler which blocks event loop longer is reported to logs with its topic and name.
+            Optional("general.slow_callback_threshold", default=0.1): Range(min=0),
+            # Event loop implementation.
+            # `uvloop` is faster, but it is optional dependency: when it is not installed default `asyncio` loop is used.
+            Optional("general.event_loop", default=EventLoopType.asyncio): Coerce(EventLoopType),
+            # Number of worker processes. Devices are distributed between workers by device ID,
+            # MQTT connections are kept in main process. Value 1 disables sharding.
+            # Useful for installations with hundreds of devices on multicore hosts.
+            Optional("general.workers", default=1): All(int, Range(min=1)),
+            # Time in seconds without any message from Wiren Board device, after which device is considered removed:
+            # it is evicted from memory and its entities are removed from Home Assistant. Set 0 to disable.
+            # Set it well above the longest silence of any device, e.g. sensor, which reports on change only:
+            # entities of evicted device are missing in Home Assistant, until device sends message again and its meta is fetched,
+            # and Home Assistant may drop their customization, e.g. area or name, when they are removed.
+            # Controls, which are deleted on Wiren Board (empty retained `meta/type`), are removed regardless of this option.
+            Optional("general.stale_device_timeout", default=0): Range(min=0),
+            # Local endpoint with internal state for troubleshooting: `127.0.0.1:8099` for HTTP on TCP port
+            # or `unix:/run/ha-wb-discovery.sock` for unix socket. Empty value disables endpoint.
+            # `GET /state` returns devices, pending tasks and publishing state in JSON, `GET /metrics` returns metrics.
+            # Not available when `general.workers` is greater than 1.
+            Optional("general.debug_endpoint", default=""): str,
+            # Time in seconds to publish pending states and disconnect from brokers on stop, e.g. on add-on restart or update.
+            # Discovery configs, which wait for `config_first_publish_delay` or `config_publish_delay`, are published immediately with last states.
+            Optional("general.shutdown_timeout", default=5): Range(min=0),
+            # Wiren Board part configuration.
+            # List of brokers can be provided to bridge several controllers, each with unique `device_id_prefix`.
+            # Add-on options declare list with one broker by default, single mapping is accepted in standalone config files.
+            Required("wirenboard"): Any(wirenboard_schema, All([wirenboard_schema], _unique_device_id_prefixes)),
             # Home Assistant part configuration
             Required("homeassistant", default={}): {
                 # Home Assistant MQTT broker host.
@@ -67,6 +148,7 @@ def config_schema_builder(program_args: dict) -> Schema:
                 Optional("password", default = program_args.get("ha_mqtt_password", '')): str,
                 # MQTT client ID, required by MQTT protocol.
                 # By default used same client ID for both MQTT clients.
+                # It is also origin name of published discovery configs, so instances on same broker need different IDs.
                 Required("mqtt_client_id", default="ha-wb-discovery"): str,
                 # Delay in seconds before first config publish.
                 # Parameter is used when device discovered in first time after addon start.
@@ -101,17 +183,80 @@ def config_schema_builder(program_args: dict) -> Schema:
                 # For more details about retain flag check MQTT spec.
                 # For more details about state messages check Home Assistant documentation.
                 Optional("state_retain", default=True): bool,
+                # Maximum number of MQTT 5 topic aliases for most published topics, actual number is limited by broker.
+                # Aliases are used only for QoS 0 messages, so set `state_qos` to 0 to shrink state traffic.
+                # MQTT 3.1.1 brokers receive full topics. Set 0 to disable.
+                Optional("topic_alias_maximum", default=100): Range(min=0, max=65535),
+                # Do not publish Wiren Board state echo after command from Home Assistant, when state equals commanded one.
+                # Switches are announced as optimistic, so Home Assistant applies commanded state without waiting for echo.
+                # Echo with other state is always published. Halves state traffic when scenes switch many relays.
+                Optional("suppress_command_echo", default=False): bool,
+                # Time in seconds to collect retained discovery configs from Home Assistant broker after connect.
+                # Configs, which are already retained with same content, are not published again,
+                # retained configs of entities, which do not exist anymore, are removed. Only configs with origin name
+                # equal to `mqtt_client_id` are removed, configs of other instances and integrations are left untouched.
+                # Should be greater than `config_first_publish_delay`. Set 0 to disable and publish all configs on start.
+                Optional("bootstrap_timeout", default=0): Range(min=0),
+                # Publish one aggregated state per window instead of every sample, e.g. for fast polled power meters.
+                # Rule matches controls by Wiren Board `control_type` (e.g. `power`, `current`) or by `entity_id`,
+                # which can be pattern like in `homeassistant.ignored_device_control_ids`. First matching rule is used.
+                # `window` is in seconds, `function` is `mean`, `min`, `max` or `last`. Non-numeric states are not aggregated.
+                Optional("aggregation", default=[]): [All({
+                    Optional("control_type"): Coerce(WirenControlType),
+                    Optional("entity_id"): All(str, _id_rule),
+                    Required("window"): All(Coerce(float), Range(min=0.1)),
+                    Optional("function", default="mean"): Any("mean", "min", "max", "last"),
+                }, _control_rule)],
+                # QoS and retain flag of state and availability messages of some controls, overriding `state_qos`, `state_retain`,
+                # `availability_qos` and `availability_retain`, e.g. QoS 0 without retain for fast polled sensors and QoS 1 for switches.
+                # Rule matches controls by `control_type` or `entity_id` like in `aggregation`. First matching rule is used.
+                # Options, which are not set in rule, keep defaults.
+                Optional("publish_policy", default=[]): [All({
+                    Optional("control_type"): Coerce(WirenControlType),
+                    Optional("entity_id"): All(str, _id_rule),
+                    Optional("state_qos"): Range(min=0, max=2, msg=__invalid_qos_msg),
+                    Optional("state_retain"): bool,
+                    Optional("availability_qos"): Range(min=0, max=2, msg=__invalid_qos_msg),
+                    Optional("availability_retain"): bool,
+                }, _control_rule)],
+                # Detection of flapping entities, e.g. misbehaving device, which toggles error or state hundreds of times per second.
+                # Every entity may have `burst` state and availability updates at once and `rate` updates per second on average.
+                # Entity, which exceeds this, is throttled: its last state and availability are published once per `interval` seconds,
+                # until it has no more than `rate` updates per second during interval. Set `rate` to 0 to disable.
+                Optional("flapping", default={}): {
+                    Optional("rate", default=10): All(Coerce(float), Range(min=0)),
+                    Optional("burst", default=100): All(int, Range(min=1)),
+                    Optional("interval", default=5): All(Coerce(float), Range(min=0.1)),
+                },
+                # State and availability updates are published round robin by device, so chatty device, e.g. energy meter
+                # with dozens of fast polled controls, does not delay updates of quiet ones, e.g. door sensor.
+                # Every device may publish `quantum` updates per round, up to `batch` updates are published at once.
+                # Updates wait, while `max_inflight` messages are not acknowledged. Queue depth by device is reported in metrics.
+                Optional("fair_scheduling", default={}): {
+                    Optional("quantum", default=1): All(Coerce(float), Range(min=0.1)),
+                    Optional("batch", default=100): All(int, Range(min=1)),
+                },
+                # Maximum number of QoS 1 and 2 messages published to Home Assistant broker without acknowledgement,
+                # actual number is limited by broker. Other messages wait for acknowledgements in publish order,
+                # waiting message is replaced by newer one to same topic. Set 0 to disable.
+                # Number of messages in flight and acknowledgement latency are reported in metrics.
+                Optional("max_inflight", default=100): Range(min=0, max=65535),
             },
             # Home Assistant ignored devices configuration.
             #
             # Device ID should be provided in lower case with `-` replaced with `_`.
             # Device ID in Wiren Board MQTT `wb-mr3_16` should be provided as `wb_mr3_16`.
-            Optional("homeassistant.ignored_device_ids", default=[]): [str],
+            #
+            # All device and control IDs in customization options can be patterns:
+            # glob like `wb_mr6c_*` or regular expression with `re:` prefix like `re:wb_mr6c_\d+`.
+            # Pattern must match whole ID.
+            Optional("homeassistant.ignored_device_ids", default=[]): [All(str, _id_rule)],
             # Home Assistant ignored controls configuration.
             #
             # Device ID should be provided in lower case with `-` replaced with `_`.
             # Device ID in Wiren Board MQTT `wb-mr3_16` control `k1` should be provided as `wb_mr3_16_k1`.
-            Optional("homeassistant.ignored_device_control_ids", default=[]): [str],
+            # Use patterns to ignore groups of controls, e.g. `wb_mr6c_*_input_*_counter`.
+            Optional("homeassistant.ignored_device_control_ids", default=[]): [All(str, _id_rule)],
             # List of device ids in Wiren Board that should be splitted into multiple devices in Home Assistant.
             # After splitting each control in device will be registered as separate device in Home Assistant.
             #
@@ -122,7 +267,7 @@ def config_schema_builder(program_args: dict) -> Schema:
             # Device ID in Wiren Board MQTT `wb-mr3_16` should be provided as `wb_mr3_16`.
             #
             # This parameter can be used with combined devices.
-            Optional("homeassistant.splitted_device_ids", default=[]): [str],
+            Optional("homeassistant.splitted_device_ids", default=[]): [All(str, _id_rule)],
             # List of combined devices that should be combined to one in Home Assistant.
             # Also parameters can be used for remapping.
             #
@@ -134,10 +279,13 @@ def config_schema_builder(program_args: dict) -> Schema:
             #
             # This parameter can be used with splitted devices.
             # Use splitted device ID as device_id to map control to new device.
+            #
+            # When several rules match device, first one is used, whether its device_id is exact ID or pattern.
+            # Default combined devices go after configured ones.
             Optional("homeassistant.combined_devices", default=[]): [
                 {
-                    # Device ID in Wiren Board MQTT.
-                    Required("device_id"): str,
+                    # Device ID in Wiren Board MQTT or pattern.
+                    Required("device_id"): All(str, _id_rule),
                     # New device ID in Home Assistant.
                     Required("new_device_id"): str,
                     # New displayed device name in Home Assistant.
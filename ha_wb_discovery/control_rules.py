@@ -0,0 +1,45 @@
+from typing import Generic, Protocol, TypeVar
+
+from ha_wb_discovery.id_matcher import IdMatcher
+from ha_wb_discovery.mappers import WirenControlType
+from ha_wb_discovery.wirenboard_registry import WirenControl
+
+class ControlRule(Protocol):
+    control_type: WirenControlType | None
+    entity_id: str | None
+
+R = TypeVar('R', bound=ControlRule)
+
+class ControlRules(Generic[R]):
+    """
+    Rules, which match controls by Wiren Board control type or by entity ID, which can be pattern like in IdMatcher.
+    First matching rule is used. Match is cached per entity until control type changes.
+    """
+    _rules: list[R]
+    _entity_rules: IdMatcher
+    # entity ID -> (control type, matched rule)
+    _cache: dict[str, tuple[WirenControlType | None, R | None]]
+
+    def __init__(self, rules: list[R]):
+        self._rules = rules
+        self._entity_rules = IdMatcher(rule.entity_id for rule in rules if rule.entity_id)
+        self._cache = {}
+
+    def __bool__(self) -> bool:
+        return bool(self._rules)
+
+    def find(self, entity_id: str, control: WirenControl) -> R | None:
+        cached = self._cache.get(entity_id)
+        if cached is not None and cached[0] == control.type:
+            return cached[1]
+        matched_entity = self._entity_rules.find(entity_id)
+        rule = next((
+            r for r in self._rules
+            if (r.entity_id is not None and r.entity_id == matched_entity)
+            or (r.entity_id is None and r.control_type is not None and r.control_type == control.type)
+        ), None)
+        self._cache[entity_id] = (control.type, rule)
+        return rule
+
+    def forget(self, entity_id: str):
+        self._cache.pop(entity_id, None)
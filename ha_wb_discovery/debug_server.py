@@ -0,0 +1,104 @@
+import asyncio
+import json
+import logging
+import os
+from typing import Any, Callable, Iterable, Iterator
+
+from ha_wb_discovery.metrics import metrics, MetricsRegistry
+
+logger = logging.getLogger(__name__)
+
+# Number of JSON chunks written between yields to the event loop
+_CHUNKS_PER_YIELD = 1000
+
+def json_chunks(value: Any) -> Iterator[str]:
+    """
+    Serialize value to JSON piece by piece, so big dumps can be written without blocking the loop.
+    Besides JSON types, iterators and generators are serialized as arrays and consumed lazily.
+    """
+    if isinstance(value, dict):
+        yield '{'
+        for i, (k, v) in enumerate(value.items()):
+            yield (', ' if i else '') + json.dumps(str(k)) + ': '
+            yield from json_chunks(v)
+        yield '}'
+    elif isinstance(value, (list, tuple)) or isinstance(value, Iterator):
+        yield '['
+        for i, v in enumerate(value):
+            if i:
+                yield ', '
+            yield from json_chunks(v)
+        yield ']'
+    else:
+        yield json.dumps(value)
+
+class DebugServer:
+    """
+    Local HTTP endpoint with internal state in JSON:
+    `GET /state` for registry and publisher state, `GET /metrics` for metrics snapshot.
+    Listens on `host:port` or on unix socket with `unix:/path/to/socket` address.
+    """
+    _address: str
+    _state: Callable[[], dict]
+    _metrics: MetricsRegistry
+    _server: asyncio.Server | None
+
+    def __init__(self, address: str, state: Callable[[], dict], registry: MetricsRegistry = metrics):
+        self._address = address
+        self._state = state
+        self._metrics = registry
+        self._server = None
+
+    async def start(self):
+        if self._address.startswith('unix:'):
+            path = self._address.removeprefix('unix:')
+            if os.path.exists(path):
+                os.unlink(path)
+            self._server = await asyncio.start_unix_server(self._handle, path)
+        else:
+            host, _, port = self._address.rpartition(':')
+            self._server = await asyncio.start_server(self._handle, host or '127.0.0.1', int(port))
+        logger.warning(f"debug endpoint is listening on {self._address}")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            # Skip headers
+            while (await reader.readline()).strip():
+                pass
+            path = request_line[1] if len(request_line) > 1 else ''
+            if path == '/state':
+                await self._respond(writer, '200 OK', self._state())
+            elif path == '/metrics':
+                await self._respond(writer, '200 OK', self._metrics.snapshot())
+            else:
+                await self._respond(writer, '404 Not Found', {'paths': ['/state', '/metrics']})
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            logger.debug(f"debug endpoint client error: {e}")
+        finally:
+            writer.close()
+
+    async def _respond(self, writer: asyncio.StreamWriter, status: str, body: Any):
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\nConnection: close\r\n\r\n".encode())
+        buffer: list[str] = []
+        for chunk in json_chunks(body):
+            buffer.append(chunk)
+            if len(buffer) >= _CHUNKS_PER_YIELD:
+                writer.write(''.join(buffer).encode())
+                buffer.clear()
+                await writer.drain()
+                # Let other callbacks run while big state is serialized
+                await asyncio.sleep(0)
+        buffer.append('\n')
+        writer.write(''.join(buffer).encode())
+        await writer.drain()
+
+def lazy_list(items: Iterable, convert: Callable[[Any], Any]) -> Iterator:
+    """Iterator over snapshot of items, converted only when serialized."""
+    return (convert(item) for item in list(items))
@@ -0,0 +1,34 @@
+import asyncio
+import importlib.util
+import logging
+from enum import Enum
+
+logger = logging.getLogger(__name__)
+
+class EventLoopType(Enum):
+    asyncio = "asyncio"
+    uvloop = "uvloop"
+
+def is_uvloop_available() -> bool:
+    return importlib.util.find_spec("uvloop") is not None
+
+def available_loop_types() -> list[EventLoopType]:
+    result = [EventLoopType.asyncio]
+    if is_uvloop_available():
+        result.append(EventLoopType.uvloop)
+    return result
+
+def new_event_loop(loop_type: EventLoopType = EventLoopType.asyncio) -> asyncio.AbstractEventLoop:
+    """
+    Create new event loop of requested type.
+    uvloop is optional dependency, so default asyncio loop is used when it is not installed.
+    """
+    if loop_type == EventLoopType.uvloop:
+        try:
+            import uvloop  # type: ignore[import-not-found]
+        except ImportError:
+            logger.warning("uvloop is not installed, fallback to default asyncio event loop")
+        else:
+            logger.info("using uvloop event loop")
+            return uvloop.new_event_loop()
+    return asyncio.new_event_loop()
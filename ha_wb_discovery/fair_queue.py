@@ -0,0 +1,115 @@
+import time
+from collections import deque
+from typing import Generic, Hashable, TypeVar
+
+from ha_wb_discovery.metrics import metrics, Gauge, MetricsRegistry, Summary
+
+K = TypeVar('K', bound=Hashable)
+V = TypeVar('V')
+
+class _Flow(Generic[K, V]):
+    __slots__ = ('items', 'deficit', 'depth')
+
+    # key -> (value, time of first enqueue)
+    items: dict[K, tuple[V, float]]
+    deficit: float
+    depth: Gauge
+
+    def __init__(self, depth: Gauge):
+        self.items = {}
+        self.deficit = 0
+        self.depth = depth
+
+class FairQueue(Generic[K, V]):
+    """
+    Deficit round robin over flows, e.g. devices: every round each flow with queued items
+    may take `quantum` items, so one busy flow does not delay items of quiet ones.
+    Every item costs one: messages in flight are limited by count, not by size.
+    Item with key, which is already queued in flow, replaces its value and keeps its place,
+    like newer state of entity supersedes queued one.
+    """
+    _quantum: float
+    _flows: dict[str, _Flow[K, V]]
+    # Flows with queued items in round order, first one is served now
+    _active: deque[str]
+    _length: int
+    _metrics_registry: MetricsRegistry
+    _metric_name: str
+    _wait: Summary
+
+    def __init__(self, quantum: float = 1, metric_name: str = 'publish_queue', metrics_registry: MetricsRegistry = metrics):
+        assert quantum > 0
+        self._quantum = quantum
+        self._flows = {}
+        self._active = deque()
+        self._length = 0
+        self._metrics_registry = metrics_registry
+        self._metric_name = metric_name
+        self._wait = metrics_registry.summary(f'{metric_name}_wait')
+
+    def __len__(self) -> int:
+        return self._length
+
+    def depth(self, flow_id: str) -> int:
+        flow = self._flows.get(flow_id)
+        return len(flow.items) if flow is not None else 0
+
+    def put(self, flow_id: str, key: K, value: V):
+        flow = self._flows.get(flow_id)
+        if flow is None:
+            flow = self._flows[flow_id] = _Flow(self._metrics_registry.gauge(f'{self._metric_name}_depth', device=flow_id))
+        if not flow.items:
+            self._active.append(flow_id)
+        queued = flow.items.get(key)
+        if queued is not None:
+            flow.items[key] = (value, queued[1])
+            return
+        flow.items[key] = (value, time.monotonic())
+        self._length += 1
+        flow.depth.set(len(flow.items))
+
+    def pop(self) -> tuple[str, K, V] | None:
+        """Next item in round robin order, None when queue is empty."""
+        while self._active:
+            flow_id = self._active[0]
+            flow = self._flows[flow_id]
+            if flow.deficit < 1:
+                # Flow turn ends, next one starts with new quantum
+                flow.deficit += self._quantum
+                if flow.deficit < 1:
+                    self._active.rotate(-1)
+                    continue
+            key = next(iter(flow.items))
+            value, queued_at = flow.items.pop(key)
+            flow.deficit -= 1
+            self._length -= 1
+            flow.depth.set(len(flow.items))
+            self._wait.observe(time.monotonic() - queued_at)
+            if not flow.items:
+                # Idle flow does not save deficit for later bursts
+                flow.deficit = 0
+                self._active.popleft()
+            elif flow.deficit < 1:
+                self._active.rotate(-1)
+            return flow_id, key, value
+        return None
+
+    def discard(self, flow_id: str, key: K):
+        flow = self._flows.get(flow_id)
+        if flow is None or flow.items.pop(key, None) is None:
+            return
+        self._length -= 1
+        flow.depth.set(len(flow.items))
+        if not flow.items:
+            flow.deficit = 0
+            self._active.remove(flow_id)
+
+    def remove_flow(self, flow_id: str):
+        """Drop queued items and metrics of flow, e.g. of removed device."""
+        flow = self._flows.pop(flow_id, None)
+        if flow is None:
+            return
+        if flow.items:
+            self._length -= len(flow.items)
+            self._active.remove(flow_id)
+        self._metrics_registry.remove_gauge(f'{self._metric_name}_depth', device=flow_id)
@@ -0,0 +1,165 @@
+import logging
+import time
+
+from ha_wb_discovery.metrics import metrics, Counter, Gauge, MetricsRegistry
+from ha_wb_discovery.sampled_log import SampledLogger
+from ha_wb_discovery.timer_wheel import TimerWheel
+from ha_wb_discovery.wirenboard import IHomeAssistant
+from ha_wb_discovery.wirenboard_registry import WirenControl, WirenDevice
+
+logger = logging.getLogger(__name__)
+sampled_logger = SampledLogger(logger, 'homeassistant')
+
+# (device ID, control ID)
+_EntityKey = tuple[str, str]
+
+class _Bucket:
+    __slots__ = ('device', 'control', 'tokens', 'updated_at', 'throttled', 'updates', 'state', 'state_pending', 'availability_pending')
+
+    device: WirenDevice
+    control: WirenControl
+    tokens: float
+    updated_at: float
+    throttled: bool
+    # Updates since throttling interval start
+    updates: int
+    # Last state, which is held back while throttled
+    state: bytes | None
+    state_pending: bool
+    availability_pending: bool
+
+    def __init__(self, device: WirenDevice, control: WirenControl, tokens: float, now: float):
+        self.device = device
+        self.control = control
+        self.tokens = tokens
+        self.updated_at = now
+        self.throttled = False
+        self.updates = 0
+        self.state = None
+        self.state_pending = False
+        self.availability_pending = False
+
+class FlapGuard:
+    """
+    Stage between Wiren Board and Home Assistant, which detects flapping entities, e.g. misbehaving Modbus device,
+    which toggles `meta/error` or state hundreds of times per second.
+    State and availability updates of every entity are counted by token bucket: bucket of `burst` tokens
+    is refilled with `rate` tokens per second, every update takes one token.
+    Entity, which runs out of tokens, is throttled: its updates are held back and last state and availability
+    are published once per `interval`. Entity recovers, when it has no more than `rate` updates per second during interval.
+    Throttling and recovery are logged once. Other calls are passed to Home Assistant as is.
+    """
+    _hass: IHomeAssistant
+    _rate: float
+    _burst: float
+    _interval: float
+    _buckets: dict[_EntityKey, _Bucket]
+    _wheel: TimerWheel[_EntityKey]
+    _throttled: Gauge
+    _suppressed: Counter
+
+    def __init__(self, hass: IHomeAssistant, rate: float, burst: float, interval: float, tick: float = 0.1,
+                 registry: MetricsRegistry = metrics):
+        self._hass = hass
+        self._rate = rate
+        self._burst = burst
+        self._interval = interval
+        self._buckets = {}
+        self._wheel = TimerWheel(self._end_interval, tick)
+        self._throttled = registry.gauge('flapping_entities')
+        self._suppressed = registry.counter('flapping_suppressed_updates')
+
+    def _hold_back(self, device: WirenDevice, control: WirenControl) -> _Bucket | None:
+        """Takes token for update, returns bucket of throttled entity, when update should be held back."""
+        key = (device.device_id, control.id)
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket(device, control, self._burst, now)
+        if bucket.throttled:
+            bucket.updates += 1
+            self._suppressed.inc()
+            return bucket
+        bucket.tokens = min(self._burst, bucket.tokens + (now - bucket.updated_at) * self._rate)
+        bucket.updated_at = now
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            return None
+        logger.warning(f"[{device.debug_id}/{control.debug_id}] is flapping: more than {self._burst:g} updates "
+                       f"at {self._rate:g}/s, publishing it once per {self._interval:g}s")
+        bucket.throttled = True
+        bucket.updates = 1
+        self._suppressed.inc()
+        self._throttled.inc()
+        self._wheel.schedule(key, self._interval)
+        return bucket
+
+    def publish_control_state(self, device: WirenDevice, control: WirenControl, state: bytes | None = None):
+        bucket = self._hold_back(device, control)
+        if bucket is None:
+            self._hass.publish_control_state(device, control, state)
+            return
+        bucket.state = state
+        bucket.state_pending = True
+
+    def publish_availability(self, device: WirenDevice, control: WirenControl):
+        bucket = self._hold_back(device, control)
+        if bucket is None:
+            self._hass.publish_availability(device, control)
+            return
+        bucket.availability_pending = True
+
+    def _publish_held_back(self, bucket: _Bucket):
+        # Availability goes first, so Home Assistant does not drop state of unavailable entity
+        if bucket.availability_pending:
+            bucket.availability_pending = False
+            self._hass.publish_availability(bucket.device, bucket.control)
+        if bucket.state_pending:
+            bucket.state_pending = False
+            self._hass.publish_control_state(bucket.device, bucket.control, bucket.state)
+
+    def _end_interval(self, key: _EntityKey):
+        bucket = self._buckets.get(key)
+        if bucket is None or not bucket.throttled:
+            return
+        self._publish_held_back(bucket)
+        if bucket.updates > self._rate * self._interval:
+            sampled_logger.debug("[%s/%s] %s updates in %ss, still throttled",
+                                 bucket.device.debug_id, bucket.control.debug_id, bucket.updates, self._interval)
+            bucket.updates = 0
+            self._wheel.schedule(key, self._interval)
+            return
+        logger.warning(f"[{bucket.device.debug_id}/{bucket.control.debug_id}] is not flapping anymore")
+        bucket.throttled = False
+        bucket.tokens = self._burst
+        bucket.updated_at = time.monotonic()
+        self._throttled.dec()
+
+    def flush(self):
+        """Publish held back updates of throttled entities, e.g. before stop."""
+        for bucket in self._buckets.values():
+            if bucket.throttled:
+                self._publish_held_back(bucket)
+        self._wheel.close()
+
+    def _forget(self, device: WirenDevice, control: WirenControl):
+        key = (device.device_id, control.id)
+        self._wheel.cancel(key)
+        bucket = self._buckets.pop(key, None)
+        if bucket is not None and bucket.throttled:
+            self._throttled.dec()
+
+    def publish_device_config(self, device: WirenDevice):
+        self._hass.publish_device_config(device)
+
+    def publish_control_config(self, device: WirenDevice, control: WirenControl):
+        self._hass.publish_control_config(device, control)
+
+    def remove_control(self, device: WirenDevice, control: WirenControl):
+        self._forget(device, control)
+        self._hass.remove_control(device, control)
+
+    def remove_device(self, device: WirenDevice):
+        for control in device.controls.values():
+            self._forget(device, control)
+        self._hass.remove_device(device)
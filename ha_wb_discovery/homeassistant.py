@@ -1,15 +1,42 @@
 import asyncio
+import hashlib
 import json
 import logging
 import re
 import time
+from functools import partial
 from typing import Callable, Coroutine
 
 import ha_wb_discovery.mappers as mappers
+from ha_wb_discovery.fair_queue import FairQueue
+from ha_wb_discovery.id_matcher import IdMatcher
+from ha_wb_discovery.metrics import metrics, Counter, MetricsRegistry
 from ha_wb_discovery.mqtt_conn.mqtt_client import MQTTRouter
+from ha_wb_discovery.publish_policy import PublishPolicy, PublishPolicyRule
+from ha_wb_discovery.sampled_log import SampledLogger
+from ha_wb_discovery.watchdog import LoopWatchdog
+from ha_wb_discovery.wirenboard import COMMAND_ECHO_TIMEOUT
 from ha_wb_discovery.wirenboard_registry import WirenControl, WirenDevice, WirenBoardDeviceRegistry
 
 logger = logging.getLogger(__name__)
+sampled_logger = SampledLogger(logger, 'homeassistant')
+
+DISCOVERY_CONFIG_TOPIC = 'homeassistant/+/+/+/config'
+SUPPORT_URL = 'https://github.com/vetcher/ha-wb-discovery'
+
+def _own_config_marker(origin_name: str) -> bytes:
+    """Part of discovery config, which tells configs of this instance from ones of other instances and integrations."""
+    return b'"origin": {"name": ' + json.dumps(origin_name).encode('utf-8') + b','
+
+def _config_digest(payload: bytes) -> bytes:
+    return hashlib.blake2b(payload, digest_size=16).digest()
+
+def _current_state(device: WirenDevice, control: WirenControl) -> bytes | None:
+    return control.state
+
+# Kinds of queued publishes
+_STATE = 'state'
+_AVAILABILITY = 'availability'
 
 class CombinedDevice:
     device_id: str
@@ -35,9 +62,14 @@ _default_combined_devices: list[CombinedDevice] = [
 ]
 
 class HomeAssistantDiscoveryCustomizer:
-    _ignored_device_ids: set[str]
-    _ignored_device_control_ids: set[str]
-    _splitted_device_ids: set[str]
+    """
+    Customization rules. Every ID in rules can be a glob (`wb_mr6c_*_input_*_counter`)
+    or regular expression with `re:` prefix, see IdMatcher.
+    """
+    _ignored_device_ids: IdMatcher
+    _ignored_device_control_ids: IdMatcher
+    _splitted_device_ids: IdMatcher
+    _combined_device_ids: IdMatcher
     _combined_devices: dict[str, CombinedDevice]
 
     def __init__(self,
@@ -47,25 +79,39 @@ class HomeAssistantDiscoveryCustomizer:
                  combined_devices: list[dict] = [],
                  enable_default_combined_devices: bool = True,
         ):
-        self._ignored_device_ids = set(ignored_device_ids)
-        self._ignored_device_control_ids = set(ignored_device_control_ids)
-        self._splitted_device_ids = set(splitted_device_ids)
+        self._ignored_device_ids = IdMatcher(ignored_device_ids)
+        self._ignored_device_control_ids = IdMatcher(ignored_device_control_ids)
+        self._splitted_device_ids = IdMatcher(splitted_device_ids)
         self._combined_devices = {e['device_id']: CombinedDevice(**e) for e in combined_devices}
         if enable_default_combined_devices:
-            self._combined_devices.update({e.device_id: e for e in _default_combined_devices})
+            # Default rules go after configured ones, so configured rule for same device wins
+            for e in _default_combined_devices:
+                self._combined_devices.setdefault(e.device_id, e)
+        self._combined_device_ids = IdMatcher(self._combined_devices.keys())
+
+    @classmethod
+    def from_config(cls, cfg: dict) -> 'HomeAssistantDiscoveryCustomizer':
+        return cls(
+            splitted_device_ids=cfg.get("homeassistant.splitted_device_ids", []),
+            combined_devices=cfg.get("homeassistant.combined_devices", []),
+            ignored_device_ids=cfg.get("homeassistant.ignored_device_ids", []),
+            ignored_device_control_ids=cfg.get("homeassistant.ignored_device_control_ids", []),
+            enable_default_combined_devices=cfg.get("homeassistant.enable_default_combined_devices", True),
+        )
 
     def is_ignored_device(self, device_id: str) -> bool:
-        return device_id in self._ignored_device_ids
+        return self._ignored_device_ids.find(device_id) is not None
 
     # Используем entity_id, а не device_id + control_id, потому что в вызывающем коде идентификатор уже прошел преобразование.
     def is_ignored_control(self, entity_id: str) -> bool:
-        return entity_id in self._ignored_device_control_ids
+        return self._ignored_device_control_ids.find(entity_id) is not None
 
     def is_splitted_device(self, device_id: str) -> bool:
-        return device_id in self._splitted_device_ids
+        return self._splitted_device_ids.find(device_id) is not None
 
     def get_combined_device_id(self, device_id: str) -> CombinedDevice | None:
-        return self._combined_devices.get(device_id)
+        rule = self._combined_device_ids.find(device_id)
+        return self._combined_devices[rule] if rule is not None else None
 
 class HomeAssistant:
     # components
@@ -73,26 +119,51 @@ class HomeAssistant:
     _registry: WirenBoardDeviceRegistry
     _ha_customizer: HomeAssistantDiscoveryCustomizer
     _async_tasks: dict[str, asyncio.Task]
+    _watchdog: LoopWatchdog | None
 
     # internal states
     _ratelimiter: dict[str, float]
     _ratelimit_intervals: dict[str, int]
     _first_published_configs: dict[str, bool]
+    # entity unique id -> (topic, payload) of last published discovery config
+    _published_configs: dict[str, tuple[str, str]]
+    # entity unique id -> (state, time) of last command, which is not echoed yet
+    _pending_echoes: dict[str, tuple[bytes, float]]
+    _suppressed_echoes: Counter
+    # discovery topic -> digest of config, which is retained on Home Assistant broker and was not published yet
+    _retained_configs: dict[str, bytes]
+    _bootstrapping: bool
+    # Discovery configs are tagged with origin, configs of other origins are left untouched
+    _origin: dict[str, str]
+    _own_config_marker: bytes
+    # Tasks, which wait for config publish delays, in order of waiting start
+    _delayed_tasks: dict[asyncio.Task, None]
+    # Tasks, which delays are cut short on shutdown
+    _drained_tasks: set[asyncio.Task]
+    # State and availability publishes by device ID, (kind, control ID) -> (device, control, state),
+    # so chatty device does not delay updates of quiet ones
+    _publish_queue: FairQueue[tuple[str, str], tuple[WirenDevice, WirenControl, bytes | None]]
+    # Maximum number of queued messages published in one event loop iteration
+    _publish_batch: int
+    _publish_scheduled: bool
 
     # configs
     _config_publish_delay: int
     _config_first_publish_delay: int
     _subscribe_qos: int
-    _availability_qos: int
-    _availability_retain: bool
     _config_qos: int
     _config_retain: bool
-    _state_qos: int
-    _state_retain: bool
+    # QoS and retain flag of state and availability messages
+    _publish_policy: PublishPolicy
+    _suppress_command_echo: bool
 
     _control_command_topic_re = re.compile(r"/devices/([^/]*)/controls/([^/]*)/on$")
 
-    on_control_set_state: Callable[[str, str, str], None]
+    on_control_set_state: Callable[[str, str, bytes], None]
+    # State, which is published with config and on republish, e.g. last aggregated one instead of current
+    state_of: Callable[[WirenDevice, WirenControl], bytes | None]
+    # Set after first discovery config is published
+    config_published: asyncio.Event
 
     def __init__(self,
                  router: MQTTRouter,
@@ -107,6 +178,14 @@ class HomeAssistant:
                  config_retain: bool = True,
                  state_qos: int = 1,
                  state_retain: bool = True,
+                 watchdog: LoopWatchdog | None = None,
+                 suppress_command_echo: bool = False,
+                 bootstrap_retained_configs: bool = False,
+                 metrics_registry: MetricsRegistry = metrics,
+                 publish_policy: list[PublishPolicyRule] = [],
+                 publish_quantum: float = 1,
+                 publish_batch: int = 100,
+                 origin_name: str = 'ha-wb-discovery',
         ):
         self._router = router
         self._registry = registry
@@ -114,27 +193,58 @@ class HomeAssistant:
         self._config_first_publish_delay = config_first_publish_delay
         self._config_publish_delay = config_publish_delay
         self._subscribe_qos = subscribe_qos
-        self._availability_qos = availability_qos
-        self._availability_retain = availability_retain
         self._config_qos = config_qos
         self._config_retain = config_retain
-        self._state_qos = state_qos
-        self._state_retain = state_retain
+        self._publish_policy = PublishPolicy(state_qos, state_retain, availability_qos, availability_retain, publish_policy)
         self._async_tasks = {}
         self._ratelimiter = {}
         self._ratelimit_intervals = {}
         self._first_published_configs = {}
+        self._published_configs = {}
+        self._watchdog = watchdog
+        self._suppress_command_echo = suppress_command_echo
+        self._pending_echoes = {}
+        self._suppressed_echoes = metrics_registry.counter('command_echo_suppressed')
+        self._retained_configs = {}
+        self._bootstrapping = bootstrap_retained_configs
+        self._origin = {'name': origin_name, 'support_url': SUPPORT_URL}
+        self._own_config_marker = _own_config_marker(origin_name)
+        self._delayed_tasks = {}
+        self._drained_tasks = set()
+        self._publish_queue = FairQueue(publish_quantum, metrics_registry=metrics_registry)
+        self._publish_batch = publish_batch
+        self._publish_scheduled = False
+        self._router.on_ready(self._schedule_publish_queued)
+        self.state_of = _current_state
+        self.config_published = asyncio.Event()
 
     def _run_task(self, task_id: str, task: Coroutine):
         loop = asyncio.get_event_loop()
         if task_id in self._async_tasks:
             self._async_tasks[task_id].cancel()
-        self._async_tasks[task_id] = loop.create_task(task)
-
-    def on_connect(self, *args, **kwargs):
+        if self._watchdog is not None:
+            task = self._watchdog.wrap_task('homeassistant', task_id, task)
+        t = loop.create_task(task)
+        # Keep only pending tasks, so memory does not grow with number of published topics
+        t.add_done_callback(lambda t: self._forget_task(task_id, t))
+        self._async_tasks[task_id] = t
+
+    def _forget_task(self, task_id: str, task: asyncio.Task):
+        if self._async_tasks.get(task_id) is task:
+            del self._async_tasks[task_id]
+
+    def _cancel_task(self, task_id: str):
+        task = self._async_tasks.pop(task_id, None)
+        if task is not None:
+            task.cancel()
+
+    def on_connect(self, client=None, flags=None, rc=None, properties=None):
         logger.warning(f"connected to MQTT")
+        self._router.on_connect(properties)
         self._router.subscribe(f"hass/status", self._ha_status_topic_handler, qos=self._subscribe_qos)
         self._router.subscribe(f"/devices/+/controls/+/on", self._control_set_state_topic_handler, qos=self._subscribe_qos)
+        if self._bootstrapping:
+            self._router.subscribe(DISCOVERY_CONFIG_TOPIC, self._retained_config_handler, qos=self._subscribe_qos)
         self._publish_all_devices()
 
     def _publish_all_devices(self):
@@ -143,9 +253,61 @@ class HomeAssistant:
                 self.publish_device_config(device)
         self._run_task("publish_all_devices", do_publish_all_devices())
 
+    async def _wait_publish_delay(self, delay: float):
+        """Wait before discovery publish. Delay is cut short on shutdown: no more data is gathered at that point."""
+        if delay <= 0:
+            await asyncio.sleep(0)
+            return
+        task = asyncio.current_task()
+        assert task is not None
+        self._delayed_tasks[task] = None
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            if task not in self._drained_tasks:
+                raise
+            # Cancelled by drain, publish continues
+            task.uncancel()
+        finally:
+            self._delayed_tasks.pop(task, None)
+
+    async def drain(self, timeout: float):
+        """
+        Complete pending publishes before disconnect, but not longer than timeout.
+        Discovery, which waits for publish delays, is published immediately with last states.
+        QoS 1 and 2 messages, which wait for broker window, are sent and all of them are acknowledged.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        self._publish_all_queued()
+        # Pending publishes can start new ones, e.g. device config publishes configs of controls
+        while self._async_tasks:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                logger.warning(f"{len(self._async_tasks)} publishes are not completed in {timeout}s, cancelling")
+                for task in self._async_tasks.values():
+                    task.cancel()
+                break
+            pending = set(self._async_tasks.values())
+            # Delays are cut short last, so their publishes are not repeated by publishes, which replace them
+            if not pending - self._delayed_tasks.keys():
+                self._drained_tasks |= pending
+                # Publishes are made in same order as without shutdown
+                for task in list(self._delayed_tasks):
+                    task.cancel()
+            await asyncio.wait(pending - self._delayed_tasks.keys() or pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+        # Updates, which were received while waiting
+        self._publish_all_queued()
+        # Messages above window are sent, as acknowledgements are received
+        if self._router.unacknowledged():
+            try:
+                await asyncio.wait_for(self._router.wait_acknowledged(), max(deadline - loop.time(), 0))
+            except TimeoutError:
+                logger.warning(f"{self._router.unacknowledged()} messages are not acknowledged in {timeout}s")
+
     def publish_device_config(self, device: WirenDevice):
         async def do_publish_device_config():
-            await asyncio.sleep(self._config_publish_delay)
+            await self._wait_publish_delay(self._config_publish_delay)
             self._publish_device_config(device)
 
         self._run_task(f"{device.device_id}_device_config", do_publish_device_config())
@@ -159,13 +321,14 @@ class HomeAssistant:
             return
         if self._ha_customizer.is_ignored_control(format_entity_id(device.device_id, control.id)):
             return
+        entity_id = format_entity_id(device.device_id, control.id)
         async def do_publish_control_config():
-            if control.id not in self._first_published_configs:
+            if entity_id not in self._first_published_configs:
                 try:
                     # Wait for 1 second to ensure that all data is gathered from all wb topics
-                    await asyncio.sleep(self._config_first_publish_delay)
+                    await self._wait_publish_delay(self._config_first_publish_delay)
                     # Next time do not wait
-                    self._first_published_configs[control.id] = True
+                    self._first_published_configs[entity_id] = True
                 except asyncio.CancelledError:
                     return
             self._publish_control_config(device, control)
@@ -174,6 +337,33 @@ class HomeAssistant:
         self._run_task(f"{device.device_id}_{control.id}_config", do_publish_control_config())
 
     def _publish_control_config(self, device: WirenDevice, control: WirenControl):
+        config = self._build_control_config(device, control)
+        if config is None:
+            return
+        topic, payload = config
+        logger.info("publish config of %s to '%s'", control, topic)
+        self._published_configs[format_entity_id(device.device_id, control.id)] = config
+        if mappers.wiren_to_hass_type(control) in _command_hass_types:
+            # Commands of known entities skip topic matching and parsing
+            self._router.add_fast_route(
+                self._get_command_topic(device, control),
+                partial(self._control_command_handler, device.device_id, control.id),
+            )
+
+        digest = self._retained_configs.pop(topic, None)
+        if digest is not None and digest == _config_digest(payload.encode('utf-8')):
+            logger.info("config of %s is already retained on '%s'", control, topic)
+            self.config_published.set()
+            return
+
+        async def publish_config():
+            self._router.publish(topic, payload, qos=self._config_qos, retain=self._config_retain)
+            self.config_published.set()
+
+        self._run_task(f"publish_{topic}", publish_config())
+
+    def _build_control_config(self, device: WirenDevice, control: WirenControl) -> tuple[str, str] | None:
+        """Returns discovery topic and payload of control or None, if control is not exposed to Home Assistant."""
         # Итоговый идентификатор девайса, под которым девайс или контрол будет зарегистрирован в Home Assistant
         # Ниже эти параметры будут переопределены в соответствии с конфигом кастомизации
         device_unique_id = prepare_ha_identifier(device.device_id)
@@ -185,9 +375,9 @@ class HomeAssistant:
         object_id = prepare_ha_identifier(control.id)
 
         if self._ha_customizer.is_ignored_device(device_unique_id):
-            return
+            return None
         if self._ha_customizer.is_ignored_control(entity_unique_id):
-            return
+            return None
 
         if self._ha_customizer.is_splitted_device(device_unique_id):
             device_unique_id = entity_unique_id
@@ -222,25 +412,93 @@ class HomeAssistant:
         payload['availability_topic'] = self._get_availability_topic(device, control);
         payload['payload_available'] = "1"
         payload['payload_not_available'] = "0"
+        payload['origin'] = self._origin
 
         component = self._enrich_with_component(payload, device, control)
         if not component:
-            return
+            return None
 
         node_id = device_unique_id
 
         # https://www.home-assistant.io/integrations/mqtt/#discovery-messages
         topic = 'homeassistant' + '/' + component.value + '/' + node_id + '/' + object_id + '/config'
-        logger.info(f"publish config of {control} to '{topic}'")
+        return topic, json.dumps(payload)
 
-        async def publish_config():
-            self._router.publish(topic, json.dumps(payload), qos=self._config_qos, retain=self._config_retain)
-
-        self._run_task(f"publish_{topic}", publish_config())
+    def _retained_config_handler(self, topic: str, payload: bytes):
+        if not self._bootstrapping:
+            return
+        if self._own_config_marker in payload:
+            self._retained_configs[topic] = _config_digest(payload)
+        else:
+            self._retained_configs.pop(topic, None)
+
+    def finish_bootstrap(self):
+        """
+        Stop collecting retained discovery configs and remove retained configs of entities, which do not exist anymore.
+        Configs, which are equal to retained ones, are not published again.
+        Should be called after Wiren Board retained messages are received.
+        """
+        if not self._bootstrapping:
+            return
+        self._bootstrapping = False
+        self._router.unsubscribe(DISCOVERY_CONFIG_TOPIC)
+        expected_topics = set()
+        for device in self._registry.devices().values():
+            for control in device.controls.values():
+                config = self._build_control_config(device, control)
+                if config is not None:
+                    expected_topics.add(config[0])
+        orphaned_topics = [topic for topic in self._retained_configs if topic not in expected_topics]
+        for topic in orphaned_topics:
+            logger.info(f"remove orphaned config from '{topic}'")
+            self._router.publish(topic, '', qos=self._config_qos, retain=self._config_retain)
+            del self._retained_configs[topic]
+        logger.warning(f"bootstrap finished: {len(self._published_configs)} configs are up to date or published, {len(orphaned_topics)} orphaned removed")
+
+    def reload_customizer(self, customizer: HomeAssistantDiscoveryCustomizer):
+        """
+        Apply new customization rules without full republish.
+        Only changed configs are published. Entities, which became ignored or moved to another topic,
+        are removed from Home Assistant by empty retained config.
+        """
+        self._ha_customizer = customizer
+        old_configs = self._published_configs
+        self._published_configs = {}
+        changed: list[tuple[WirenDevice, WirenControl, tuple[str, str]]] = []
+        for device in self._registry.devices().values():
+            for control in device.controls.values():
+                entity_id = format_entity_id(device.device_id, control.id)
+                config = self._build_control_config(device, control)
+                if config is None:
+                    continue
+                if entity_id not in old_configs:
+                    # Was ignored before. Pending first publication will use new rules by itself.
+                    task = self._async_tasks.get(f"{device.device_id}_{control.id}_config")
+                    if task is None or task.done():
+                        self.publish_control_config(device, control)
+                    continue
+                self._published_configs[entity_id] = config
+                if config != old_configs[entity_id]:
+                    changed.append((device, control, config))
+
+        # Removals go first, so Home Assistant releases unique ids of moved entities
+        new_topics = {topic for topic, _ in self._published_configs.values()}
+        removed_topics = {topic for topic, _ in old_configs.values()} - new_topics
+        for topic in removed_topics:
+            self._router.publish(topic, '', qos=self._config_qos, retain=self._config_retain)
+        for device, control, (topic, payload) in changed:
+            self._router.publish(topic, payload, qos=self._config_qos, retain=self._config_retain)
+            if topic != old_configs[format_entity_id(device.device_id, control.id)][0]:
+                self._publish_availability_sync(device, control)
+                self._publish_control_state_sync(device, control)
+        logger.warning(f"customization rules reloaded: {len(changed)} configs changed, {len(removed_topics)} removed")
 
     def _get_control_topic(self, device: WirenDevice, control: WirenControl):
         return f"/devices/{device.device_id}/controls/{control.id}"
 
+    def _get_command_topic(self, device: WirenDevice, control: WirenControl):
+        return f"{self._get_control_topic(device, control)}/on"
+
     def _get_availability_topic(self, device: WirenDevice, control: WirenControl):
         return f"{self._get_control_topic(device, control)}/availability"
 
@@ -267,8 +525,11 @@ class HomeAssistant:
                 'state_on': _payload_on,
                 'state_off': _payload_off,
                 'state_topic': f"{control_topic}",
-                'command_topic': f"{control_topic}/on",
+                'command_topic': self._get_command_topic(device, control),
             })
+            if self._suppress_command_echo:
+                # Home Assistant shows commanded state at once, confirming echo is not published
+                payload['optimistic'] = True
         elif hass_entity_type == mappers.HassControlType.binary_sensor:
             payload.update({
                 'payload_on': _payload_on,
@@ -285,7 +546,7 @@ class HomeAssistant:
                 payload['unit_of_measurement'] = control.units
         elif hass_entity_type == mappers.HassControlType.button:
             payload.update({
-                'command_topic': f"{control_topic}/on",
+                'command_topic': self._get_command_topic(device, control),
             })
         else:
             logger.warning(f"No algorithm for hass type '{control.type.name}', hass: '{hass_entity_type}', {device}")
@@ -293,38 +554,144 @@ class HomeAssistant:
 
         return hass_entity_type
 
+    def remove_control(self, device: WirenDevice, control: WirenControl):
+        """Remove entity from Home Assistant and drop all state kept for it."""
+        entity_id = format_entity_id(device.device_id, control.id)
+        self._cancel_task(f"{device.device_id}_{control.id}_config")
+        self._publish_queue.discard(device.device_id, (_STATE, control.id))
+        self._publish_queue.discard(device.device_id, (_AVAILABILITY, control.id))
+        self._ratelimiter.pop(entity_id, None)
+        self._first_published_configs.pop(entity_id, None)
+        availability_qos, availability_retain = self._publish_policy.availability(entity_id, control)
+        self._publish_policy.forget(entity_id)
+        self._pending_echoes.pop(entity_id, None)
+        self._router.remove_fast_route(self._get_command_topic(device, control))
+        config = self._published_configs.pop(entity_id, None)
+        if config is None:
+            # Config was never published, so Home Assistant does not know the entity
+            return
+        topic, _ = config
+        self._cancel_task(f"publish_{topic}")
+        logger.info(f"remove config of {control} from '{topic}'")
+        self._router.publish(topic, '', qos=self._config_qos, retain=self._config_retain)
+        self._router.publish(self._get_availability_topic(device, control), '', qos=availability_qos, retain=availability_retain)
+
+    def remove_device(self, device: WirenDevice):
+        for control in device.controls.values():
+            self.remove_control(device, control)
+        self._cancel_task(f"{device.device_id}_device_config")
+        self._publish_queue.remove_flow(device.device_id)
+
+    def debug_state(self) -> dict:
+        """
+        Internal state for debug endpoint.
+        Collections are copied, so state can be serialized lazily while messages are being handled.
+        """
+        now = time.time()
+        devices = list(self._registry.devices().values())
+        def controls():
+            for device in devices:
+                for control in list(device.controls.values()):
+                    yield device, control, format_entity_id(device.device_id, control.id)
+        def waiting_first_publish():
+            for device, control, entity_id in controls():
+                if entity_id not in self._first_published_configs and f"{device.device_id}_{control.id}_config" in self._async_tasks:
+                    yield entity_id
+        def rate_limited():
+            for _, control, entity_id in controls():
+                if self._ratelimiter.get(entity_id, 0) + self._ratelimit_intervals.get(control.id, 0) > now:
+                    yield entity_id
+        return {
+            'pending_tasks': list(self._async_tasks),
+            'publish_queue': len(self._publish_queue),
+            'published_configs': len(self._published_configs),
+            'waiting_first_publish': waiting_first_publish(),
+            'rate_limited': rate_limited(),
+            'last_state_publish': dict(self._ratelimiter),
+        }
+
     def publish_availability(self, device: WirenDevice, control: WirenControl):
-        self._publish_availability_sync(device, control)
+        self._publish_queue.put(device.device_id, (_AVAILABILITY, control.id), (device, control, None))
+        self._schedule_publish_queued()
 
     def _publish_availability_sync(self, device: WirenDevice, control: WirenControl):
         if self._ha_customizer.is_ignored_device(prepare_ha_identifier(device.device_id)):
             return
-        if self._ha_customizer.is_ignored_control(format_entity_id(device.device_id, control.id)):
+        entity_id = format_entity_id(device.device_id, control.id)
+        if self._ha_customizer.is_ignored_control(entity_id):
             return
         topic = self._get_availability_topic(device, control)
         payload = '1' if not control.error else '0'
-        logger.info(f"[{device.debug_id}/{control.debug_id}] availability: {'online' if control.state else 'offline'}")
-        self._router.publish(topic, payload, qos=self._availability_qos, retain=self._availability_retain)
-
-    def publish_control_state(self, device: WirenDevice, control: WirenControl):
-        if self._ratelimiter.get(control.id, 0) + self._ratelimit_intervals.get(control.id, 0) > time.time():
+        sampled_logger.debug("[%s/%s] availability: %s", device.device_id, control.id, 'offline' if control.error else 'online')
+        qos, retain = self._publish_policy.availability(entity_id, control)
+        self._router.publish(topic, payload, qos=qos, retain=retain)
+
+    def publish_control_state(self, device: WirenDevice, control: WirenControl, state: bytes | None = None):
+        """Publish current state of control or given state instead, e.g. aggregated one."""
+        entity_id = format_entity_id(device.device_id, control.id)
+        if self._pending_echoes and self._is_command_echo(entity_id, state if state is not None else control.state):
+            self._suppressed_echoes.inc()
             return
-        self._run_task(f"publish_state_{control.id}", self._publish_control_state(device, control))
+        if self._ratelimiter.get(entity_id, 0) + self._ratelimit_intervals.get(control.id, 0) > time.time():
+            return
+        self._publish_queue.put(device.device_id, (_STATE, control.id), (device, control, state))
+        self._schedule_publish_queued()
+
+    def _schedule_publish_queued(self):
+        if self._publish_queue and not self._publish_scheduled:
+            self._publish_scheduled = True
+            asyncio.get_event_loop().call_soon(self._publish_queued)
+
+    def _publish_queued(self):
+        """
+        Publish queued updates round robin by device. Batch is limited, so updates received meanwhile
+        take their turn in next iteration, and publishing waits for acknowledgements, when broker window is full.
+        """
+        self._publish_scheduled = False
+        for _ in range(self._publish_batch):
+            if not self._router.ready():
+                # Continued by router, when acknowledgements are received
+                return
+            item = self._publish_queue.pop()
+            if item is None:
+                return
+            self._publish_queued_item(*item)
+        self._schedule_publish_queued()
+
+    def _publish_all_queued(self):
+        while (item := self._publish_queue.pop()) is not None:
+            self._publish_queued_item(*item)
+
+    def _publish_queued_item(self, device_id: str, key: tuple[str, str], item: tuple[WirenDevice, WirenControl, bytes | None]):
+        device, control, state = item
+        if key[0] == _STATE:
+            self._publish_control_state_sync(device, control, state)
+        else:
+            self._publish_availability_sync(device, control)
 
-    async def _publish_control_state(self, device: WirenDevice, control: WirenControl):
-        self._publish_control_state_sync(device, control)
+    def _is_command_echo(self, entity_id: str, state: bytes | None) -> bool:
+        """First published state after command is its echo. Echo with other state than commanded is not suppressed."""
+        pending = self._pending_echoes.pop(entity_id, None)
+        if pending is None:
+            return False
+        commanded, sent_at = pending
+        return state == commanded and time.monotonic() - sent_at < COMMAND_ECHO_TIMEOUT
 
-    def _publish_control_state_sync(self, device: WirenDevice, control: WirenControl):
+    def _publish_control_state_sync(self, device: WirenDevice, control: WirenControl, state: bytes | None = None):
         if self._ha_customizer.is_ignored_device(prepare_ha_identifier(device.device_id)):
             return
-        if self._ha_customizer.is_ignored_control(format_entity_id(device.device_id, control.id)):
+        entity_id = format_entity_id(device.device_id, control.id)
+        if self._ha_customizer.is_ignored_control(entity_id):
             return
         target_topic = self._get_control_topic(device, control)
-        if control.state is None:
-            logger.debug(f"[{control}] state is None, skip publishing")
+        if state is None:
+            state = self.state_of(device, control)
+        if state is None:
+            sampled_logger.debug("[%s] state is None, skip publishing", control)
             return
-        self._router.publish(target_topic, control.state, qos=self._state_qos, retain=self._state_retain)
-        self._ratelimiter[control.id] = time.time()
+        qos, retain = self._publish_policy.state(entity_id, control)
+        self._router.publish(target_topic, state, qos=qos, retain=retain)
+        self._ratelimiter[entity_id] = time.time()
 
     def _ha_status_topic_handler(self, topic: str, payload: bytes):
         if payload == b'online':
@@ -338,9 +705,20 @@ class HomeAssistant:
         if not match:
             logger.warning(f'not matched topic={topic} re={self._control_command_topic_re}')
             return
-        device_id, control_id, control_state = match.group(1), match.group(2), payload.decode('utf-8')
+        # Command payload is passed to Wiren Board as is
+        self._on_command(match.group(1), match.group(2), payload)
+
+    def _control_command_handler(self, device_id: str, control_id: str, topic: str, payload: bytes):
+        self._on_command(device_id, control_id, payload)
+
+    def _on_command(self, device_id: str, control_id: str, control_state: bytes):
+        if self._suppress_command_echo:
+            self._pending_echoes[format_entity_id(device_id, control_id)] = (control_state, time.monotonic())
         self.on_control_set_state(device_id, control_id, control_state)
 
+# Entity types, which have command topic
+_command_hass_types = (mappers.HassControlType.switch, mappers.HassControlType.button)
+
 def prepare_ha_identifier(name: str) -> str:
     return name.lower().replace(" ", "_").replace("-", "_")
 
@@ -0,0 +1,94 @@
+import fnmatch
+import re
+from typing import Iterable
+
+REGEX_PREFIX = 're:'
+
+def is_id_pattern(rule: str) -> bool:
+    return rule.startswith(REGEX_PREFIX) or any(c in rule for c in '*?[')
+
+def id_pattern_regex(rule: str) -> str:
+    """Regex source of rule: `re:` prefixed regular expression or glob like `wb_mr6c_*_k1`."""
+    if rule.startswith(REGEX_PREFIX):
+        return rule[len(REGEX_PREFIX):]
+    return fnmatch.translate(rule)
+
+def _is_combinable(regex: str) -> bool:
+    """
+    Pattern can be part of combined regular expression, when it has no groups,
+    which would clash with group names or shift numbered backreferences, and no global flags like `(?i)`,
+    which are allowed only at the start of expression.
+    """
+    try:
+        return re.compile(f'(?:{regex})').groups == 0
+    except re.error:
+        return False
+
+class IdMatcher:
+    """
+    Ordered set of IDs and ID patterns.
+    Exact IDs are looked up in dict. Patterns are compiled into single regular expression,
+    except ones with groups or global flags, which are matched one by one. Result for every checked ID is cached,
+    so number of patterns does not matter on hot path.
+    When several rules match, first one in rules order wins, whether it is exact ID or pattern.
+    """
+    # ID -> index of rule
+    _exact: dict[str, int]
+    _regex: re.Pattern | None
+    # group name in _regex -> (index, rule)
+    _rules: dict[str, tuple[int, str]]
+    # (index, rule, regex) of patterns, which are not combined
+    _separate: list[tuple[int, str, re.Pattern]]
+    # ID -> (index, rule) of first matching pattern
+    _cache: dict[str, tuple[int, str] | None]
+    _cache_limit: int
+
+    def __init__(self, rules: Iterable[str], cache_limit: int = 65536):
+        self._exact = {}
+        self._rules = {}
+        self._separate = []
+        self._cache = {}
+        self._cache_limit = cache_limit
+        groups = []
+        for index, rule in enumerate(rules):
+            if not is_id_pattern(rule):
+                self._exact.setdefault(rule, index)
+                continue
+            regex = id_pattern_regex(rule)
+            if not _is_combinable(regex):
+                self._separate.append((index, rule, re.compile(regex)))
+                continue
+            name = f'r{len(self._rules)}'
+            self._rules[name] = (index, rule)
+            groups.append(f'(?P<{name}>{regex})')
+        self._regex = re.compile('|'.join(groups)) if groups else None
+
+    def find(self, id: str) -> str | None:
+        """Returns first rule, which matches ID: ID itself or pattern."""
+        exact = self._exact.get(id)
+        if self._regex is None and not self._separate:
+            return id if exact is not None else None
+        if id in self._cache:
+            pattern = self._cache[id]
+        else:
+            pattern = self._find_pattern(id)
+            if len(self._cache) >= self._cache_limit:
+                self._cache.clear()
+            self._cache[id] = pattern
+        if pattern is not None and (exact is None or pattern[0] < exact):
+            return pattern[1]
+        return id if exact is not None else None
+
+    def _find_pattern(self, id: str) -> tuple[int, str] | None:
+        found = None
+        if self._regex is not None:
+            # Alternatives are tried in order, so match is the first combined pattern
+            match = self._regex.fullmatch(id)
+            if match is not None and match.lastgroup is not None:
+                found = self._rules[match.lastgroup]
+        for index, rule, regex in self._separate:
+            if found is not None and found[0] < index:
+                break
+            if regex.fullmatch(id):
+                return index, rule
+        return found
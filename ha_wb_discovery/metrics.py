@@ -0,0 +1,118 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Labels are stored as sorted tuple of (name, value) pairs, so they can be used as dict keys.
+_LabelsKey = tuple[tuple[str, str], ...]
+
+def _labels_key(labels: dict[str, str]) -> _LabelsKey:
+    return tuple(sorted(labels.items()))
+
+class Counter:
+    value: float
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, value: float = 1):
+        self.value += value
+
+class Gauge:
+    value: float
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, value: float = 1):
+        self.value += value
+
+    def dec(self, value: float = 1):
+        self.value -= value
+
+class Summary:
+    count: int
+    total: float
+    max: float
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    @property
+    def avg(self) -> float:
+        return self.total / self.count if self.count else 0
+
+class MetricsRegistry:
+    """
+    In-process metrics storage.
+    Metric objects are created on first access and cached, so hot paths should keep returned object
+    instead of looking it up for every message.
+    """
+    _counters: dict[str, dict[_LabelsKey, Counter]]
+    _gauges: dict[str, dict[_LabelsKey, Gauge]]
+    _summaries: dict[str, dict[_LabelsKey, Summary]]
+    _lock: threading.Lock
+
+    def __init__(self):
+        self._counters = {}
+        self._gauges = {}
+        self._summaries = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, **labels: str) -> Counter:
+        return self._get(self._counters, Counter, name, labels)
+
+    def gauge(self, name: str, **labels: str) -> Gauge:
+        return self._get(self._gauges, Gauge, name, labels)
+
+    def summary(self, name: str, **labels: str) -> Summary:
+        return self._get(self._summaries, Summary, name, labels)
+
+    def remove_gauge(self, name: str, **labels: str):
+        """Drop gauge of removed object, e.g. device, so labels of gone objects do not accumulate."""
+        with self._lock:
+            self._gauges.get(name, {}).pop(_labels_key(labels), None)
+
+    def _get(self, storage: dict, factory: type, name: str, labels: dict[str, str]):
+        key = _labels_key(labels)
+        metrics = storage.get(name)
+        if metrics is None or key not in metrics:
+            with self._lock:
+                metrics = storage.setdefault(name, {})
+                if key not in metrics:
+                    metrics[key] = factory()
+        return metrics[key]
+
+    def snapshot(self) -> dict:
+        result: dict = {'counters': {}, 'gauges': {}, 'summaries': {}}
+        with self._lock:
+            for name, counters in self._counters.items():
+                result['counters'][name] = [{'labels': dict(k), 'value': c.value} for k, c in counters.items()]
+            for name, gauges in self._gauges.items():
+                result['gauges'][name] = [{'labels': dict(k), 'value': g.value} for k, g in gauges.items()]
+            for name, summaries in self._summaries.items():
+                result['summaries'][name] = [
+                    {'labels': dict(k), 'count': s.count, 'total': s.total, 'avg': s.avg, 'max': s.max}
+                    for k, s in summaries.items()
+                ]
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._summaries.clear()
+
+# Default registry used by all components.
+metrics = MetricsRegistry()
@@ -0,0 +1,129 @@
+import asyncio
+import time
+from typing import Callable
+
+from gmqtt.storage import HeapPersistentStorage
+from ha_wb_discovery.metrics import metrics, Counter, Gauge, MetricsRegistry, Summary
+
+# Broker, which does not send `receive_maximum` in CONNACK, allows protocol maximum
+_PROTOCOL_RECEIVE_MAXIMUM = 65535
+
+def broker_receive_maximum(properties: dict | None) -> int:
+    """Number of QoS 1 and 2 messages in flight allowed by broker in CONNACK properties."""
+    maximum = (properties or {}).get('receive_maximum', _PROTOCOL_RECEIVE_MAXIMUM)
+    # gmqtt passes parsed properties as lists
+    if isinstance(maximum, list):
+        return maximum[0] if maximum else _PROTOCOL_RECEIVE_MAXIMUM
+    return maximum
+
+class InflightStorage(HeapPersistentStorage):
+    """
+    Storage of unacknowledged QoS 1 and 2 messages of gmqtt client, which tracks number of messages in flight
+    and time to acknowledgement. Should be passed to gmqtt client as `persistent_storage`.
+    """
+    on_ack: Callable[[], None] | None
+    # message id -> time of first send
+    _sent: dict[int, float]
+    _ack_latency: Summary
+    _inflight: Gauge
+    # Set on every acknowledgement, see `wait_ack`
+    _acked: asyncio.Event
+
+    def __init__(self, client_name: str, retry_deliver_timeout: float = 5, metrics_registry: MetricsRegistry = metrics):
+        super().__init__(retry_deliver_timeout)
+        self.on_ack = None
+        self._sent = {}
+        self._ack_latency = metrics_registry.summary('mqtt_ack_latency', client=client_name)
+        self._inflight = metrics_registry.gauge('mqtt_inflight', client=client_name)
+        self._acked = asyncio.Event()
+
+    def push_message_nowait(self, mid, raw_package):
+        # Called on publish only, resent messages are pushed back by push_message
+        self._sent[mid] = time.monotonic()
+        self._inflight.set(len(self._sent))
+        return super().push_message_nowait(mid, raw_package)
+
+    async def remove_message_by_mid(self, mid):
+        await super().remove_message_by_mid(mid)
+        sent = self._sent.pop(mid, None)
+        if sent is None:
+            return
+        self._ack_latency.observe(time.monotonic() - sent)
+        self._inflight.set(len(self._sent))
+        if self.on_ack is not None:
+            self.on_ack()
+        self._acked.set()
+
+    async def wait_ack(self):
+        """Wait for next acknowledgement."""
+        self._acked.clear()
+        await self._acked.wait()
+
+    def __len__(self) -> int:
+        return len(self._sent)
+
+def inflight_storage(client) -> InflightStorage | None:
+    """Storage of gmqtt client, if it tracks messages in flight. Local and shard clients have none."""
+    # gmqtt has no public accessor of storage passed to constructor
+    storage = getattr(client, '_persistent_storage', None)
+    return storage if isinstance(storage, InflightStorage) else None
+
+class InflightWindow:
+    """
+    Caps number of QoS 1 and 2 messages in flight, so broker is not overloaded by bursts, e.g. on full republish.
+    Messages above cap wait for acknowledgements in publish order. Waiting message is replaced by newer one
+    to same topic: retained config or state is superseded by newer one anyway.
+    """
+    _storage: InflightStorage
+    _maximum: int
+    # Maximum limited by broker
+    _limit: int
+    _send: Callable[..., None]
+    # topic -> (payload, qos, retain) of waiting message
+    _waiting: dict[str, tuple[str | bytes, int, bool]]
+    _waiting_gauge: Gauge
+    _superseded: Counter
+    # Called, when acknowledgements free the window, so publisher can send more
+    on_ready: Callable[[], None] | None
+
+    def __init__(self, storage: InflightStorage, maximum: int, send: Callable[..., None], client_name: str,
+                 metrics_registry: MetricsRegistry = metrics):
+        self._storage = storage
+        self._maximum = self._limit = maximum
+        self._send = send
+        self._waiting = {}
+        self._waiting_gauge = metrics_registry.gauge('mqtt_inflight_waiting', client=client_name)
+        self._superseded = metrics_registry.counter('mqtt_inflight_superseded', client=client_name)
+        self.on_ready = None
+        storage.on_ack = self._send_waiting
+
+    def on_connect(self, properties: dict | None = None):
+        self._limit = min(self._maximum, broker_receive_maximum(properties))
+        self._send_waiting()
+
+    def ready(self) -> bool:
+        """True, when message can be sent without waiting for acknowledgements."""
+        return not self._waiting and len(self._storage) < self._limit
+
+    def waiting(self) -> int:
+        """Number of messages, which wait for acknowledgements to be sent."""
+        return len(self._waiting)
+
+    def admit(self, topic: str, payload: str | bytes, qos: int, retain: bool) -> bool:
+        """Returns True, when message can be sent now, otherwise message waits for acknowledgements."""
+        if self.ready():
+            return True
+        if topic in self._waiting:
+            self._superseded.inc()
+        self._waiting[topic] = (payload, qos, retain)
+        self._waiting_gauge.set(len(self._waiting))
+        return False
+
+    def _send_waiting(self):
+        while self._waiting and len(self._storage) < self._limit:
+            topic = next(iter(self._waiting))
+            payload, qos, retain = self._waiting.pop(topic)
+            self._send(topic, payload, qos=qos, retain=retain)
+        self._waiting_gauge.set(len(self._waiting))
+        if self.on_ready is not None and self.ready():
+            self.on_ready()
@@ -0,0 +1,345 @@
+"""
+In-process MQTT broker stand-in for tests and benchmarks, which use real MQTT clients.
+
+Unlike `LocalMQTTClient`, which replaces MQTT client, broker lets gmqtt clients exercise framing, QoS acks,
+retained messages and reconnects without external service. It implements only what clients of this add-on need:
+MQTT 3.1.1 and 5 packets, QoS 0, 1 and 2 publishes (delivered with QoS up to 1), retained messages,
+wildcard subscriptions and MQTT 5 topic aliases. Sessions are not persisted.
+Latency of every packet sent by broker can be injected and connections can be dropped to test reconnects.
+"""
+import asyncio
+import logging
+import struct
+
+from ha_wb_discovery.mqtt_conn.topic_filter import TopicFilterIndex
+
+logger = logging.getLogger(__name__)
+
+_CONNECT = 1
+_CONNACK = 2
+_PUBLISH = 3
+_PUBACK = 4
+_PUBREC = 5
+_PUBREL = 6
+_PUBCOMP = 7
+_SUBSCRIBE = 8
+_SUBACK = 9
+_UNSUBSCRIBE = 10
+_UNSUBACK = 11
+_PINGREQ = 12
+_PINGRESP = 13
+_DISCONNECT = 14
+
+_MQTT_V5 = 5
+
+# MQTT 5 property id -> value format: struct format, 'vbi' for variable byte integer,
+# 'str' and 'bin' for length prefixed data, 'pair' for user property
+_PROPERTY_FORMATS = {
+    0x01: '!B', 0x02: '!I', 0x03: 'str', 0x08: 'str', 0x09: 'bin', 0x0B: 'vbi', 0x11: '!I', 0x12: 'str',
+    0x13: '!H', 0x15: 'str', 0x16: 'bin', 0x17: '!B', 0x18: '!I', 0x19: '!B', 0x1A: 'str', 0x1C: 'str',
+    0x1F: 'str', 0x21: '!H', 0x22: '!H', 0x23: '!H', 0x24: '!B', 0x25: '!B', 0x26: 'pair', 0x27: '!I',
+    0x28: '!B', 0x29: '!B', 0x2A: '!B',
+}
+_PROPERTY_TOPIC_ALIAS = 0x23
+_PROPERTY_RECEIVE_MAXIMUM = 0x21
+_PROPERTY_TOPIC_ALIAS_MAXIMUM = 0x22
+
+def _pack_vbi(value: int) -> bytes:
+    result = bytearray()
+    while True:
+        byte, value = value % 128, value // 128
+        result.append(byte | 0x80 if value else byte)
+        if not value:
+            return bytes(result)
+
+def _unpack_vbi(data: bytes, offset: int) -> tuple[int, int]:
+    value, shift = 0, 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, offset
+        shift += 7
+
+def _unpack_str(data: bytes, offset: int) -> tuple[bytes, int]:
+    length, = struct.unpack_from('!H', data, offset)
+    return data[offset + 2:offset + 2 + length], offset + 2 + length
+
+def _pack_str(value: bytes) -> bytes:
+    return struct.pack('!H', len(value)) + value
+
+def _unpack_properties(data: bytes, offset: int) -> tuple[dict[int, object], int]:
+    """Returns properties by id, user properties are skipped."""
+    length, offset = _unpack_vbi(data, offset)
+    end = offset + length
+    properties: dict[int, object] = {}
+    while offset < end:
+        prop_id = data[offset]
+        fmt = _PROPERTY_FORMATS[prop_id]
+        offset += 1
+        value: object
+        if fmt == 'vbi':
+            value, offset = _unpack_vbi(data, offset)
+        elif fmt in ('str', 'bin'):
+            value, offset = _unpack_str(data, offset)
+        elif fmt == 'pair':
+            _, offset = _unpack_str(data, offset)
+            _, offset = _unpack_str(data, offset)
+            continue
+        else:
+            value, = struct.unpack_from(fmt, data, offset)
+            offset += struct.calcsize(fmt)
+        properties[prop_id] = value
+    return properties, end
+
+def _packet(packet_type: int, flags: int, body: bytes) -> bytes:
+    return bytes([packet_type << 4 | flags]) + _pack_vbi(len(body)) + body
+
+class _Connection:
+    client_id: str
+    version: int
+    # topic filter -> granted QoS
+    subscriptions: TopicFilterIndex[int]
+    # MQTT 5 topic alias -> topic of messages received from client
+    topic_aliases: dict[int, str]
+    _writer: asyncio.StreamWriter
+    # Packets are sent in order by one task, each after broker latency
+    _outgoing: asyncio.Queue[tuple[float, bytes]]
+    _sender: asyncio.Task
+    _next_id: int
+
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.client_id = ''
+        self.version = 4
+        self.subscriptions = TopicFilterIndex()
+        self.topic_aliases = {}
+        self._writer = writer
+        self._outgoing = asyncio.Queue()
+        self._sender = asyncio.get_running_loop().create_task(self._send_outgoing())
+        self._next_id = 0
+
+    def send(self, packet: bytes, latency: float):
+        self._outgoing.put_nowait((asyncio.get_running_loop().time() + latency, packet))
+
+    def packet_id(self) -> int:
+        self._next_id = self._next_id % 65535 + 1
+        return self._next_id
+
+    async def _send_outgoing(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            due, packet = await self._outgoing.get()
+            delay = due - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if self._writer.is_closing():
+                return
+            self._writer.write(packet)
+
+    def close(self):
+        self._sender.cancel()
+        self._writer.close()
+
+class LocalMQTTBroker:
+    """
+    MQTT broker on localhost, see module docstring.
+    `latency` delays every packet sent by broker, including acks, and can be changed at any time.
+    """
+    latency: float
+    # topic -> payload of retained message
+    retained: dict[str, bytes]
+    # Number of messages received from clients
+    received: int
+    _host: str
+    _port: int
+    _topic_alias_maximum: int
+    _receive_maximum: int
+    _server: asyncio.Server | None
+    _connections: dict[str, _Connection]
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0, topic_alias_maximum: int = 0, receive_maximum: int = 0):
+        self.latency = latency
+        self.retained = {}
+        self.received = 0
+        self._host = host
+        self._port = port
+        self._topic_alias_maximum = topic_alias_maximum
+        self._receive_maximum = receive_maximum
+        self._server = None
+        self._connections = {}
+
+    @property
+    def port(self) -> int:
+        """Listening port, it is chosen by OS when broker is created with port 0."""
+        return self._port
+
+    @property
+    def client_ids(self) -> list[str]:
+        return list(self._connections)
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self._host, self._port)
+        self._port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"local broker is listening on {self._host}:{self._port}")
+
+    async def stop(self):
+        self.drop_connections()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def drop_connections(self, client_id: str | None = None) -> int:
+        """Close connections without DISCONNECT, like network failure. Returns number of dropped connections."""
+        dropped = [c for c in self._connections.values() if client_id is None or c.client_id == client_id]
+        for connection in dropped:
+            self._forget(connection)
+            connection.close()
+        return len(dropped)
+
+    def _forget(self, connection: _Connection):
+        if self._connections.get(connection.client_id) is connection:
+            del self._connections[connection.client_id]
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        connection = _Connection(writer)
+        try:
+            while True:
+                header = await reader.readexactly(1)
+                length, multiplier = 0, 1
+                while True:
+                    byte = (await reader.readexactly(1))[0]
+                    length += (byte & 0x7F) * multiplier
+                    multiplier *= 128
+                    if not byte & 0x80:
+                        break
+                body = await reader.readexactly(length)
+                if not self._handle_packet(connection, header[0] >> 4, header[0] & 0x0F, body):
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._forget(connection)
+            connection.close()
+
+    def _handle_packet(self, connection: _Connection, packet_type: int, flags: int, body: bytes) -> bool:
+        """Returns False, when connection should be closed."""
+        if packet_type == _CONNECT:
+            self._handle_connect(connection, body)
+        elif packet_type == _PUBLISH:
+            self._handle_publish(connection, flags, body)
+        elif packet_type == _PUBREL:
+            connection.send(_packet(_PUBCOMP, 0, body[:2]), self.latency)
+        elif packet_type == _SUBSCRIBE:
+            self._handle_subscribe(connection, body)
+        elif packet_type == _UNSUBSCRIBE:
+            self._handle_unsubscribe(connection, body)
+        elif packet_type == _PINGREQ:
+            connection.send(_packet(_PINGRESP, 0, b''), self.latency)
+        elif packet_type == _DISCONNECT:
+            return False
+        # Acks of messages delivered by broker are not tracked: messages are not redelivered
+        return True
+
+    def _handle_connect(self, connection: _Connection, body: bytes):
+        _, offset = _unpack_str(body, 0)
+        connection.version = body[offset]
+        flags = body[offset + 1]
+        offset += 4
+        if connection.version == _MQTT_V5:
+            _, offset = _unpack_properties(body, offset)
+        client_id, offset = _unpack_str(body, offset)
+        connection.client_id = client_id.decode('utf-8')
+        # Will message, username and password are accepted and ignored
+        previous = self._connections.get(connection.client_id)
+        if previous is not None:
+            # Session takeover by client with same ID
+            previous.close()
+        self._connections[connection.client_id] = connection
+        if flags & 0x02 == 0:
+            logger.warning(f"[{connection.client_id}] persistent sessions are not supported, session is clean")
+        if connection.version == _MQTT_V5:
+            properties = b''
+            if self._topic_alias_maximum:
+                properties += struct.pack('!BH', _PROPERTY_TOPIC_ALIAS_MAXIMUM, self._topic_alias_maximum)
+            if self._receive_maximum:
+                properties += struct.pack('!BH', _PROPERTY_RECEIVE_MAXIMUM, self._receive_maximum)
+            connection.send(_packet(_CONNACK, 0, b'\x00\x00' + _pack_vbi(len(properties)) + properties), self.latency)
+        else:
+            connection.send(_packet(_CONNACK, 0, b'\x00\x00'), self.latency)
+
+    def _handle_publish(self, connection: _Connection, flags: int, body: bytes):
+        qos = (flags >> 1) & 0x03
+        retain = bool(flags & 0x01)
+        topic_bytes, offset = _unpack_str(body, 0)
+        topic = topic_bytes.decode('utf-8')
+        packet_id = None
+        if qos:
+            packet_id, = struct.unpack_from('!H', body, offset)
+            offset += 2
+        if connection.version == _MQTT_V5:
+            properties, offset = _unpack_properties(body, offset)
+            alias = properties.get(_PROPERTY_TOPIC_ALIAS)
+            if isinstance(alias, int):
+                if topic:
+                    connection.topic_aliases[alias] = topic
+                else:
+                    topic = connection.topic_aliases[alias]
+        payload = body[offset:]
+        self.received += 1
+        if packet_id is not None:
+            ack = _PUBACK if qos == 1 else _PUBREC
+            connection.send(_packet(ack, 0, struct.pack('!H', packet_id)), self.latency)
+        if retain:
+            if payload:
+                self.retained[topic] = payload
+            else:
+                self.retained.pop(topic, None)
+        for subscriber in list(self._connections.values()):
+            granted = subscriber.subscriptions.match(topic)
+            if granted:
+                self._deliver(subscriber, topic, payload, min(qos, max(granted)), False)
+
+    def _deliver(self, connection: _Connection, topic: str, payload: bytes, qos: int, retain: bool):
+        body = _pack_str(topic.encode('utf-8'))
+        if qos:
+            body += struct.pack('!H', connection.packet_id())
+        if connection.version == _MQTT_V5:
+            body += b'\x00'
+        connection.send(_packet(_PUBLISH, qos << 1 | int(retain), body + payload), self.latency)
+
+    def _handle_subscribe(self, connection: _Connection, body: bytes):
+        packet_id, = struct.unpack_from('!H', body, 0)
+        offset = 2
+        if connection.version == _MQTT_V5:
+            _, offset = _unpack_properties(body, offset)
+        filters = TopicFilterIndex[int]()
+        granted = bytearray()
+        while offset < len(body):
+            topic_filter, offset = _unpack_str(body, offset)
+            # QoS 2 delivery is not implemented, so it is downgraded as allowed by MQTT spec
+            qos = min(body[offset] & 0x03, 1)
+            offset += 1
+            connection.subscriptions.add(topic_filter.decode('utf-8'), qos)
+            filters.add(topic_filter.decode('utf-8'), qos)
+            granted.append(qos)
+        properties = b'\x00' if connection.version == _MQTT_V5 else b''
+        connection.send(_packet(_SUBACK, 0, struct.pack('!H', packet_id) + properties + bytes(granted)), self.latency)
+        for topic, payload in list(self.retained.items()):
+            qos_list = filters.match(topic)
+            if qos_list:
+                self._deliver(connection, topic, payload, max(qos_list), True)
+
+    def _handle_unsubscribe(self, connection: _Connection, body: bytes):
+        packet_id, = struct.unpack_from('!H', body, 0)
+        offset = 2
+        if connection.version == _MQTT_V5:
+            _, offset = _unpack_properties(body, offset)
+        count = 0
+        while offset < len(body):
+            topic_filter, offset = _unpack_str(body, offset)
+            connection.subscriptions.remove(topic_filter.decode('utf-8'))
+            count += 1
+        reasons = b'\x00' + b'\x00' * count if connection.version == _MQTT_V5 else b''
+        connection.send(_packet(_UNSUBACK, 0, struct.pack('!H', packet_id) + reasons), self.latency)
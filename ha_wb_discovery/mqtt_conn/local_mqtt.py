@@ -2,9 +2,10 @@ import asyncio
 import json
 import os
 from typing import Callable
-import re
 import logging
 
+from ha_wb_discovery.mqtt_conn.topic_filter import TopicFilterIndex
+
 logger = logging.getLogger(__name__)
 
 class LocalMQTTClient:
@@ -12,7 +13,7 @@ class LocalMQTTClient:
     on_disconnect: Callable
     on_connect: Callable
 
-    _subscriptions: list[re.Pattern]
+    _subscriptions: TopicFilterIndex[int]
     _input_file: str
     _output_file: str
     _completed: asyncio.Event
@@ -20,20 +21,21 @@ class LocalMQTTClient:
     def __init__(self, input_file: str, output_file: str):
         self._input_file = input_file
         self._output_file = output_file
-        self._subscriptions = []
+        self._subscriptions = TopicFilterIndex()
         self._completed = asyncio.Event()
         with open(self._output_file, 'wt') as f:
             pass
 
     def subscribe(self, topic: str, qos: int = 0):
-        topic_pattern = topic.replace('+', '[^/]+').replace('#', '.+')
-        topic_regex = re.compile(f'^{topic_pattern}$')
-        self._subscriptions.append(topic_regex)
+        self._subscriptions.add(topic, qos)
+
+    def unsubscribe(self, topic: str):
+        self._subscriptions.remove(topic)
 
-    def publish(self, topic: str, payload: str, qos: int = 0, retain: bool = False):
+    def publish(self, topic: str, payload: str | bytes, qos: int = 0, retain: bool = False, **properties):
         msg = {
             'topic': topic,
-            'payload': payload
+            'payload': payload if isinstance(payload, str) else payload.decode('utf-8')
         }
 
         with open(self._output_file, 'at') as f:
@@ -42,16 +44,23 @@ class LocalMQTTClient:
     async def connect(self, *args, **kwargs):
         if self.on_connect is not None:
             self.on_connect(self)
+        await self.replay()
 
-        with open(self._input_file) as f:
+    async def replay(self, input_file: str | None = None):
+        """Deliver all messages from input file (own one by default) to subscriptions and disconnect."""
+        with open(input_file or self._input_file) as f:
             for line in f:
                 msg = json.loads(line)
-                for topic_regex in self._subscriptions:
-                    if topic_regex.match(msg['topic']):
-                        self.on_message(None, msg['topic'], msg['payload'].encode('utf-8'), 0, {})
+                self.deliver(msg['topic'], msg['payload'].encode('utf-8'))
         self._completed.set()
         if self.on_disconnect is not None:
             await self.on_disconnect(None, None)
 
+    def deliver(self, topic: str, payload: bytes):
+        """Deliver one message to subscriptions, like broker does."""
+        # Deliver message once even if several subscriptions match
+        if self._subscriptions.first(topic) is not None:
+            self.on_message(None, topic, payload, 0, {})
+
     async def disconnect(self):
         await self._completed.wait()
\ No newline at end of file
@@ -1,20 +1,20 @@
 import logging
-from typing import Callable, Union
-import re
+from typing import TYPE_CHECKING, Callable
 
 from gmqtt import Client
-from ha_wb_discovery.mqtt_conn.local_mqtt import LocalMQTTClient
+from ha_wb_discovery.metrics import metrics, Counter, MetricsRegistry
+from ha_wb_discovery.mqtt_conn.inflight import InflightStorage, InflightWindow, inflight_storage
+from ha_wb_discovery.mqtt_conn.topic_alias import TopicAliases, broker_topic_alias_maximum
+from ha_wb_discovery.mqtt_conn.topic_filter import TopicFilterIndex
+from ha_wb_discovery.sampled_log import SampledLogger
+from ha_wb_discovery.watchdog import LoopWatchdog
 
-logger = logging.getLogger(__name__)
-
-class Subscription:
-    re_matcher: re.Pattern
-    callback: Callable
+if TYPE_CHECKING:
+    from ha_wb_discovery.mqtt_conn.local_mqtt import LocalMQTTClient
+    from ha_wb_discovery.mqtt_conn.shard_mqtt import ShardMQTTClient
 
-    def __init__(self, pattern: str, callback: Callable):
-        self.callback = callback
-        pattern = pattern.replace('+', '[^/]+').replace('#', '.+')
-        self.re_matcher = re.compile(pattern)
+logger = logging.getLogger(__name__)
+sampled_logger = SampledLogger(logger, 'mqtt')
 
 def default_404(topic: str, payload: bytes):
     if logger.isEnabledFor(logging.DEBUG):
@@ -23,32 +23,111 @@ def default_404(topic: str, payload: bytes):
 
 class MQTTRouter:
     _client_name: str = ''
-    _mqtt: Client | LocalMQTTClient
-    _subscriptions: list[Subscription]
+    _mqtt: 'Client | LocalMQTTClient | ShardMQTTClient'
+    # topic filter -> callback, message is handled by first subscribed matching filter
+    _subscriptions: TopicFilterIndex[Callable[[str, bytes], None]]
+    # exact topic -> callback for latency sensitive messages, checked before subscriptions
+    _fast_routes: dict[str, Callable[[str, bytes], None]]
+    _watchdog: LoopWatchdog | None
+    # Upper limit of topic aliases, actual number is limited by broker
+    _topic_alias_maximum: int
+    _topic_aliases: TopicAliases
+    _topic_alias_saved_bytes: Counter
+    # Unacknowledged QoS 1 and 2 messages, only for gmqtt client with InflightStorage
+    _storage: InflightStorage | None
+    # Cap of QoS 1 and 2 messages in flight
+    _inflight: InflightWindow | None
     on_404: Callable = default_404
 
-    def __init__(self, cl: Client | LocalMQTTClient, client_name: str):
+    def __init__(self, cl: 'Client | LocalMQTTClient | ShardMQTTClient', client_name: str, watchdog: LoopWatchdog | None = None,
+                 topic_alias_maximum: int = 0, metrics_registry: MetricsRegistry = metrics, max_inflight: int = 0):
         self._client_name = client_name
         cl.on_message = self._on_message
         self._mqtt = cl
-        self._subscriptions = []
+        self._subscriptions = TopicFilterIndex()
+        self._fast_routes = {}
+        self._watchdog = watchdog
+        self._topic_alias_maximum = topic_alias_maximum
+        self._topic_aliases = TopicAliases()
+        self._topic_alias_saved_bytes = metrics_registry.counter('mqtt_topic_alias_saved_bytes', client=client_name)
+        self._storage = storage = inflight_storage(cl)
+        self._inflight = None
+        if storage is not None and max_inflight:
+            self._inflight = InflightWindow(storage, max_inflight, cl.publish, client_name, metrics_registry)
+
+    def on_connect(self, properties: dict | None = None):
+        """Should be called on every connect with CONNACK properties, topic aliases are used only when broker supports them."""
+        self._topic_aliases.reset(min(self._topic_alias_maximum, broker_topic_alias_maximum(properties)))
+        if self._topic_aliases.maximum:
+            logger.info(f"[{self._client_name}] using up to {self._topic_aliases.maximum} topic aliases")
+        if self._inflight is not None:
+            self._inflight.on_connect(properties)
 
     def subscribe(self, topic: str, callback: Callable[[str, bytes], None], qos: int = 0):
-        self._subscriptions.append(Subscription(topic, callback))
+        self._subscriptions.add(topic, callback)
         self._mqtt.subscribe(topic, qos=qos)
         logger.info(f"[{self._client_name}] subscribed to topic={topic} with qos={qos}")
 
-    def publish(self, topic: str, payload: str, qos: int = 0, retain: bool = False):
-        self._mqtt.publish(topic, payload, qos=qos, retain=retain)
-        logger.debug(f"[{self._client_name}] published to topic={topic} payload={payload} with qos={qos}")
+    def unsubscribe(self, topic: str):
+        self._subscriptions.remove(topic)
+        self._mqtt.unsubscribe(topic)
+        logger.info(f"[{self._client_name}] unsubscribed from topic={topic}")
 
-    def _on_message(self, client: Client, topic: str, payload: bytes, qos: int, properties):
-        if logger.isEnabledFor(logging.DEBUG):
-            pl = payload.decode('utf-8')
-            logger.debug(f"[{self._client_name}] received message topic={topic} payload={pl}")
+    def add_fast_route(self, topic: str, callback: Callable[[str, bytes], None]):
+        """
+        Handle exact topic with callback, bypassing subscriptions lookup and watchdog.
+        Topic must be covered by subscription, callback must be short.
+        """
+        self._fast_routes[topic] = callback
+
+    def remove_fast_route(self, topic: str):
+        self._fast_routes.pop(topic, None)
 
-        for sub in self._subscriptions:
-            if sub.re_matcher.match(topic):
-                sub.callback(topic, payload)
+    def ready(self) -> bool:
+        """False, when QoS 1 and 2 messages would wait for acknowledgements."""
+        return self._inflight is None or self._inflight.ready()
+
+    def on_ready(self, callback: Callable[[], None]):
+        """Call back, when acknowledgements allow to publish again after `ready` returned False."""
+        if self._inflight is not None:
+            self._inflight.on_ready = callback
+
+    def unacknowledged(self) -> int:
+        """Number of QoS 1 and 2 messages, which wait for window or for acknowledgement."""
+        if self._storage is None:
+            return 0
+        return len(self._storage) + (self._inflight.waiting() if self._inflight is not None else 0)
+
+    async def wait_acknowledged(self):
+        """Wait until all QoS 1 and 2 messages are sent and acknowledged, e.g. before disconnect."""
+        while self._storage is not None and self.unacknowledged():
+            await self._storage.wait_ack()
+
+    def publish(self, topic: str, payload: str | bytes, qos: int = 0, retain: bool = False):
+        if qos > 0 and self._inflight is not None and not self._inflight.admit(topic, payload, qos, retain):
+            sampled_logger.debug("[%s] topic=%s waits for acknowledgements", self._client_name, topic)
+            return
+        # QoS 1 and 2 messages are resent by gmqtt as is after reconnect, when aliases of previous connection are not valid anymore
+        if qos == 0 and self._topic_aliases.maximum:
+            wire_topic, alias = self._topic_aliases.alias(topic)
+            if alias is not None:
+                self._topic_alias_saved_bytes.inc(len(topic) - len(wire_topic))
+                self._mqtt.publish(wire_topic, payload, qos=qos, retain=retain, topic_alias=alias)
+                sampled_logger.debug("[%s] published to topic=%s (alias %s) payload=%s with qos=%s", self._client_name, topic, alias, payload, qos)
                 return
-        self.on_404(topic, payload)
\ No newline at end of file
+        self._mqtt.publish(topic, payload, qos=qos, retain=retain)
+        sampled_logger.debug("[%s] published to topic=%s payload=%s with qos=%s", self._client_name, topic, payload, qos)
+
+    def _on_message(self, client: Client, topic: str, payload: bytes, qos: int, properties):
+        sampled_logger.debug("[%s] received message topic=%s payload=%r", self._client_name, topic, payload)
+        callback = self._fast_routes.get(topic)
+        if callback is not None:
+            callback(topic, payload)
+            return
+        callback = self._subscriptions.first(topic)
+        if callback is None:
+            self.on_404(topic, payload)
+        elif self._watchdog is None:
+            callback(topic, payload)
+        else:
+            self._watchdog.call(self._client_name, topic, callback, topic, payload)
\ No newline at end of file
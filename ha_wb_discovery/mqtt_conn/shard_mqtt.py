@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import pickle
+import socket
+import struct
+from typing import Callable
+
+from ha_wb_discovery.metrics import metrics, Counter, MetricsRegistry
+
+logger = logging.getLogger(__name__)
+
+_frame_header = struct.Struct('!I')
+# Items, which wait while peer process is slow, e.g. blocked or overloaded
+MAX_PENDING_ITEMS = 100_000
+# MQTT messages and publishes of control states can be coalesced on overflow, other items are always sent
+_COALESCED = frozenset(('message', 'publish'))
+
+def _is_state_topic(topic: str) -> bool:
+    """`/devices/+/controls/+`, newer state supersedes older one. Meta topics are never dropped."""
+    parts = topic.split('/')
+    return len(parts) == 5 and parts[1] == 'devices' and parts[3] == 'controls'
+
+class ShardLink:
+    """
+    Bidirectional channel between ingress and worker processes.
+    Items are tuples, sent in batches: all items sent during one event loop iteration are pickled together.
+    Next batch is written only after previous one is taken by OS, so slow peer does not grow write buffer.
+    Meanwhile items are batched up to `max_pending`. Above limit control state replaces pending state of same topic
+    like in `InflightWindow`, state of topic without pending one is dropped. Meta, commands and control items
+    are always sent, otherwise device would stay half built in worker.
+    """
+    _reader: asyncio.StreamReader
+    _writer: asyncio.StreamWriter
+    _batch: list[tuple]
+    _flusher: asyncio.Task | None
+    _max_pending: int
+    # (kind, client name, topic) -> index in batch of pending state, built on overflow until batch is written
+    _states: dict[tuple, int] | None
+    _superseded: Counter
+    _dropped: Counter
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, max_pending: int = MAX_PENDING_ITEMS,
+                 metrics_registry: MetricsRegistry = metrics):
+        self._reader = reader
+        self._writer = writer
+        self._batch = []
+        self._flusher = None
+        self._max_pending = max_pending
+        self._states = None
+        self._superseded = metrics_registry.counter('shard_link_superseded')
+        self._dropped = metrics_registry.counter('shard_link_dropped')
+
+    @classmethod
+    async def open(cls, sock: socket.socket) -> 'ShardLink':
+        reader, writer = await asyncio.open_unix_connection(sock=sock)
+        return cls(reader, writer)
+
+    def send(self, item: tuple):
+        if len(self._batch) >= self._max_pending and item[0] in _COALESCED and _is_state_topic(item[2]):
+            self._coalesce(item)
+            return
+        self._batch.append(item)
+        if self._flusher is None:
+            self._flusher = asyncio.get_running_loop().create_task(self._flush())
+
+    def _coalesce(self, item: tuple):
+        if self._states is None:
+            logger.error(f"peer process does not keep up, more than {self._max_pending} items are pending, coalescing states")
+            # Newest pending state of topic is replaced, older duplicates are delivered before it
+            self._states = {
+                pending[:3]: i for i, pending in enumerate(self._batch)
+                if pending[0] in _COALESCED and _is_state_topic(pending[2])
+            }
+        index = self._states.get(item[:3])
+        if index is None:
+            self._dropped.inc()
+            return
+        self._batch[index] = item
+        self._superseded.inc()
+
+    async def _flush(self):
+        try:
+            while self._batch and not self._writer.is_closing():
+                data = pickle.dumps(self._batch, protocol=pickle.HIGHEST_PROTOCOL)
+                self._batch = []
+                self._states = None
+                self._writer.write(_frame_header.pack(len(data)) + data)
+                # Waits, while write buffer is above high water mark
+                await self._writer.drain()
+        except ConnectionError:
+            # Peer is gone, its exit is detected by reader
+            self._batch = []
+        finally:
+            self._flusher = None
+
+    async def receive(self) -> list[tuple] | None:
+        """Returns next batch of items or None when other side closed the link."""
+        try:
+            header = await self._reader.readexactly(_frame_header.size)
+            data = await self._reader.readexactly(_frame_header.unpack(header)[0])
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return None
+        return pickle.loads(data)
+
+    async def close(self):
+        if self._batch and self._flusher is None:
+            self._flusher = asyncio.get_running_loop().create_task(self._flush())
+        if self._flusher is not None:
+            await self._flusher
+        self._writer.close()
+
+class ShardMQTTClient:
+    """MQTT client for App inside worker process. Real MQTT connection is owned by ingress process."""
+    on_message: Callable
+    on_disconnect: Callable | None
+    on_connect: Callable | None
+
+    name: str
+    _link: ShardLink
+    _connected: asyncio.Event
+
+    def __init__(self, name: str, link: ShardLink):
+        self.name = name
+        self._link = link
+        self._connected = asyncio.Event()
+        self.on_connect = None
+        self.on_disconnect = None
+
+    def subscribe(self, topic: str, qos: int = 0):
+        self._link.send(('subscribe', self.name, topic, qos))
+
+    def unsubscribe(self, topic: str):
+        # Ingress process shares subscriptions between workers and keeps them,
+        # messages of removed subscription are dropped by router of worker
+        pass
+
+    def publish(self, topic: str, payload: str | bytes, qos: int = 0, retain: bool = False, **properties):
+        self._link.send(('publish', self.name, topic, payload, qos, retain))
+
+    def handle_connected(self):
+        if self.on_connect is not None:
+            self.on_connect(self)
+        self._connected.set()
+
+    async def connect(self, *args, **kwargs):
+        await self._connected.wait()
+
+    async def disconnect(self):
+        pass
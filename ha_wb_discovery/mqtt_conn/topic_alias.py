@@ -0,0 +1,74 @@
+def broker_topic_alias_maximum(properties: dict | None) -> int:
+    """Number of topic aliases allowed by broker in CONNACK properties. MQTT 3.1.1 brokers and local clients allow none."""
+    maximum = (properties or {}).get('topic_alias_maximum', 0)
+    # gmqtt passes parsed properties as lists
+    if isinstance(maximum, list):
+        return maximum[0] if maximum else 0
+    return maximum
+
+class TopicAliases:
+    """
+    MQTT 5 topic aliases of published topics for one connection.
+    Broker limits number of aliases (`topic_alias_maximum` in CONNACK), so aliases are given to most published topics:
+    free alias is given to first published topics, busy alias is moved to topic, which is published
+    more than twice as often as least published aliased topic.
+    Publish counts are halved periodically, so topics, which are not published anymore, are forgotten.
+    """
+    _maximum: int
+    # topic -> alias
+    _aliases: dict[str, int]
+    # topic -> publishes count since last decay, halved on decay
+    _counts: dict[str, int]
+    # lower bound of count of least published aliased topic
+    _min_count: int
+    _publishes: int
+    _decay_interval: int
+
+    def __init__(self, maximum: int = 0):
+        self.reset(maximum)
+
+    def reset(self, maximum: int):
+        """Aliases are valid only within connection and are reset on connect."""
+        self._maximum = maximum
+        self._aliases = {}
+        self._counts = {}
+        self._min_count = 0
+        self._publishes = 0
+        self._decay_interval = max(1000, maximum * 10)
+
+    @property
+    def maximum(self) -> int:
+        return self._maximum
+
+    def alias(self, topic: str) -> tuple[str, int | None]:
+        """
+        Returns topic to send and its alias. Topic is empty, when alias is already known by broker.
+        Topic is sent with alias, when alias is assigned or moved to it.
+        """
+        if not self._maximum:
+            return topic, None
+        count = self._counts.get(topic, 0) + 1
+        self._counts[topic] = count
+        self._publishes += 1
+        if self._publishes >= self._decay_interval:
+            self._decay()
+        alias = self._aliases.get(topic)
+        if alias is not None:
+            return '', alias
+        if len(self._aliases) < self._maximum:
+            alias = self._aliases[topic] = len(self._aliases) + 1
+            return topic, alias
+        # Counts of aliased topics only grow between decays, so cached minimum is checked first
+        if count <= 2 * self._min_count:
+            return topic, None
+        victim = min(self._aliases, key=lambda t: self._counts.get(t, 0))
+        self._min_count = self._counts.get(victim, 0)
+        if count <= 2 * self._min_count:
+            return topic, None
+        alias = self._aliases[topic] = self._aliases.pop(victim)
+        return topic, alias
+
+    def _decay(self):
+        self._publishes = 0
+        self._counts = {topic: count // 2 for topic, count in self._counts.items() if count > 1}
+        self._min_count //= 2
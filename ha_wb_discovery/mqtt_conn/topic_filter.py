@@ -0,0 +1,128 @@
+from typing import Generic, TypeVar
+
+T = TypeVar('T')
+
+def validate_topic_filter(topic_filter: str):
+    levels = topic_filter.split('/')
+    for i, level in enumerate(levels):
+        if level == '#' and i != len(levels) - 1:
+            raise ValueError(f"'#' must be the last level of topic filter: {topic_filter}")
+        if level not in ('+', '#') and ('+' in level or '#' in level):
+            raise ValueError(f"wildcard must occupy whole level of topic filter: {topic_filter}")
+
+class _Node(Generic[T]):
+    __slots__ = ('children', 'plus', 'entry', 'hash_entry')
+
+    children: dict[str, '_Node[T]']
+    plus: '_Node[T] | None'
+    # (subscription order, value) of filter ending at this node
+    entry: tuple[int, T] | None
+    # (subscription order, value) of filter ending with '#' at this node
+    hash_entry: tuple[int, T] | None
+
+    def __init__(self):
+        self.children = {}
+        self.plus = None
+        self.entry = None
+        self.hash_entry = None
+
+class TopicFilterIndex(Generic[T]):
+    """
+    MQTT topic filters indexed by levels, with matching by MQTT spec:
+    `+` matches exactly one level (possibly empty), `#` matches any number of levels including parent level,
+    wildcards at first level do not match topics starting with `$`.
+
+    Matching cost depends on number of topic levels, not on number of filters.
+    Every filter has one value: adding same filter again replaces value and keeps original order.
+    """
+    _root: _Node[T]
+    _size: int
+    _seq: int
+
+    def __init__(self):
+        self._root = _Node()
+        self._size = 0
+        self._seq = 0
+
+    def add(self, topic_filter: str, value: T):
+        validate_topic_filter(topic_filter)
+        node = self._root
+        levels = topic_filter.split('/')
+        for level in levels[:-1]:
+            node = self._child(node, level)
+        last = levels[-1]
+        if last == '#':
+            node.hash_entry = self._entry(node.hash_entry, value)
+        else:
+            node = self._child(node, last)
+            node.entry = self._entry(node.entry, value)
+
+    def remove(self, topic_filter: str):
+        """Remove filter, if it was added. Empty nodes are kept: filters are rarely removed."""
+        node: _Node[T] | None = self._root
+        levels = topic_filter.split('/')
+        for level in levels[:-1]:
+            node = self._existing_child(node, level) if node is not None else None
+        if node is None:
+            return
+        last = levels[-1]
+        if last == '#':
+            if node.hash_entry is not None:
+                node.hash_entry = None
+                self._size -= 1
+            return
+        node = self._existing_child(node, last)
+        if node is not None and node.entry is not None:
+            node.entry = None
+            self._size -= 1
+
+    def _existing_child(self, node: _Node[T], level: str) -> _Node[T] | None:
+        return node.plus if level == '+' else node.children.get(level)
+
+    def _child(self, node: _Node[T], level: str) -> _Node[T]:
+        if level == '+':
+            if node.plus is None:
+                node.plus = _Node()
+            return node.plus
+        child = node.children.get(level)
+        if child is None:
+            child = node.children[level] = _Node()
+        return child
+
+    def _entry(self, entry: tuple[int, T] | None, value: T) -> tuple[int, T]:
+        if entry is not None:
+            return entry[0], value
+        self._size += 1
+        self._seq += 1
+        return self._seq, value
+
+    def match(self, topic: str) -> list[T]:
+        """Values of all matching filters in order of adding."""
+        found: list[tuple[int, T]] = []
+        self._collect(self._root, topic.split('/'), 0, not topic.startswith('$'), found)
+        found.sort(key=lambda e: e[0])
+        return [value for _, value in found]
+
+    def first(self, topic: str) -> T | None:
+        """Value of first added filter, which matches topic."""
+        found: list[tuple[int, T]] = []
+        self._collect(self._root, topic.split('/'), 0, not topic.startswith('$'), found)
+        if not found:
+            return None
+        return min(found, key=lambda e: e[0])[1]
+
+    def _collect(self, node: _Node[T], levels: list[str], i: int, wildcards: bool, found: list[tuple[int, T]]):
+        if wildcards and node.hash_entry is not None:
+            found.append(node.hash_entry)
+        if i == len(levels):
+            if node.entry is not None:
+                found.append(node.entry)
+            return
+        child = node.children.get(levels[i])
+        if child is not None:
+            self._collect(child, levels, i + 1, True, found)
+        if wildcards and node.plus is not None:
+            self._collect(node.plus, levels, i + 1, True, found)
+
+    def __len__(self) -> int:
+        return self._size
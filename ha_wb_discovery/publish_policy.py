@@ -0,0 +1,89 @@
+from ha_wb_discovery.control_rules import ControlRules
+from ha_wb_discovery.mappers import WirenControlType
+from ha_wb_discovery.wirenboard_registry import WirenControl
+
+class PublishPolicyRule:
+    """QoS and retain flag of state and availability messages of controls of type or with entity ID matching pattern."""
+    control_type: WirenControlType | None
+    entity_id: str | None
+    # None keeps default of traffic class
+    state_qos: int | None
+    state_retain: bool | None
+    availability_qos: int | None
+    availability_retain: bool | None
+
+    def __init__(self,
+                 control_type: WirenControlType | None = None,
+                 entity_id: str | None = None,
+                 state_qos: int | None = None,
+                 state_retain: bool | None = None,
+                 availability_qos: int | None = None,
+                 availability_retain: bool | None = None,
+        ):
+        self.control_type = control_type
+        self.entity_id = entity_id
+        self.state_qos = state_qos
+        self.state_retain = state_retain
+        self.availability_qos = availability_qos
+        self.availability_retain = availability_retain
+
+    @classmethod
+    def from_config(cls, cfg: dict) -> 'PublishPolicyRule':
+        return cls(
+            cfg.get('control_type'),
+            cfg.get('entity_id'),
+            cfg.get('state_qos'),
+            cfg.get('state_retain'),
+            cfg.get('availability_qos'),
+            cfg.get('availability_retain'),
+        )
+
+class PublishPolicy:
+    """
+    QoS and retain flag per traffic class: state and availability messages have class defaults,
+    which are overridden for matched controls by rules, e.g. QoS 0 without retain for fast polled sensors.
+    """
+    _state: tuple[int, bool]
+    _availability: tuple[int, bool]
+    _rules: ControlRules[PublishPolicyRule]
+    # entity ID -> resolved (qos, retain) of state and availability
+    _resolved: dict[str, tuple[WirenControlType | None, tuple[int, bool], tuple[int, bool]]]
+
+    def __init__(self, state_qos: int, state_retain: bool, availability_qos: int, availability_retain: bool,
+                 rules: list[PublishPolicyRule] = []):
+        self._state = (state_qos, state_retain)
+        self._availability = (availability_qos, availability_retain)
+        self._rules = ControlRules(rules)
+        self._resolved = {}
+
+    def state(self, entity_id: str, control: WirenControl) -> tuple[int, bool]:
+        if not self._rules:
+            return self._state
+        return self._resolve(entity_id, control)[1]
+
+    def availability(self, entity_id: str, control: WirenControl) -> tuple[int, bool]:
+        if not self._rules:
+            return self._availability
+        return self._resolve(entity_id, control)[2]
+
+    def _resolve(self, entity_id: str, control: WirenControl):
+        resolved = self._resolved.get(entity_id)
+        if resolved is not None and resolved[0] == control.type:
+            return resolved
+        state, availability = self._state, self._availability
+        rule = self._rules.find(entity_id, control)
+        if rule is not None:
+            state = (
+                rule.state_qos if rule.state_qos is not None else state[0],
+                rule.state_retain if rule.state_retain is not None else state[1],
+            )
+            availability = (
+                rule.availability_qos if rule.availability_qos is not None else availability[0],
+                rule.availability_retain if rule.availability_retain is not None else availability[1],
+            )
+        resolved = self._resolved[entity_id] = (control.type, state, availability)
+        return resolved
+
+    def forget(self, entity_id: str):
+        self._rules.forget(entity_id)
+        self._resolved.pop(entity_id, None)
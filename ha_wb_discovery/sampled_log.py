@@ -0,0 +1,43 @@
+import logging
+
+class SampledLogger:
+    """
+    Debug logger for per-message events.
+    Only every n-th event of subsystem is logged, number of skipped events is appended to the message.
+    Message is formatted by logging module only when it is emitted, so pass arguments instead of f-strings.
+    """
+    __slots__ = ('subsystem', 'every', '_logger', '_skipped')
+
+    subsystem: str
+    every: int
+    _logger: logging.Logger
+    _skipped: int
+
+    def __init__(self, logger: logging.Logger, subsystem: str):
+        self.subsystem = subsystem
+        self.every = _sample_rates.get(subsystem, 1)
+        self._logger = logger
+        self._skipped = 0
+        _sampled_loggers.append(self)
+
+    def debug(self, msg: str, *args):
+        if not self._logger.isEnabledFor(logging.DEBUG):
+            return
+        if self._skipped + 1 < self.every:
+            self._skipped += 1
+            return
+        if self._skipped:
+            self._logger.debug(msg + ' (%d skipped)', *args, self._skipped)
+            self._skipped = 0
+        else:
+            self._logger.debug(msg, *args)
+
+_sampled_loggers: list[SampledLogger] = []
+_sample_rates: dict[str, int] = {}
+
+def configure_sampling(rates: dict[str, int]):
+    """Set sample rate per subsystem: 1 logs every event, 100 logs 1 of 100 events."""
+    _sample_rates.clear()
+    _sample_rates.update(rates)
+    for sampled_logger in _sampled_loggers:
+        sampled_logger.every = rates.get(sampled_logger.subsystem, 1)
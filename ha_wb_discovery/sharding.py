@@ -0,0 +1,249 @@
+"""
+Sharded mode: devices are distributed between worker processes.
+
+Main (ingress) process keeps MQTT connections to both brokers and routes every message by device ID
+from the topic to the worker process, which owns the device. Messages without device ID,
+like `hass/status`, are broadcasted to all workers. Each worker runs regular `App` with its own
+`WirenBoardDeviceRegistry` and `HomeAssistant`, but its MQTT clients are replaced with `ShardMQTTClient`,
+which sends subscriptions and publications back to the ingress process.
+"""
+import asyncio
+import logging
+import multiprocessing
+import signal
+import socket
+import zlib
+from typing import Callable
+
+from ha_wb_discovery.app import App, MQTTClientType, connect_mqtt, wirenboard_client_name
+from ha_wb_discovery.config import LOGLEVEL_MAPPER, general_config, wirenboard_configs
+from ha_wb_discovery.event_loop import new_event_loop
+from ha_wb_discovery.homeassistant import HomeAssistantDiscoveryCustomizer
+from ha_wb_discovery.mqtt_conn.inflight import InflightWindow, inflight_storage
+from ha_wb_discovery.mqtt_conn.shard_mqtt import ShardLink, ShardMQTTClient
+from ha_wb_discovery.mqtt_conn.topic_alias import TopicAliases, broker_topic_alias_maximum
+
+logger = logging.getLogger(__name__)
+
+def shard_index(device_id: str, shards: int) -> int:
+    # crc32 instead of hash(), because hash() of str is randomized per process
+    return zlib.crc32(device_id.encode('utf-8')) % shards
+
+def device_id_from_topic(topic: str) -> str | None:
+    if not topic.startswith('/devices/'):
+        return None
+    parts = topic.split('/', 3)
+    return parts[2] if len(parts) > 2 else None
+
+def _worker_main(index: int, sock: socket.socket, cfg: dict):
+    logging.basicConfig(
+        level=LOGLEVEL_MAPPER[cfg["general.loglevel"]],
+        format=f"%(asctime)s %(levelname)s [shard-{index}] [%(name)s] %(message)s",
+        datefmt="%H:%M:%S",
+    )
+    # Worker is stopped by ingress process, which flushes pending messages before
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    loop = new_event_loop(cfg["general.event_loop"])
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(_run_worker(sock, cfg))
+
+async def _run_worker(sock: socket.socket, cfg: dict):
+    link = await ShardLink.open(sock)
+    wb_configs = wirenboard_configs(cfg["wirenboard"])
+    clients = {
+        name: ShardMQTTClient(name, link)
+        for name in [wirenboard_client_name(i, len(wb_configs)) for i in range(len(wb_configs))] + ['homeassistant']
+    }
+    wb_clients: list[MQTTClientType] = [clients[wirenboard_client_name(i, len(wb_configs))] for i in range(len(wb_configs))]
+    app = App(
+        # Every worker knows only its devices and would remove configs of other workers as orphaned
+        cfg["homeassistant"] | {'bootstrap_timeout': 0},
+        wb_configs,
+        clients['homeassistant'],
+        wb_clients,
+        HomeAssistantDiscoveryCustomizer.from_config(cfg),
+        # Every worker has only part of devices, debug endpoint is not available in sharded mode
+        general_config(cfg) | {'debug_endpoint': ''},
+    )
+
+    async def dispatch():
+        while (batch := await link.receive()) is not None:
+            for item in batch:
+                kind = item[0]
+                if kind == 'message':
+                    _, name, topic, payload, qos = item
+                    clients[name].on_message(None, topic, payload, qos, {})
+                elif kind == 'connected':
+                    clients[item[1]].handle_connected()
+                elif kind == 'reload_customizer':
+                    app.reload_customizer(item[1])
+                elif kind == 'stop':
+                    await app.stop()
+                    return
+        logger.error("ingress process closed connection")
+        await app.stop()
+
+    asyncio.get_running_loop().create_task(dispatch())
+    await app.run()
+    await link.close()
+
+class _Worker:
+    process: multiprocessing.process.BaseProcess
+    link: ShardLink
+    reader: asyncio.Task | None
+
+    def __init__(self, process: multiprocessing.process.BaseProcess, link: ShardLink):
+        self.process = process
+        self.link = link
+        self.reader = None
+
+class ShardedApp:
+    _cfg: dict
+    _clients: dict[str, MQTTClientType]
+    _configs: dict[str, dict]
+    _device_id_prefixes: dict[str, str]
+    _subscribed: dict[str, set[str]]
+    # Topic aliases belong to broker connections of ingress process
+    _topic_aliases: dict[str, TopicAliases]
+    # Caps of QoS 1 and 2 messages in flight of broker connections
+    _inflight: dict[str, InflightWindow]
+    _workers: list[_Worker]
+    _stopping: bool
+    _stoper: asyncio.Event
+
+    def __init__(self,
+                 cfg: dict,
+                 ha_mqtt_client: MQTTClientType,
+                 wb_mqtt_client: MQTTClientType | list[MQTTClientType],
+                 workers: int | None = None,
+                 ):
+        self._cfg = cfg
+        self._workers_count = workers or cfg["general.workers"]
+        if cfg.get("general.debug_endpoint"):
+            logger.warning("debug endpoint is not supported with several workers, it is disabled")
+        if cfg['homeassistant'].get("bootstrap_timeout"):
+            logger.warning("bootstrap from retained configs is not supported with several workers, it is disabled")
+        wb_configs = wirenboard_configs(cfg['wirenboard'])
+        wb_mqtt_clients = wb_mqtt_client if isinstance(wb_mqtt_client, list) else [wb_mqtt_client]
+        assert len(wb_configs) == len(wb_mqtt_clients)
+        self._clients = {'homeassistant': ha_mqtt_client}
+        self._configs = {'homeassistant': cfg['homeassistant']}
+        self._device_id_prefixes = {'homeassistant': ''}
+        for i, (wb_config, client) in enumerate(zip(wb_configs, wb_mqtt_clients)):
+            name = wirenboard_client_name(i, len(wb_configs))
+            self._clients[name] = client
+            self._configs[name] = wb_config
+            self._device_id_prefixes[name] = wb_config.get('device_id_prefix', '')
+        self._subscribed = {name: set() for name in self._clients}
+        self._topic_aliases = {name: TopicAliases() for name in self._clients}
+        self._inflight = {}
+        storage = inflight_storage(ha_mqtt_client)
+        if storage is not None and cfg['homeassistant'].get('max_inflight'):
+            self._inflight['homeassistant'] = InflightWindow(storage, cfg['homeassistant']['max_inflight'], ha_mqtt_client.publish, 'homeassistant')
+        self._workers = []
+        self._stopping = False
+        self._stoper = asyncio.Event()
+        for name, client in self._clients.items():
+            client.on_connect = self._connect_handler(name)
+            client.on_message = self._message_handler(name)
+
+    async def run(self):
+        await self._start_workers()
+        async with asyncio.TaskGroup() as tg:
+            for name, client in self._clients.items():
+                tg.create_task(connect_mqtt(
+                    name=name,
+                    client=client,
+                    host=self._configs[name]['broker_host'],
+                    port=self._configs[name]['broker_port'],
+                ))
+        await self._stoper.wait()
+
+    async def _start_workers(self):
+        ctx = multiprocessing.get_context('spawn')
+        loop = asyncio.get_running_loop()
+        for index in range(self._workers_count):
+            ingress_sock, worker_sock = socket.socketpair()
+            process = ctx.Process(target=_worker_main, args=(index, worker_sock, self._cfg), name=f'shard-{index}', daemon=True)
+            process.start()
+            worker_sock.close()
+            worker = _Worker(process, await ShardLink.open(ingress_sock))
+            worker.reader = loop.create_task(self._read_worker(worker))
+            self._workers.append(worker)
+        logger.info(f"started {self._workers_count} worker processes")
+
+    def _connect_handler(self, name: str) -> Callable:
+        def on_connect(client=None, flags=None, rc=None, properties=None):
+            # Workers subscribe again after each connect, like App components do
+            self._subscribed[name].clear()
+            self._topic_aliases[name].reset(min(self._configs[name].get('topic_alias_maximum', 0), broker_topic_alias_maximum(properties)))
+            if name in self._inflight:
+                self._inflight[name].on_connect(properties)
+            self._broadcast(('connected', name))
+        return on_connect
+
+    def _message_handler(self, name: str) -> Callable:
+        # Home Assistant topics contain prefixed device IDs already
+        prefix = self._device_id_prefixes[name]
+        def on_message(client, topic: str, payload: bytes, qos: int, properties):
+            item = ('message', name, topic, payload, qos)
+            device_id = device_id_from_topic(topic)
+            if device_id is None:
+                self._broadcast(item)
+            else:
+                self._workers[shard_index(prefix + device_id, len(self._workers))].link.send(item)
+        return on_message
+
+    def reload_customizer(self, customizer: HomeAssistantDiscoveryCustomizer):
+        self._broadcast(('reload_customizer', customizer))
+
+    def _broadcast(self, item: tuple):
+        for worker in self._workers:
+            worker.link.send(item)
+
+    async def _read_worker(self, worker: _Worker):
+        while (batch := await worker.link.receive()) is not None:
+            for item in batch:
+                kind, name = item[0], item[1]
+                client = self._clients[name]
+                if kind == 'publish':
+                    _, _, topic, payload, qos, retain = item
+                    window = self._inflight.get(name)
+                    if qos > 0 and window is not None and not window.admit(topic, payload, qos, retain):
+                        continue
+                    aliases = self._topic_aliases[name]
+                    if qos == 0 and aliases.maximum:
+                        wire_topic, alias = aliases.alias(topic)
+                        if alias is not None:
+                            client.publish(wire_topic, payload, qos=qos, retain=retain, topic_alias=alias)
+                            continue
+                    client.publish(topic, payload, qos=qos, retain=retain)
+                elif kind == 'subscribe':
+                    _, _, topic, qos = item
+                    if topic not in self._subscribed[name]:
+                        self._subscribed[name].add(topic)
+                        client.subscribe(topic, qos=qos)
+        if not self._stopping:
+            # Devices of worker would be silently lost, so app is stopped to be restarted by supervisor
+            await asyncio.get_running_loop().run_in_executor(None, worker.process.join, 1)
+            logger.error(f"worker process {worker.process.name} exited unexpectedly with code {worker.process.exitcode}, stopping")
+            # Stop waits for this reader, so it is not awaited here
+            asyncio.get_running_loop().create_task(self.stop())
+
+    async def stop(self):
+        if self._stopping:
+            return
+        self._stopping = True
+        logger.info("Stopping workers")
+        self._broadcast(('stop',))
+        # Workers publish all pending messages before closing the link
+        await asyncio.gather(*(w.reader for w in self._workers if w.reader is not None))
+        loop = asyncio.get_running_loop()
+        for worker in self._workers:
+            await worker.link.close()
+            await loop.run_in_executor(None, worker.process.join)
+        logger.info("Stopping app")
+        for client in self._clients.values():
+            await client.disconnect()
+        self._stoper.set()
@@ -0,0 +1,36 @@
+import logging
+import time
+
+from ha_wb_discovery.metrics import metrics, MetricsRegistry
+
+logger = logging.getLogger(__name__)
+
+class StartupTimer:
+    """
+    Startup phases timing: imports, config validation, MQTT connect, first discovery publish.
+    Every phase is reported at INFO level when it is done and stored to `startup_seconds` gauge
+    as time since process start.
+    """
+    _started: float
+    _last: float
+    _phases: list[str]
+    _metrics: MetricsRegistry
+
+    def __init__(self, started: float | None = None, registry: MetricsRegistry = metrics):
+        self._started = started if started is not None else time.perf_counter()
+        self._last = self._started
+        self._phases = []
+        self._metrics = registry
+
+    def mark(self, phase: str, at: float | None = None):
+        """
+        Phase is reported once, repeated marks (e.g. after reconnect) are ignored.
+        `at` is time.perf_counter() of phase end, for phases done before logging is set up.
+        """
+        if phase in self._phases:
+            return
+        now = at if at is not None else time.perf_counter()
+        self._phases.append(phase)
+        self._metrics.gauge('startup_seconds', phase=phase).set(now - self._started)
+        logger.info("startup: %s in %.3fs, %.3fs since start", phase, now - self._last, now - self._started)
+        self._last = now
@@ -0,0 +1,89 @@
+import asyncio
+from typing import Callable, Generic, Hashable, TypeVar
+
+K = TypeVar('K', bound=Hashable)
+
+class TimerWheel(Generic[K]):
+    """
+    Hashed timer wheel: timers of many keys are served by one event loop timer.
+    Schedule and cancel are O(1), expired keys are passed to callback with up to one tick delay.
+    Loop timer is armed only while there are scheduled keys.
+    """
+    _callback: Callable[[K], None]
+    _tick: float
+    # slot -> key -> remaining full turns of wheel
+    _slots: list[dict[K, int]]
+    # key -> slot
+    _positions: dict[K, int]
+    _current: int
+    _next_tick_at: float
+    _handle: asyncio.TimerHandle | None
+
+    def __init__(self, callback: Callable[[K], None], tick: float = 0.1, slots: int = 512):
+        self._callback = callback
+        self._tick = tick
+        self._slots = [{} for _ in range(slots)]
+        self._positions = {}
+        self._current = 0
+        self._next_tick_at = 0
+        self._handle = None
+
+    def schedule(self, key: K, delay: float):
+        """Call callback with key after delay. Key, which is already scheduled, is rescheduled."""
+        self.cancel(key)
+        if self._handle is None:
+            self._next_tick_at = asyncio.get_running_loop().time() + self._tick
+            self._handle = asyncio.get_running_loop().call_at(self._next_tick_at, self._on_tick)
+        ticks = max(1, round(delay / self._tick))
+        turns, offset = divmod(ticks - 1, len(self._slots))
+        slot = (self._current + offset) % len(self._slots)
+        self._slots[slot][key] = turns
+        self._positions[key] = slot
+
+    def cancel(self, key: K):
+        slot = self._positions.pop(key, None)
+        if slot is not None:
+            del self._slots[slot][key]
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._positions
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def close(self):
+        """Drop all timers without calling callback."""
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        for slot in self._slots:
+            slot.clear()
+        self._positions.clear()
+
+    def _on_tick(self):
+        loop = asyncio.get_running_loop()
+        # Loop can be late, all passed ticks are processed at once
+        while self._next_tick_at <= loop.time():
+            self._expire_slot()
+            self._next_tick_at += self._tick
+        if self._positions:
+            self._handle = loop.call_at(self._next_tick_at, self._on_tick)
+        else:
+            self._handle = None
+
+    def _expire_slot(self):
+        slot = self._slots[self._current]
+        self._current = (self._current + 1) % len(self._slots)
+        if not slot:
+            return
+        expired = []
+        for key, turns in slot.items():
+            if turns:
+                slot[key] = turns - 1
+            else:
+                expired.append(key)
+        for key in expired:
+            del slot[key]
+            del self._positions[key]
+        for key in expired:
+            self._callback(key)
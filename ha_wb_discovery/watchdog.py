@@ -0,0 +1,124 @@
+import asyncio
+import collections.abc
+import logging
+import time
+from typing import Any, Callable, Coroutine
+
+from ha_wb_discovery.metrics import metrics, MetricsRegistry
+
+logger = logging.getLogger(__name__)
+
+def callback_name(callback: object) -> str:
+    return getattr(callback, '__qualname__', None) or repr(callback)
+
+class LoopWatchdog:
+    """
+    Measures event loop lag and reports callbacks and task steps that block the loop for too long.
+
+    Loop lag is measured by periodic sleep: difference between expected and actual wake up time
+    is the time loop was busy with something else.
+    """
+    _interval: float
+    _slow_callback_threshold: float
+    _metrics: MetricsRegistry
+    _task: asyncio.Task | None
+
+    def __init__(self, interval: float = 1, slow_callback_threshold: float = 0.1, registry: MetricsRegistry = metrics):
+        self._interval = interval
+        self._slow_callback_threshold = slow_callback_threshold
+        self._metrics = registry
+        self._task = None
+        self._lag = registry.gauge('loop_lag_seconds')
+        self._lag_summary = registry.summary('loop_lag')
+
+    def start(self):
+        if self._interval <= 0 or self._task is not None:
+            return
+        self._task = asyncio.get_event_loop().create_task(self._measure_lag())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _measure_lag(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self._interval)
+            lag = max(loop.time() - started - self._interval, 0)
+            self._lag.set(lag)
+            self._lag_summary.observe(lag)
+            if self.is_slow(lag):
+                logger.warning(f"event loop lag {lag:.3f}s")
+
+    def call(self, source: str, topic: str, callback: Callable, *args) -> Any:
+        """Call callback synchronously and report it if it took longer than threshold."""
+        started = time.perf_counter()
+        try:
+            return callback(*args)
+        finally:
+            elapsed = time.perf_counter() - started
+            if self.is_slow(elapsed):
+                self.report_slow('callback', source, topic, callback_name(callback), elapsed)
+
+    def wrap_task(self, source: str, task_id: str, coro: Coroutine) -> Coroutine:
+        """
+        Wrap coroutine to measure every step between awaits separately.
+        Time spent in awaits is not counted, because loop is free to run other callbacks.
+        Coroutine is returned as is, when slow callbacks are not reported.
+        """
+        if self._slow_callback_threshold <= 0:
+            return coro
+        return _TimedCoroutine(self, source, task_id, coro)
+
+    def is_slow(self, elapsed: float) -> bool:
+        return 0 < self._slow_callback_threshold < elapsed
+
+    def report_slow(self, kind: str, source: str, topic: str, handler: str, elapsed: float):
+        self._metrics.counter('slow_callbacks_total', kind=kind, source=source, handler=handler).inc()
+        self._metrics.summary('slow_callback_duration', kind=kind, source=source, handler=handler).observe(elapsed)
+        logger.warning(f"[{source}] slow {kind} {handler} took {elapsed:.3f}s, topic={topic}")
+
+class _TimedCoroutine(collections.abc.Coroutine):
+    """Coroutine proxy which reports every slow step of wrapped coroutine to the watchdog."""
+    __slots__ = ('_watchdog', '_source', '_task_id', '_coro')
+
+    def __init__(self, watchdog: LoopWatchdog, source: str, task_id: str, coro: Coroutine):
+        self._watchdog = watchdog
+        self._source = source
+        self._task_id = task_id
+        self._coro = coro
+
+    def send(self, value):
+        started = time.perf_counter()
+        try:
+            return self._coro.send(value)
+        finally:
+            self._check_step(started)
+
+    def throw(self, typ, val=None, tb=None):
+        started = time.perf_counter()
+        try:
+            if val is None and tb is None:
+                return self._coro.throw(typ)
+            return self._coro.throw(typ, val, tb)
+        finally:
+            self._check_step(started)
+
+    def close(self):
+        self._coro.close()
+
+    def __await__(self):
+        return self
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.send(None)
+
+    def _check_step(self, started: float):
+        elapsed = time.perf_counter() - started
+        if self._watchdog.is_slow(elapsed):
+            self._watchdog.report_slow('task', self._source, self._task_id, callback_name(self._coro), elapsed)
@@ -1,12 +1,24 @@
+import asyncio
+import json
 import logging
 import re
+import time
 from typing import Protocol
 
 from ha_wb_discovery.wirenboard_registry import WirenBoardDeviceRegistry, WirenDevice, WirenControl
 from ha_wb_discovery.mqtt_conn.mqtt_client import MQTTRouter
 from ha_wb_discovery.mappers import WirenControlType, WIREN_UNITS_DICT
+from ha_wb_discovery.metrics import metrics, MetricsRegistry, Summary
+from ha_wb_discovery.sampled_log import SampledLogger
 
 logger = logging.getLogger(__name__)
+sampled_logger = SampledLogger(logger, 'wirenboard')
+
+# State echo later than this is not counted as command round trip and is not suppressed as echo,
+# device probably did not respond
+COMMAND_ECHO_TIMEOUT = 10
+# Time in seconds to receive retained meta of evicted device, which is back
+META_REFETCH_TIMEOUT = 10
 
 class IHomeAssistant(Protocol):
     def publish_device_config(self, device: WirenDevice) -> None:
@@ -15,25 +27,41 @@ class IHomeAssistant(Protocol):
     def publish_control_config(self, device: WirenDevice, control: WirenControl) -> None:
         ...
 
-    def publish_control_state(self, device: WirenDevice, control: WirenControl) -> None:
+    def publish_control_state(self, device: WirenDevice, control: WirenControl, state: bytes | None = None) -> None:
         ...
 
     def publish_availability(self, device: WirenDevice, control: WirenControl) -> None:
         ...
 
+    def remove_control(self, device: WirenDevice, control: WirenControl) -> None:
+        ...
+
+    def remove_device(self, device: WirenDevice) -> None:
+        ...
+
 class Wirenboard:
     _device_meta_topic_re = re.compile(r"/devices/([^/]*)/meta/([^/]*)")
     _control_meta_topic_re = re.compile(r"/devices/([^/]*)/controls/([^/]*)/meta/([^/]*)")
+    _control_meta_json_topic_re = re.compile(r"/devices/([^/]*)/controls/([^/]*)/meta$")
     _control_state_topic_re = re.compile(r"/devices/([^/]*)/controls/([^/]*)$")
 
     _router: MQTTRouter
     _device_registry: WirenBoardDeviceRegistry
     __hass: IHomeAssistant
-    _unknown_types: list[str]
+    # Logged once, so set is bounded by number of distinct type names
+    _unknown_types: set[str]
+    # (device_id, control_id) without prefix -> command topic
+    _command_topics: dict[tuple[str, str], str]
+    # (device_id, control_id) without prefix -> time of last command without state echo
+    _pending_commands: dict[tuple[str, str], float]
+    _command_rtt: Summary
+    # IDs without prefix of devices evicted for inactivity, their retained meta is fetched again, when they are back
+    _evicted_devices: set[str]
 
     _subscribe_qos: int
     _publish_qos: int
     _publish_retain: bool
+    _device_id_prefix: str
 
     def __init__(self,
                  router: MQTTRouter,
@@ -41,12 +69,21 @@ class Wirenboard:
                  hass: IHomeAssistant | None = None,
                  subscribe_qos: int = 1,
                  publish_qos: int = 1,
-                 publish_retain: bool = False):
+                 publish_retain: bool = False,
+                 device_id_prefix: str = '',
+                 metrics_registry: MetricsRegistry = metrics):
         self._router = router
         self._device_registry = registry
         self._subscribe_qos = subscribe_qos
         self._publish_qos = publish_qos
         self._publish_retain = publish_retain
+        self._device_id_prefix = device_id_prefix
+        self._unknown_types = set()
+        self._command_topics = {}
+        self._pending_commands = {}
+        self._evicted_devices = set()
+        # Time from command publish to Wiren Board state echo
+        self._command_rtt = metrics_registry.summary('command_rtt_seconds')
         if hass is not None:
             self.hass = hass
 
@@ -65,10 +102,12 @@ class Wirenboard:
         """
         self.__hass = value
 
-    def on_connect(self, *args, **kwargs):
+    def on_connect(self, client=None, flags=None, rc=None, properties=None):
         logger.warning(f"connected to MQTT")
+        self._router.on_connect(properties)
         self._router.subscribe('/devices/+/meta/+', self._device_meta_handler, qos=self._subscribe_qos)
         self._router.subscribe('/devices/+/controls/+/meta/+', self._control_meta_handler, qos=self._subscribe_qos)
+        self._router.subscribe('/devices/+/controls/+/meta', self._control_meta_json_handler, qos=self._subscribe_qos)
         self._router.subscribe('/devices/+/controls/+', self._control_state_handler, qos=self._subscribe_qos)
 
     def _device_meta_handler(self, topic: str, payload: bytes):
@@ -77,10 +116,13 @@ class Wirenboard:
             logger.warning(f'not matched topic={topic} re={self._device_meta_topic_re}')
             return
         device_id, meta_name, meta_value = match.group(1), match.group(2), payload.decode('utf-8')
-        device = self._device_registry.get_device(device_id)
+        if not meta_value and self._find_device(device_id) is None:
+            # Cleared retained topic of removed device
+            return
+        device = self._get_device(device_id)
         if meta_name == 'name':
             device.name = meta_value
-        logger.debug(f'DEVICE META: {device_id} / {meta_name} ==> {meta_value}')
+        sampled_logger.debug('DEVICE META: %s / %s ==> %s', device_id, meta_name, meta_value)
 
     def _control_meta_handler(self, topic: str, payload: bytes):
         match = self._control_meta_topic_re.match(topic)
@@ -88,7 +130,7 @@ class Wirenboard:
             logger.warning(f'not matched topic={topic} re={self._control_meta_topic_re}')
             return
         device_id, control_id, meta_name, meta_value = match.group(1), match.group(2), match.group(3), payload.decode('utf-8')
-        logger.debug(f'CONTROL META: {device_id} / {control_id} / {meta_name} ==> {meta_value}')
+        sampled_logger.debug('CONTROL META: %s / %s / %s ==> %s', device_id, control_id, meta_name, meta_value)
 
         # Обработка специальных контролов.
         # В mqtt в wb системная информация зарегана под устройством system.
@@ -97,7 +139,17 @@ class Wirenboard:
         if device_id == 'system' and self.is_known_system_control(control_id):
             return
 
-        device = self._device_registry.get_device(device_id)
+        if not meta_value:
+            found = self._find_control(device_id, control_id)
+            if found is None:
+                # Cleared retained topic of removed control
+                return
+            if meta_name == 'type':
+                # Wiren Board clears retained meta when control is deleted
+                self.remove_control(*found)
+                return
+
+        device = self._get_device(device_id)
         control = device.get_control(control_id)
 
         if meta_name == 'error':
@@ -114,49 +166,170 @@ class Wirenboard:
 
             if meta_name == 'order':
                 return  # Ignore
-            elif meta_name == 'type':
-                try:
-                    has_changes |= control.apply_type(WirenControlType(meta_value))
-                    if control.type in WIREN_UNITS_DICT:
-                        has_changes |= control.apply_units(WIREN_UNITS_DICT[control.type])
-                except ValueError:
-                    if not meta_value in self._unknown_types:
-                        logger.warning(f'unknown type for wirenboard control: {meta_value}')
-                        self._unknown_types.append(meta_value)
-            elif meta_name == 'readonly':
-                has_changes |= control.apply_read_only(True if meta_value == '1' else False)
-            elif meta_name == 'units':
-                has_changes |= control.apply_units(meta_value)
-            elif meta_name == 'max':
-                has_changes |= control.apply_max(int(meta_value) if meta_value else None)
+            has_changes |= self._apply_control_meta(control, meta_name, meta_value)
             if has_changes:
                 self.hass.publish_control_config(device, control)
 
+    def _control_meta_json_handler(self, topic: str, payload: bytes):
+        """
+        Newer firmware publishes all control meta as one JSON object in addition to `meta/<name>` topics.
+        All fields are applied at once, so config is rebuilt once per control instead of once per field.
+        """
+        match = self._control_meta_json_topic_re.match(topic)
+        if match is None:
+            logger.warning(f'not matched topic={topic} re={self._control_meta_json_topic_re}')
+            return
+        device_id, control_id = match.group(1), match.group(2)
+        if device_id == 'system' and self.is_known_system_control(control_id):
+            return
+        if not payload:
+            # Removal of control is handled by cleared `meta/type`
+            return
+        try:
+            meta = json.loads(payload)
+            if not isinstance(meta, dict):
+                raise ValueError('meta is not JSON object')
+        except ValueError as e:
+            logger.warning(f'invalid JSON meta of control {device_id}/{control_id}: {e}')
+            return
+        sampled_logger.debug('CONTROL META JSON: %s / %s ==> %s', device_id, control_id, meta)
+
+        device = self._get_device(device_id)
+        control = device.get_control(control_id)
+        has_changes = False
+        if control.error is None:
+            # We assume that there is no error by default
+            control.error = False
+            has_changes = True
+        for meta_name in _json_meta_fields:
+            if meta_name not in meta:
+                continue
+            try:
+                has_changes |= self._apply_control_meta(control, meta_name, _json_meta_value(meta[meta_name]))
+            except ValueError:
+                logger.warning(f'invalid {meta_name} in JSON meta of control {device_id}/{control_id}: {meta[meta_name]}')
+        if has_changes:
+            self.hass.publish_control_config(device, control)
+
+    def _apply_control_meta(self, control: WirenControl, meta_name: str, meta_value: str) -> bool:
+        """Apply one meta field in `meta/<name>` topic format, returns True if control is changed."""
+        has_changes = False
+        if meta_name == 'type':
+            try:
+                has_changes |= control.apply_type(WirenControlType(meta_value))
+                if control.type in WIREN_UNITS_DICT:
+                    has_changes |= control.apply_units(WIREN_UNITS_DICT[control.type])
+            except ValueError:
+                if not meta_value in self._unknown_types:
+                    logger.warning(f'unknown type for wirenboard control: {meta_value}')
+                    self._unknown_types.add(meta_value)
+        elif meta_name == 'readonly':
+            has_changes |= control.apply_read_only(True if meta_value == '1' else False)
+        elif meta_name == 'units':
+            has_changes |= control.apply_units(meta_value)
+        elif meta_name == 'max':
+            has_changes |= control.apply_max(int(meta_value) if meta_value else None)
+        return has_changes
+
     def _control_state_handler(self, topic: str, payload: bytes):
         match = self._control_state_topic_re.match(topic)
         if match is None:
             logger.warning(f'not matched topic={topic} re={self._control_state_topic_re}')
             return
-        device_id, control_id, control_state = match.group(1), match.group(2), payload.decode('utf-8')
+        device_id, control_id = match.group(1), match.group(2)
 
         # Обработка специальных контролов.
         # В mqtt в wb системная информация зарегана под устройством system.
         # Вытаскиваем из system максимум информации, при этом не регаем его как отдельный контрол.
         # Конкретно тут пытаемся обогатить данными существующие девайсы.
         if device_id == 'system':
-            if self.process_system_control(device_id, control_id, control_state):
+            if self.process_system_control(device_id, control_id, payload.decode('utf-8')):
                 return
+        if not payload and self._find_control(device_id, control_id) is None:
+            return
         normilized_control_id = control_id.lower().replace(" ", "_")
         if normilized_control_id == 'serial':
-            device = self._device_registry.get_device(device_id)
-            device.serial_number = control_state
+            device = self._get_device(device_id)
+            device.serial_number = payload.decode('utf-8')
             self.hass.publish_device_config(device)
             return
-        device = self._device_registry.get_device(device_id)
+        device = self._get_device(device_id)
         control = device.get_control(control_id)
-        control.state = control_state
+        # Payload is passed to Home Assistant as is, without decoding and encoding again
+        control.state = payload
+        if self._pending_commands:
+            sent_at = self._pending_commands.pop((device_id, control_id), None)
+            if sent_at is not None and (rtt := time.perf_counter() - sent_at) < COMMAND_ECHO_TIMEOUT:
+                self._command_rtt.observe(rtt)
         self.hass.publish_control_state(device, control)
 
+    def _get_device(self, device_id: str) -> WirenDevice:
+        if device_id in self._evicted_devices:
+            self._evicted_devices.discard(device_id)
+            self._refetch_meta(device_id)
+        # Registry is shared between controllers, so device IDs are prefixed
+        device = self._device_registry.get_device(self._device_id_prefix + device_id)
+        device.last_seen = time.monotonic()
+        return device
+
+    def _find_device(self, device_id: str) -> WirenDevice | None:
+        return self._device_registry.find_device(self._device_id_prefix + device_id)
+
+    def _find_control(self, device_id: str, control_id: str) -> tuple[WirenDevice, WirenControl] | None:
+        # Unlike _get_device, known device and control are not created
+        device = self._find_device(device_id)
+        if device is None or control_id not in device.controls:
+            return None
+        return device, device.controls[control_id]
+
+    def remove_control(self, device: WirenDevice, control: WirenControl):
+        logger.info(f"[{device.debug_id}/{control.debug_id}] control removed")
+        self._forget_commands(device, control)
+        self.hass.remove_control(device, control)
+        device.remove_control(control.id)
+        if not device.controls:
+            self.remove_device(device)
+
+    def remove_device(self, device: WirenDevice):
+        logger.info(f"[{device.debug_id}] device removed")
+        for control in device.controls.values():
+            self._forget_commands(device, control)
+        self.hass.remove_device(device)
+        self._device_registry.remove_device(device.device_id)
+
+    def evict_device(self, device: WirenDevice):
+        """
+        Remove device, which sends no messages, from memory and Home Assistant.
+        Its retained meta is fetched again, when it is back, so its entities are discovered again.
+        """
+        self.remove_device(device)
+        self._evicted_devices.add(device.device_id.removeprefix(self._device_id_prefix))
+
+    def _refetch_meta(self, device_id: str):
+        # Broker delivers retained messages on subscribe, router passes them to handlers of general subscriptions
+        logger.info(f"[{device_id}] evicted device is back, fetching its meta")
+        topic_filters = [
+            (f'/devices/{device_id}/meta/+', self._device_meta_handler),
+            (f'/devices/{device_id}/controls/+/meta/+', self._control_meta_handler),
+            (f'/devices/{device_id}/controls/+/meta', self._control_meta_json_handler),
+        ]
+        for topic_filter, handler in topic_filters:
+            self._router.subscribe(topic_filter, handler, qos=self._subscribe_qos)
+        asyncio.get_event_loop().call_later(META_REFETCH_TIMEOUT, self._unsubscribe, [f for f, _ in topic_filters])
+
+    def _unsubscribe(self, topic_filters: list[str]):
+        for topic_filter in topic_filters:
+            self._router.unsubscribe(topic_filter)
+
+    def _forget_commands(self, device: WirenDevice, control: WirenControl):
+        key = (device.device_id.removeprefix(self._device_id_prefix), control.id)
+        self._command_topics.pop(key, None)
+        self._pending_commands.pop(key, None)
+
+    @property
+    def device_id_prefix(self) -> str:
+        return self._device_id_prefix
+
     def is_known_system_control(self, control_id: str) -> bool:
         return control_id.lower().replace(" ", "_") in _known_system_controls
 
@@ -164,7 +337,7 @@ class Wirenboard:
         if not self.is_known_system_control(control_id):
             return False
 
-        device = self._device_registry.get_device(device_id)
+        device = self._get_device(device_id)
         normalized_control_id = control_id.lower().replace(" ", "_")
         if normalized_control_id == 'hw_revision':
             device.hw_version = value
@@ -178,7 +351,23 @@ class Wirenboard:
         self.hass.publish_device_config(device)
         return True
 
-    def on_control_set_state(self, device_id: str, control_id: str, control_state: str):
-        self._router.publish(f"/devices/{device_id}/controls/{control_id}/on", control_state, qos=self._publish_qos, retain=self._publish_retain)
+    def on_control_set_state(self, device_id: str, control_id: str, control_state: bytes):
+        key = (device_id.removeprefix(self._device_id_prefix), control_id)
+        topic = self._command_topics.get(key)
+        if topic is None:
+            topic = self._command_topics[key] = f"/devices/{key[0]}/controls/{control_id}/on"
+        self._pending_commands[key] = time.perf_counter()
+        self._router.publish(topic, control_state, qos=self._publish_qos, retain=self._publish_retain)
+
+_known_system_controls = ['hw_revision', 'short_sn', 'release_name']
+
+# Fields of JSON meta, which are used in configs. Type goes first: it sets default units.
+_json_meta_fields = ('type', 'readonly', 'units', 'max')
 
-_known_system_controls = ['hw_revision', 'short_sn', 'release_name']
\ No newline at end of file
+def _json_meta_value(value) -> str:
+    """Convert JSON meta value to format of `meta/<name>` topic."""
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value) if value is not None else ''
\ No newline at end of file
@@ -1,4 +1,5 @@
 import logging
+import time
 from typing import Callable, Protocol
 
 from ha_wb_discovery.mappers import WirenControlType
@@ -12,7 +13,8 @@ class WirenControl:
     error: bool | None
     units: str | None
     max: float | None
-    state: str | None
+    # Payload as received, it is decoded only when value is needed
+    state: bytes | None
     device_id: str
 
     def __init__(self, device_id: str, control_id: str):
@@ -64,7 +66,7 @@ class WirenControl:
             return True
 
     def __str__(self) -> str:
-        return f'Control [{self.id}] type: {self.type}, units: {self.units}, read_only: {self.read_only}, error: {self.error}, max: {self.max}, state: {self.state}'
+        return f'Control [{self.id}] type: {self.type}, units: {self.units}, read_only: {self.read_only}, error: {self.error}, max: {self.max}, state: {self.state!r}'
 
 class WirenDevice:
     device_id: str
@@ -74,10 +76,13 @@ class WirenDevice:
     hw_version: str | None = None
     sw_version: str | None = None
     serial_number: str | None = None
+    # time.monotonic() of last message from the device
+    last_seen: float
     _controls: dict[str, WirenControl]
 
     def __init__(self, device_id):
         self.device_id = device_id
+        self.last_seen = time.monotonic()
         self.manufactorer = 'Wiren Board'
         self._controls = {}
 
@@ -92,9 +97,12 @@ class WirenDevice:
     def get_control(self, control_id) -> WirenControl:
         if control_id not in self._controls.keys():
             self._controls[control_id] = WirenControl(self.device_id, control_id)
-            logger.debug(f'{self}: new control: {control_id}')
+            logger.debug('%s: new control: %s', self, control_id)
         return self._controls[control_id]
 
+    def remove_control(self, control_id: str) -> WirenControl | None:
+        return self._controls.pop(control_id, None)
+
     def __str__(self) -> str:
         return f'Device [{self.device_id}] {self.name}'
 
@@ -118,6 +126,18 @@ class WirenBoardDeviceRegistry:
     def get_device(self, device_id: str) -> WirenDevice:
         if self._wb_devices.get(device_id) is None:
             self._wb_devices[device_id] = WirenDevice(device_id)
-            logger.debug(f'New device: {device_id}')
+            logger.debug('New device: %s', device_id)
 
         return self._wb_devices[device_id]
+
+    def find_device(self, device_id: str) -> WirenDevice | None:
+        return self._wb_devices.get(device_id)
+
+    def remove_device(self, device_id: str) -> WirenDevice | None:
+        device = self._wb_devices.pop(device_id, None)
+        if device is not None:
+            logger.debug(f'Device removed: {device_id}')
+        return device
+
+    def stale_devices(self, last_seen_before: float) -> list[WirenDevice]:
+        return [d for d in self._wb_devices.values() if d.last_seen < last_seen_before]
@@ -0,0 +1,71 @@
+"""Fake MQTT clients shared by tests, which record messages instead of sending them to broker."""
+import asyncio
+from typing import NamedTuple
+
+from ha_wb_discovery.metrics import MetricsRegistry
+from ha_wb_discovery.mqtt_conn.inflight import InflightStorage
+
+class Published(NamedTuple):
+    topic: str
+    payload: str | bytes
+    qos: int
+    retain: bool
+    topic_alias: int | None
+
+class RecordingClient:
+    """Records published messages and active subscriptions."""
+    published: list[Published]
+    subscriptions: list[str]
+
+    def __init__(self):
+        self.published = []
+        self.subscriptions = []
+
+    def subscribe(self, topic: str, qos: int = 0):
+        self.subscriptions.append(topic)
+
+    def unsubscribe(self, topic: str):
+        self.subscriptions.remove(topic)
+
+    def publish(self, topic: str, payload: str | bytes, qos: int = 0, retain: bool = False, **properties):
+        self.published.append(Published(topic, payload, qos, retain, properties.get('topic_alias')))
+
+    async def connect(self, *args, **kwargs):
+        # Broker accepts connection at once
+        self.on_connect(self, 0, 0, {})
+
+    async def disconnect(self):
+        pass
+
+    def messages(self) -> list[tuple[str, str | bytes]]:
+        """Topics and payloads of published messages."""
+        return [(m.topic, m.payload) for m in self.published]
+
+class AckingClient(RecordingClient):
+    """
+    gmqtt like client, which keeps QoS 1 messages in storage until acknowledgement.
+    Messages are acknowledged by test or by broker after `ack_delay` seconds.
+    """
+    def __init__(self, registry: MetricsRegistry, ack_delay: float | None = None):
+        super().__init__()
+        self._persistent_storage = InflightStorage('homeassistant', metrics_registry=registry)
+        self._mid = 0
+        self._ack_delay = ack_delay
+
+    def publish(self, topic: str, payload: str | bytes, qos: int = 0, retain: bool = False, **properties):
+        super().publish(topic, payload, qos, retain, **properties)
+        if qos > 0:
+            self._mid += 1
+            self._persistent_storage.push_message_nowait(self._mid, b'')
+            if self._ack_delay is not None:
+                asyncio.get_running_loop().call_later(self._ack_delay, self._broker_ack, self._mid)
+
+    def _broker_ack(self, mid: int):
+        asyncio.get_running_loop().create_task(self.ack(mid))
+
+    async def ack(self, mid: int):
+        await self._persistent_storage.remove_message_by_mid(mid)
+
+    async def ack_all(self):
+        for mid in list(self._persistent_storage._sent):
+            await self.ack(mid)
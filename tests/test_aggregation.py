@@ -0,0 +1,120 @@
+import asyncio
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ha_wb_discovery.aggregation import AggregationFunction, AggregationRule, Aggregator
+from ha_wb_discovery.homeassistant import HomeAssistant, HomeAssistantDiscoveryCustomizer
+from ha_wb_discovery.mappers import WirenControlType
+from ha_wb_discovery.metrics import MetricsRegistry
+from ha_wb_discovery.mqtt_conn.mqtt_client import MQTTRouter
+from ha_wb_discovery.timer_wheel import TimerWheel
+from ha_wb_discovery.wirenboard_registry import WirenBoardDeviceRegistry
+from tests.mqtt_clients import RecordingClient
+
+class RecordingHass:
+    def __init__(self):
+        self.states = []
+
+    def publish_control_state(self, device, control, state=None):
+        self.states.append((control.id, state if state is not None else control.state))
+
+    def __getattr__(self, name):
+        return lambda *args: None
+
+def test_timer_wheel_expires_keys():
+    expired = []
+
+    async def run():
+        wheel = TimerWheel(expired.append, tick=0.01, slots=4)
+        wheel.schedule('a', 0.02)
+        # Delay is longer than one turn of wheel
+        wheel.schedule('b', 0.07)
+        wheel.schedule('c', 0.03)
+        wheel.cancel('c')
+        await asyncio.sleep(0.045)
+        assert expired == ['a']
+        assert 'b' in wheel and len(wheel) == 1
+        await asyncio.sleep(0.05)
+        assert expired == ['a', 'b']
+        assert wheel._handle is None
+    asyncio.run(run())
+
+def test_aggregation_per_window():
+    registry = WirenBoardDeviceRegistry()
+    device = registry.get_device('wb-map12h_1')
+    power = device.get_control('Ch 1 P')
+    power.apply_type(WirenControlType.power)
+    voltage = device.get_control('Urms L1')
+    voltage.apply_type(WirenControlType.voltage)
+    relay = device.get_control('K1')
+    relay.apply_type(WirenControlType.switch)
+    hass = RecordingHass()
+    aggregator = Aggregator(hass, [
+        AggregationRule(0.05, AggregationFunction.mean, control_type=WirenControlType.power),
+        AggregationRule(0.05, AggregationFunction.max, entity_id='wb_map12h_1_urms*'),
+    ], tick=0.01, registry=MetricsRegistry())
+
+    def receive(control, state):
+        control.state = state
+        aggregator.publish_control_state(device, control)
+
+    async def run():
+        for p, u in ((b'100', b'230.1'), (b'110', b'231.5'), (b'120.5', b'229')):
+            receive(power, p)
+            receive(voltage, u)
+        # Controls without rule are published immediately
+        receive(relay, b'1')
+        assert hass.states == [('K1', b'1')]
+        await asyncio.sleep(0.08)
+        assert sorted(hass.states[1:]) == [('Ch 1 P', b'110.16666666666667'), ('Urms L1', b'231.5')]
+        # Last aggregated state is published with config, current state of controls without rule
+        power.state = b'125'
+        assert aggregator.state_of(device, power) == b'110.16666666666667'
+        assert aggregator.state_of(device, relay) == b'1'
+
+        # Non-numeric state closes window and is published as is
+        hass.states.clear()
+        receive(power, b'200')
+        receive(power, b'error')
+        assert hass.states == [('Ch 1 P', b'200'), ('Ch 1 P', b'error')]
+
+        # Open windows are published on flush and dropped on removal
+        hass.states.clear()
+        receive(power, b'300')
+        receive(voltage, b'230')
+        aggregator.remove_control(device, voltage)
+        aggregator.flush()
+        assert hass.states == [('Ch 1 P', b'300')]
+    asyncio.run(run())
+
+def test_config_is_published_with_aggregated_state():
+    registry = WirenBoardDeviceRegistry()
+    device = registry.get_device('wb-map12h_1')
+    device.name = 'WB-MAP12H'
+    power = device.get_control('Ch 1 P')
+    power.apply_type(WirenControlType.power)
+    client = RecordingClient()
+    metrics_registry = MetricsRegistry()
+    ha = HomeAssistant(MQTTRouter(client, 'homeassistant', metrics_registry=metrics_registry), registry,
+                       HomeAssistantDiscoveryCustomizer(), 0, 0, metrics_registry=metrics_registry)
+    aggregator = Aggregator(ha, [AggregationRule(0.05, control_type=WirenControlType.power)], tick=0.01, registry=metrics_registry)
+    ha.state_of = aggregator.state_of
+    topic = '/devices/wb-map12h_1/controls/Ch 1 P'
+
+    async def run():
+        for state in (b'0.1', b'0.2'):
+            power.state = state
+            aggregator.publish_control_state(device, power)
+        await asyncio.sleep(0.08)
+        assert (topic, b'0.15000000000000002') in client.messages()
+
+        # Republished config carries last aggregate, not sample of open window
+        client.published.clear()
+        power.state = b'0.5'
+        aggregator.publish_control_state(device, power)
+        aggregator.publish_control_config(device, power)
+        await asyncio.sleep(0.01)
+        assert [payload for t, payload in client.messages() if t == topic] == [b'0.15000000000000002']
+        aggregator.flush()
+    asyncio.run(run())
@@ -0,0 +1,57 @@
+import asyncio
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ha_wb_discovery.homeassistant import HomeAssistant, HomeAssistantDiscoveryCustomizer
+from ha_wb_discovery.mappers import WirenControlType
+from ha_wb_discovery.mqtt_conn.mqtt_client import MQTTRouter
+from ha_wb_discovery.wirenboard_registry import WirenBoardDeviceRegistry
+from tests.mqtt_clients import RecordingClient
+
+def test_bootstrap_from_retained_configs():
+    client = RecordingClient()
+    registry = WirenBoardDeviceRegistry()
+    for control_id in ('K1', 'K2'):
+        device = registry.get_device('wb-mr6c_1')
+        device.name = 'WB-MR6C'
+        control = device.get_control(control_id)
+        control.apply_type(WirenControlType.switch)
+        control.apply_error(False)
+        control.state = b'1'
+    router = MQTTRouter(client, 'homeassistant')
+    ha = HomeAssistant(router, registry, HomeAssistantDiscoveryCustomizer(), 0, 0, bootstrap_retained_configs=True)
+    device = registry.get_device('wb-mr6c_1')
+    k1_topic, k1_config = ha._build_control_config(device, device.controls['K1'])
+    k2_topic, k2_config = ha._build_control_config(device, device.controls['K2'])
+    orphan_topic = 'homeassistant/switch/wb_mr6c_1/k3/config'
+    foreign_topic = 'homeassistant/sensor/0x00158d0001/temperature/config'
+    # Another instance bridges other controller with same topic layout to same broker
+    other_instance_topic = 'homeassistant/switch/wb_mr6c_2/k1/config'
+
+    def receive(topic: str, payload: str):
+        router._on_message(None, topic, payload.encode('utf-8'), 0, {})
+
+    async def run():
+        ha.on_connect()
+        receive(k1_topic, k1_config)
+        receive(k2_topic, k2_config.replace('WB-MR6C', 'old name'))
+        receive(orphan_topic, k1_config.replace('K1', 'K3'))
+        receive(foreign_topic, '{"availability_topic": "zigbee2mqtt/bridge/state"}')
+        receive(other_instance_topic, k1_config.replace('wb-mr6c_1', 'wb-mr6c_2').replace('"ha-wb-discovery"', '"ha-wb-discovery-2"'))
+        await asyncio.sleep(0.05)
+
+        configs = [(topic, payload) for topic, payload in client.messages() if topic.endswith('/config')]
+        assert configs == [(k2_topic, k2_config)]
+
+        client.published.clear()
+        ha.finish_bootstrap()
+        assert client.messages() == [(orphan_topic, '')]
+        assert 'homeassistant/+/+/+/config' not in client.subscriptions
+
+        # After bootstrap configs are published as usual
+        client.published.clear()
+        ha.publish_control_config(device, device.controls['K1'])
+        await asyncio.sleep(0.05)
+        assert (k1_topic, k1_config) in client.messages()
+    asyncio.run(run())
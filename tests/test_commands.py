@@ -0,0 +1,100 @@
+import asyncio
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ha_wb_discovery.homeassistant import HomeAssistant, HomeAssistantDiscoveryCustomizer
+from ha_wb_discovery.metrics import MetricsRegistry
+from ha_wb_discovery.mqtt_conn.mqtt_client import MQTTRouter
+from ha_wb_discovery.wirenboard import Wirenboard
+from ha_wb_discovery.wirenboard_registry import WirenBoardDeviceRegistry
+from tests.mqtt_clients import RecordingClient
+
+def test_command_fast_path():
+    wb_client, ha_client = RecordingClient(), RecordingClient()
+    registry = WirenBoardDeviceRegistry()
+    metrics = MetricsRegistry()
+    ha_router = MQTTRouter(ha_client, 'homeassistant')
+    ha = HomeAssistant(ha_router, registry, HomeAssistantDiscoveryCustomizer(), 0, 0)
+    wb_router = MQTTRouter(wb_client, 'wirenboard')
+    wb = Wirenboard(wb_router, registry, ha, device_id_prefix='wb1_', metrics_registry=metrics)
+    ha.on_control_set_state = wb.on_control_set_state
+
+    def receive(router, topic: str, payload: str):
+        router._on_message(None, topic, payload.encode('utf-8'), 0, {})
+
+    async def run():
+        ha.on_connect()
+        wb.on_connect()
+        receive(wb_router, '/devices/wb-mr6c_1/meta/name', 'WB-MR6C')
+        receive(wb_router, '/devices/wb-mr6c_1/controls/K1/meta/type', 'switch')
+        receive(wb_router, '/devices/wb-mr6c_1/controls/K1', '0')
+        await asyncio.sleep(0.05)
+        assert list(ha_router._fast_routes) == ['/devices/wb1_wb-mr6c_1/controls/K1/on']
+
+        # Command is published to Wiren Board without waiting for event loop
+        receive(ha_router, '/devices/wb1_wb-mr6c_1/controls/K1/on', '1')
+        # Payloads are passed as bytes in both directions
+        assert wb_client.messages() == [('/devices/wb-mr6c_1/controls/K1/on', b'1')]
+        # Unknown entity goes through general handler
+        receive(ha_router, '/devices/wb1_wb-mr6c_2/controls/K1/on', '1')
+        assert wb_client.messages()[-1] == ('/devices/wb-mr6c_2/controls/K1/on', b'1')
+
+        receive(wb_router, '/devices/wb-mr6c_1/controls/K1', '1')
+        assert metrics.summary('command_rtt_seconds').count == 1
+        # State change without command is not counted
+        receive(wb_router, '/devices/wb-mr6c_1/controls/K1', '0')
+        assert metrics.summary('command_rtt_seconds').count == 1
+
+        receive(wb_router, '/devices/wb-mr6c_1/controls/K1/meta/type', '')
+        assert ha_router._fast_routes == {}
+        await asyncio.sleep(0.05)
+    asyncio.run(run())
+
+def test_command_echo_suppression():
+    wb_client, ha_client = RecordingClient(), RecordingClient()
+    registry = WirenBoardDeviceRegistry()
+    metrics = MetricsRegistry()
+    ha_router = MQTTRouter(ha_client, 'homeassistant')
+    ha = HomeAssistant(ha_router, registry, HomeAssistantDiscoveryCustomizer(), 0, 0, suppress_command_echo=True, metrics_registry=metrics)
+    wb_router = MQTTRouter(wb_client, 'wirenboard')
+    wb = Wirenboard(wb_router, registry, ha)
+    ha.on_control_set_state = wb.on_control_set_state
+
+    def receive(router, topic: str, payload: str):
+        router._on_message(None, topic, payload.encode('utf-8'), 0, {})
+
+    async def run():
+        ha.on_connect()
+        wb.on_connect()
+        receive(wb_router, '/devices/wb-mr6c_1/meta/name', 'WB-MR6C')
+        for control_id in ('K1', 'K2'):
+            receive(wb_router, f'/devices/wb-mr6c_1/controls/{control_id}/meta/type', 'switch')
+            receive(wb_router, f'/devices/wb-mr6c_1/controls/{control_id}', '0')
+        await asyncio.sleep(0.05)
+        assert any('"optimistic": true' in payload for topic, payload in ha_client.messages() if topic.endswith('/config'))
+
+        ha_client.published.clear()
+        receive(ha_router, '/devices/wb-mr6c_1/controls/K1/on', '1')
+        receive(ha_router, '/devices/wb-mr6c_1/controls/K2/on', '1')
+        receive(wb_router, '/devices/wb-mr6c_1/controls/K1', '1')
+        # Device did not switch relay, Home Assistant must know it
+        receive(wb_router, '/devices/wb-mr6c_1/controls/K2', '0')
+        # Next change is not echo
+        receive(wb_router, '/devices/wb-mr6c_1/controls/K1', '1')
+        await asyncio.sleep(0.05)
+        assert ha_client.messages() == [
+            ('/devices/wb-mr6c_1/controls/K2', b'0'),
+            ('/devices/wb-mr6c_1/controls/K1', b'1'),
+        ]
+        assert metrics.counter('command_echo_suppressed').value == 1
+
+        # Explicit state, e.g. aggregated one, is compared with command instead of current state
+        ha_client.published.clear()
+        control = registry.get_device('wb-mr6c_1').controls['K2']
+        receive(ha_router, '/devices/wb-mr6c_1/controls/K2/on', '1')
+        ha.publish_control_state(registry.get_device('wb-mr6c_1'), control, b'1')
+        await asyncio.sleep(0.05)
+        assert ha_client.messages() == []
+        assert metrics.counter('command_echo_suppressed').value == 2
+    asyncio.run(run())
@@ -0,0 +1,85 @@
+import asyncio
+import json
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from voluptuous import Invalid
+
+from ha_wb_discovery.app import App
+from ha_wb_discovery.config import config_schema_builder, general_config
+from ha_wb_discovery.homeassistant import HomeAssistantDiscoveryCustomizer
+from ha_wb_discovery.mqtt_conn.local_mqtt import LocalMQTTClient
+
+def write_messages(path: str, messages: list[tuple[str, str]]):
+    with open(path, 'wt') as f:
+        for topic, payload in messages:
+            f.write(json.dumps({'topic': topic, 'payload': payload}) + '\n')
+
+def read_messages(path: str) -> list[tuple[str, str]]:
+    with open(path) as f:
+        return [(msg['topic'], msg['payload']) for msg in map(json.loads, f)]
+
+def wb_input(control_id: str, state: str) -> list[tuple[str, str]]:
+    # Same device ID on both controllers
+    return [
+        ('/devices/wb-mr6c_1/meta/name', 'WB-MR6C 1'),
+        (f'/devices/wb-mr6c_1/controls/{control_id}/meta/type', 'switch'),
+        (f'/devices/wb-mr6c_1/controls/{control_id}/meta/error', ''),
+        (f'/devices/wb-mr6c_1/controls/{control_id}', state),
+    ]
+
+def test_several_controllers(tmp_path):
+    cfg = config_schema_builder({})({
+        "homeassistant": {'broker_host': 'localhost', 'config_first_publish_delay': 0},
+        "wirenboard": [
+            {'broker_host': 'wb-kitchen', 'device_id_prefix': 'kitchen_'},
+            {'broker_host': 'wb-hall', 'device_id_prefix': 'hall_'},
+        ],
+        "general.watchdog_interval": 0,
+    })
+    write_messages(os.path.join(tmp_path, 'kitchen.input.txt'), wb_input('K1', '1'))
+    write_messages(os.path.join(tmp_path, 'hall.input.txt'), wb_input('K2', '0'))
+    write_messages(os.path.join(tmp_path, 'ha.input.txt'), [
+        ('/devices/hall_wb-mr6c_1/controls/K2/on', '1'),
+        ('/devices/kitchen_wb-mr6c_1/controls/K1/on', '0'),
+    ])
+
+    async def run():
+        wb_mqtt_clients = [
+            LocalMQTTClient(os.path.join(tmp_path, f'{name}.input.txt'), os.path.join(tmp_path, f'{name}.output.txt'))
+            for name in ('kitchen', 'hall')
+        ]
+        ha_mqtt_client = LocalMQTTClient(os.path.join(tmp_path, 'ha.input.txt'), os.path.join(tmp_path, 'ha.output.txt'))
+        app = App(cfg["homeassistant"], cfg["wirenboard"], ha_mqtt_client, wb_mqtt_clients,
+                  HomeAssistantDiscoveryCustomizer.from_config(cfg), general_config(cfg))
+        completed = 0
+        async def on_disconnect(a, b):
+            nonlocal completed
+            completed += 1
+            if completed == 3:
+                await app.stop()
+        for client in [ha_mqtt_client, *wb_mqtt_clients]:
+            client.on_disconnect = on_disconnect
+        await app.run()
+    asyncio.run(run())
+
+    ha_topics = {topic for topic, _ in read_messages(os.path.join(tmp_path, 'ha.output.txt'))}
+    assert ha_topics == {
+        'homeassistant/switch/kitchen_wb_mr6c_1/k1/config',
+        '/devices/kitchen_wb-mr6c_1/controls/K1/availability',
+        '/devices/kitchen_wb-mr6c_1/controls/K1',
+        'homeassistant/switch/hall_wb_mr6c_1/k2/config',
+        '/devices/hall_wb-mr6c_1/controls/K2/availability',
+        '/devices/hall_wb-mr6c_1/controls/K2',
+    }
+    # Commands are routed by prefix and published without it
+    assert read_messages(os.path.join(tmp_path, 'kitchen.output.txt')) == [('/devices/wb-mr6c_1/controls/K1/on', '0')]
+    assert read_messages(os.path.join(tmp_path, 'hall.output.txt')) == [('/devices/wb-mr6c_1/controls/K2/on', '1')]
+
+def test_duplicate_device_id_prefix():
+    with pytest.raises(Invalid):
+        config_schema_builder({})({
+            "wirenboard": [{'broker_host': 'wb-kitchen'}, {'broker_host': 'wb-hall'}],
+        })
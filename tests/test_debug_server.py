@@ -0,0 +1,60 @@
+import asyncio
+import json
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ha_wb_discovery.debug_server import DebugServer, json_chunks
+from ha_wb_discovery.homeassistant import HomeAssistant, HomeAssistantDiscoveryCustomizer
+from ha_wb_discovery.mappers import WirenControlType
+from ha_wb_discovery.metrics import MetricsRegistry
+from ha_wb_discovery.mqtt_conn.mqtt_client import MQTTRouter
+from ha_wb_discovery.wirenboard_registry import WirenBoardDeviceRegistry
+from tests.mqtt_clients import RecordingClient
+
+def test_json_chunks():
+    value = {'a': [1, 'x', None], 'b': {'c': True}, 'd': (i * 2 for i in range(3))}
+    assert json.loads(''.join(json_chunks(value))) == {'a': [1, 'x', None], 'b': {'c': True}, 'd': [0, 2, 4]}
+
+async def get(path: str, socket_path: str) -> tuple[str, dict]:
+    reader, writer = await asyncio.open_unix_connection(socket_path)
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+    response = (await reader.read()).decode()
+    writer.close()
+    head, body = response.split('\r\n\r\n', 1)
+    return head.split('\r\n')[0], json.loads(body)
+
+def test_debug_endpoint(tmp_path):
+    registry = WirenBoardDeviceRegistry()
+    for i in range(3000):
+        control = registry.get_device(f'wb-mr6c_{i}').get_control('K1')
+        control.apply_type(WirenControlType.switch)
+        control.state = b'1'
+    ha = HomeAssistant(MQTTRouter(RecordingClient(), 'homeassistant'), registry, HomeAssistantDiscoveryCustomizer(), 10, 0)
+    metrics = MetricsRegistry()
+    metrics.counter('messages', source='test').inc()
+    socket_path = str(tmp_path / 'debug.sock')
+
+    async def run():
+        ha.publish_control_config(registry.get_device('wb-mr6c_0'), registry.get_device('wb-mr6c_0').get_control('K1'))
+        server = DebugServer(f'unix:{socket_path}', lambda: {'devices': list(registry.devices()), 'homeassistant': ha.debug_state()}, metrics)
+        await server.start()
+        try:
+            status, state = await get('/state', socket_path)
+            assert status == 'HTTP/1.1 200 OK'
+            assert len(state['devices']) == 3000
+            assert state['homeassistant']['pending_tasks'] == ['wb-mr6c_0_K1_config']
+            assert state['homeassistant']['waiting_first_publish'] == ['wb_mr6c_0_k1']
+            assert state['homeassistant']['rate_limited'] == []
+
+            status, snapshot = await get('/metrics', socket_path)
+            assert status == 'HTTP/1.1 200 OK'
+            assert snapshot == json.loads(json.dumps(metrics.snapshot()))
+
+            status, _ = await get('/unknown', socket_path)
+            assert status == 'HTTP/1.1 404 Not Found'
+        finally:
+            await server.stop()
+            for task in ha._async_tasks.values():
+                task.cancel()
+    asyncio.run(run())
@@ -0,0 +1,80 @@
+import asyncio
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ha_wb_discovery.fair_queue import FairQueue
+from ha_wb_discovery.homeassistant import HomeAssistant, HomeAssistantDiscoveryCustomizer
+from ha_wb_discovery.mappers import WirenControlType
+from ha_wb_discovery.metrics import MetricsRegistry
+from ha_wb_discovery.mqtt_conn.mqtt_client import MQTTRouter
+from ha_wb_discovery.wirenboard_registry import WirenBoardDeviceRegistry
+from tests.mqtt_clients import AckingClient
+
+def test_fair_queue_round_robin():
+    registry = MetricsRegistry()
+    queue: FairQueue[str, int] = FairQueue(quantum=2, metrics_registry=registry)
+    for i in range(5):
+        queue.put('meter', f'P{i}', i)
+    queue.put('door', 'open', 1)
+    # Queued item is replaced and keeps its place
+    queue.put('meter', 'P0', 10)
+    assert len(queue) == 6
+    assert queue.depth('meter') == 5
+    assert registry.gauge('publish_queue_depth', device='meter').value == 5
+
+    popped = []
+    while (item := queue.pop()) is not None:
+        popped.append(item)
+    assert popped == [
+        ('meter', 'P0', 10), ('meter', 'P1', 1),
+        ('door', 'open', 1),
+        ('meter', 'P2', 2), ('meter', 'P3', 3),
+        ('meter', 'P4', 4),
+    ]
+    assert registry.summary('publish_queue_wait').count == 6
+
+    queue.put('door', 'open', 0)
+    queue.remove_flow('door')
+    assert len(queue) == 0
+    assert ('device', 'door') not in {k for v in registry.snapshot()['gauges'].values() for g in v for k in g['labels'].items()}
+
+def test_quiet_device_is_not_delayed_by_chatty_one():
+    metrics_registry = MetricsRegistry()
+    client = AckingClient(metrics_registry)
+    router = MQTTRouter(client, 'homeassistant', metrics_registry=metrics_registry, max_inflight=2)
+    registry = WirenBoardDeviceRegistry()
+    meter = registry.get_device('wb-map12h_1')
+    for i in range(10):
+        control = meter.get_control(f'Ch {i} P')
+        control.apply_type(WirenControlType.power)
+        control.state = b'100'
+    door = registry.get_device('wb-mcm8_2').get_control('Input 1')
+    door.apply_type(WirenControlType.switch)
+    door.state = b'1'
+    ha = HomeAssistant(router, registry, HomeAssistantDiscoveryCustomizer(), 0, 0, metrics_registry=metrics_registry)
+
+    async def run():
+        router.on_connect({})
+        for control in meter.controls.values():
+            ha.publish_control_state(meter, control)
+        ha.publish_control_state(registry.get_device('wb-mcm8_2'), door)
+        await asyncio.sleep(0)
+        # Quiet device takes its turn before the rest of chatty device updates
+        assert client.messages() == [
+            ('/devices/wb-map12h_1/controls/Ch 0 P', b'100'),
+            ('/devices/wb-mcm8_2/controls/Input 1', b'1'),
+        ]
+        # Publishing waits for acknowledgements, when window is full
+        assert metrics_registry.gauge('publish_queue_depth', device='wb-map12h_1').value == 9
+        await client.ack_all()
+        await asyncio.sleep(0)
+        assert client.messages()[2:] == [
+            ('/devices/wb-map12h_1/controls/Ch 1 P', b'100'),
+            ('/devices/wb-map12h_1/controls/Ch 2 P', b'100'),
+        ]
+        # On shutdown queue is passed to router, which sends it as acknowledgements are received until deadline
+        await ha.drain(0.05)
+        assert metrics_registry.gauge('mqtt_inflight_waiting', client='homeassistant').value == 7
+        assert metrics_registry.gauge('publish_queue_depth', device='wb-map12h_1').value == 0
+    asyncio.run(run())
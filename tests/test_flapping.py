@@ -0,0 +1,69 @@
+import asyncio
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ha_wb_discovery.flapping import FlapGuard
+from ha_wb_discovery.mappers import WirenControlType
+from ha_wb_discovery.metrics import MetricsRegistry
+from ha_wb_discovery.wirenboard_registry import WirenBoardDeviceRegistry
+
+class RecordingHass:
+    def __init__(self):
+        self.published = []
+
+    def publish_control_state(self, device, control, state=None):
+        self.published.append((control.id, 'state', state if state is not None else control.state))
+
+    def publish_availability(self, device, control):
+        self.published.append((control.id, 'availability', not control.error))
+
+    def __getattr__(self, name):
+        return lambda *args: None
+
+def test_flapping_entity_is_throttled_and_recovers():
+    registry = WirenBoardDeviceRegistry()
+    device = registry.get_device('wb-mr6c_2')
+    broken = device.get_control('K1')
+    broken.apply_type(WirenControlType.switch)
+    healthy = device.get_control('K2')
+    healthy.apply_type(WirenControlType.switch)
+    hass = RecordingHass()
+    metrics_registry = MetricsRegistry()
+    guard = FlapGuard(hass, rate=10, burst=3, interval=0.05, tick=0.01, registry=metrics_registry)
+
+    def flap_error(error):
+        broken.apply_error(error)
+        guard.publish_availability(device, broken)
+
+    async def run():
+        for i in range(10):
+            flap_error(i % 2 == 1)
+        broken.state = b'1'
+        guard.publish_control_state(device, broken)
+        # Other entities are not affected
+        healthy.state = b'1'
+        guard.publish_control_state(device, healthy)
+        assert hass.published == [
+            ('K1', 'availability', True),
+            ('K1', 'availability', False),
+            ('K1', 'availability', True),
+            ('K2', 'state', b'1'),
+        ]
+        assert metrics_registry.gauge('flapping_entities').value == 1
+        assert metrics_registry.counter('flapping_suppressed_updates').value == 8
+
+        # Last availability and state are published once per interval
+        hass.published.clear()
+        await asyncio.sleep(0.07)
+        assert hass.published == [('K1', 'availability', False), ('K1', 'state', b'1')]
+
+        # Entity without updates during interval recovers
+        hass.published.clear()
+        await asyncio.sleep(0.07)
+        assert hass.published == []
+        assert metrics_registry.gauge('flapping_entities').value == 0
+        broken.state = b'0'
+        guard.publish_control_state(device, broken)
+        assert hass.published == [('K1', 'state', b'0')]
+    asyncio.run(run())
@@ -0,0 +1,65 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ha_wb_discovery.homeassistant import HomeAssistantDiscoveryCustomizer
+from ha_wb_discovery.id_matcher import IdMatcher
+
+def test_id_matcher():
+    matcher = IdMatcher(['wb_mr3_16', 'wb_mr6c_*_input_*_counter', r're:wb_msw_v3_\d+_k[12]', 'wb_mr6c_*'])
+    assert matcher.find('wb_mr3_16') == 'wb_mr3_16'
+    assert matcher.find('wb_mr3_161') is None
+    assert matcher.find('wb_mr6c_12_input_3_counter') == 'wb_mr6c_*_input_*_counter'
+    assert matcher.find('wb_msw_v3_42_k2') == r're:wb_msw_v3_\d+_k[12]'
+    # Whole ID must match
+    assert matcher.find('wb_msw_v3_42_k3') is None
+    assert matcher.find('x_wb_mr6c_1') is None
+    # First matched rule wins, cached verdict is the same
+    assert matcher.find('wb_mr6c_1') == 'wb_mr6c_*'
+    assert matcher.find('wb_mr6c_1') == 'wb_mr6c_*'
+
+def test_customizer_patterns():
+    customizer = HomeAssistantDiscoveryCustomizer(
+        ignored_device_control_ids=['wb_mr6c_*_input_*_counter'],
+        splitted_device_ids=['re:wb_mr3_\\d+'],
+        combined_devices=[{'device_id': 'wb_mdm3_*', 'new_device_id': 'dimmers', 'new_name': 'Dimmers'}],
+    )
+    assert customizer.is_ignored_control('wb_mr6c_1_input_2_counter')
+    assert not customizer.is_ignored_control('wb_mr6c_1_input_2')
+    assert customizer.is_splitted_device('wb_mr3_16')
+    combined = customizer.get_combined_device_id('wb_mdm3_7')
+    assert combined is not None and combined.new_device_id == 'dimmers'
+    # Default exact rules still work
+    combined = customizer.get_combined_device_id('wb_gpio')
+    assert combined is not None and combined.new_device_id == 'wirenboard'
+
+def test_id_matcher_rule_order():
+    # Exact ID does not win over earlier pattern
+    matcher = IdMatcher(['wb_mr6c_*', 'wb_mr6c_1', 'wb_mr3_1', 'wb_mr3_*'])
+    assert matcher.find('wb_mr6c_1') == 'wb_mr6c_*'
+    assert matcher.find('wb_mr3_1') == 'wb_mr3_1'
+    assert matcher.find('wb_mr3_2') == 'wb_mr3_*'
+
+def test_id_matcher_patterns_with_groups_and_flags():
+    # Such patterns can not be combined into one regular expression, they are matched separately in rules order
+    matcher = IdMatcher([
+        r're:(?i)WB_MSW_V3_\d+',
+        r're:(?P<x>wb_mr6c)_(?P<n>\d+)',
+        r're:(?P<x>wb_mr3)_1',
+        'wb_mr3_*',
+        r're:(wb_(\w)\w*)_\2+',
+    ])
+    assert matcher.find('wb_msw_v3_21') == r're:(?i)WB_MSW_V3_\d+'
+    assert matcher.find('wb_mr6c_1') == r're:(?P<x>wb_mr6c)_(?P<n>\d+)'
+    assert matcher.find('wb_mr3_1') == r're:(?P<x>wb_mr3)_1'
+    assert matcher.find('wb_mr3_2') == 'wb_mr3_*'
+    # Numbered backreference refers to group of its own rule
+    assert matcher.find('wb_gpio_gg') == r're:(wb_(\w)\w*)_\2+'
+    assert matcher.find('wb_gpio_x') is None
+
+def test_configured_combined_device_overrides_default():
+    customizer = HomeAssistantDiscoveryCustomizer(
+        combined_devices=[{'device_id': 'wb_gpio', 'new_device_id': 'gpio', 'new_name': 'GPIO'}],
+    )
+    combined = customizer.get_combined_device_id('wb_gpio')
+    assert combined is not None and combined.new_device_id == 'gpio'
@@ -0,0 +1,43 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ha_wb_discovery.mappers import WirenControlType
+from ha_wb_discovery.mqtt_conn.mqtt_client import MQTTRouter
+from ha_wb_discovery.wirenboard import Wirenboard
+from ha_wb_discovery.wirenboard_registry import WirenBoardDeviceRegistry
+from tests.mqtt_clients import RecordingClient
+
+class CountingHass:
+    def __init__(self):
+        self.config_publishes = 0
+
+    def publish_control_config(self, device, control):
+        self.config_publishes += 1
+
+    def __getattr__(self, name):
+        return lambda *args: None
+
+def test_json_meta_rebuilds_config_once():
+    registry = WirenBoardDeviceRegistry()
+    hass = CountingHass()
+    router = MQTTRouter(RecordingClient(), 'wirenboard')
+    wb = Wirenboard(router, registry, hass)
+    wb.on_connect()
+
+    def receive(topic: str, payload: str):
+        router._on_message(None, topic, payload.encode('utf-8'), 0, {})
+
+    receive('/devices/wb-msw-v3_21/controls/Humidity/meta', '{"type": "value", "readonly": true, "units": "%, RH", "max": 100.0, "order": 2}')
+    control = registry.get_device('wb-msw-v3_21').get_control('Humidity')
+    assert (control.type, control.read_only, control.units, control.max) == (WirenControlType.value, True, '%, RH', 100)
+    assert hass.config_publishes == 1
+
+    # Legacy topics with same values do not rebuild config
+    receive('/devices/wb-msw-v3_21/controls/Humidity/meta/type', 'value')
+    receive('/devices/wb-msw-v3_21/controls/Humidity/meta/readonly', '1')
+    receive('/devices/wb-msw-v3_21/controls/Humidity/meta/units', '%, RH')
+    assert hass.config_publishes == 1
+
+    receive('/devices/wb-msw-v3_21/controls/Humidity/meta', '{"type": "value", "readonly": true, "units": "%", "max": 100}')
+    assert hass.config_publishes == 2
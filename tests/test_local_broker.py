@@ -0,0 +1,92 @@
+import asyncio
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gmqtt.client import Client as MQTTClient
+from ha_wb_discovery.app import App
+from ha_wb_discovery.config import config_schema_builder, general_config
+from ha_wb_discovery.homeassistant import HomeAssistantDiscoveryCustomizer
+from ha_wb_discovery.mqtt_conn.local_broker import LocalMQTTBroker
+
+CONFIG_TOPIC = 'homeassistant/switch/wb_mr6c_1/k1/config'
+
+async def wait_for(condition, timeout: float = 5):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        assert loop.time() < deadline, "condition is not met in time"
+        await asyncio.sleep(0.01)
+
+async def connect(client_id: str, broker: LocalMQTTBroker) -> tuple[MQTTClient, list]:
+    client = MQTTClient(client_id)
+    client.set_config({'reconnect_delay': 0.1})
+    received: list[tuple[str, bytes, bool]] = []
+    client.on_message = lambda c, topic, payload, qos, properties: received.append((topic, payload, bool(properties.get('retain'))))
+    await client.connect('127.0.0.1', broker.port)
+    return client, received
+
+def test_app_with_real_mqtt_clients():
+    async def run():
+        wb_broker = LocalMQTTBroker()
+        ha_broker = LocalMQTTBroker(latency=0.005, topic_alias_maximum=10)
+        await wb_broker.start()
+        await ha_broker.start()
+        device, device_received = await connect('wb-mr6c', wb_broker)
+        for topic, payload in (
+            ('/devices/wb-mr6c_1/meta/name', 'WB-MR6C 1'),
+            ('/devices/wb-mr6c_1/controls/K1/meta/type', 'switch'),
+            ('/devices/wb-mr6c_1/controls/K1/meta/error', ''),
+            ('/devices/wb-mr6c_1/controls/K1', '1'),
+        ):
+            device.publish(topic, payload, qos=1, retain=True)
+        device.subscribe('/devices/+/controls/+/on')
+        # Empty retained payload is not stored
+        await wait_for(lambda: len(wb_broker.retained) == 3)
+        ha, ha_received = await connect('home-assistant', ha_broker)
+        ha.subscribe('homeassistant/#')
+        ha.subscribe('/devices/#')
+
+        cfg = config_schema_builder({})({
+            "homeassistant": {'broker_host': '127.0.0.1', 'broker_port': ha_broker.port,
+                              'config_first_publish_delay': 0, 'topic_alias_maximum': 10},
+            "wirenboard": {'broker_host': '127.0.0.1', 'broker_port': wb_broker.port},
+            "general.watchdog_interval": 0,
+        })
+        app_wb, app_ha = MQTTClient('app-wb'), MQTTClient('app-ha')
+        for client in (app_wb, app_ha):
+            client.set_config({'reconnect_delay': 0.1})
+        app = App(cfg["homeassistant"], cfg["wirenboard"], app_ha, app_wb, HomeAssistantDiscoveryCustomizer.from_config(cfg),
+                  general_config(cfg))
+        app_task = asyncio.get_running_loop().create_task(app.run())
+
+        # Retained Wiren Board messages are replayed on subscribe and discovery is published
+        await wait_for(lambda: ('/devices/wb-mr6c_1/controls/K1', b'1', False) in ha_received)
+        assert CONFIG_TOPIC in ha_broker.retained
+        # Command is routed to Wiren Board broker
+        ha.publish('/devices/wb-mr6c_1/controls/K1/on', '0', qos=1)
+        await wait_for(lambda: ('/devices/wb-mr6c_1/controls/K1/on', b'0', False) in device_received)
+
+        # After network failure clients reconnect and subscribe again
+        assert wb_broker.drop_connections('app-wb') == 1
+        assert ha_broker.drop_connections('app-ha') == 1
+        await wait_for(lambda: {'app-wb'} <= set(wb_broker.client_ids) and {'app-ha'} <= set(ha_broker.client_ids))
+        ha_received.clear()
+        await asyncio.sleep(0.2)
+        device.publish('/devices/wb-mr6c_1/controls/K1', '0', qos=1, retain=True)
+        await wait_for(lambda: ('/devices/wb-mr6c_1/controls/K1', b'0', False) in ha_received)
+
+        # New subscriber receives retained discovery with retain flag
+        late, late_received = await connect('late', ha_broker)
+        late.subscribe('homeassistant/+/+/+/config')
+        await wait_for(lambda: late_received != [])
+        assert late_received[0][0] == CONFIG_TOPIC
+        assert late_received[0][2]
+
+        await app.stop()
+        await app_task
+        for client in (device, ha, late):
+            await client.disconnect()
+        await wb_broker.stop()
+        await ha_broker.stop()
+    asyncio.run(run())
@@ -0,0 +1,72 @@
+import asyncio
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ha_wb_discovery.homeassistant import HomeAssistant, HomeAssistantDiscoveryCustomizer
+from ha_wb_discovery.mappers import WirenControlType
+from ha_wb_discovery.metrics import MetricsRegistry
+from ha_wb_discovery.mqtt_conn.mqtt_client import MQTTRouter
+from ha_wb_discovery.publish_policy import PublishPolicyRule
+from ha_wb_discovery.wirenboard_registry import WirenBoardDeviceRegistry
+from tests.mqtt_clients import AckingClient, Published, RecordingClient
+
+def test_publish_policy_per_entity():
+    client = RecordingClient()
+    registry = WirenBoardDeviceRegistry()
+    device = registry.get_device('wb-map12h_1')
+    power = device.get_control('Ch 1 P')
+    power.apply_type(WirenControlType.power)
+    relay = device.get_control('K1')
+    relay.apply_type(WirenControlType.switch)
+    temperature = device.get_control('Temperature')
+    temperature.apply_type(WirenControlType.temperature)
+    ha = HomeAssistant(MQTTRouter(client, 'homeassistant'), registry, HomeAssistantDiscoveryCustomizer(), 0, 0,
+                       availability_qos=1, availability_retain=True, state_qos=1, state_retain=True,
+                       publish_policy=[
+                           PublishPolicyRule(control_type=WirenControlType.power, state_qos=0, state_retain=False),
+                           PublishPolicyRule(entity_id='wb_map12h_1_t*', state_qos=2, availability_retain=False),
+                       ])
+
+    for control, state in ((power, b'100'), (relay, b'1'), (temperature, b'21.5')):
+        control.state = state
+        ha._publish_control_state_sync(device, control)
+        ha._publish_availability_sync(device, control)
+    assert client.published == [
+        Published('/devices/wb-map12h_1/controls/Ch 1 P', b'100', 0, False, None),
+        Published('/devices/wb-map12h_1/controls/Ch 1 P/availability', '1', 1, True, None),
+        # Controls without rule keep defaults
+        Published('/devices/wb-map12h_1/controls/K1', b'1', 1, True, None),
+        Published('/devices/wb-map12h_1/controls/K1/availability', '1', 1, True, None),
+        Published('/devices/wb-map12h_1/controls/Temperature', b'21.5', 2, True, None),
+        Published('/devices/wb-map12h_1/controls/Temperature/availability', '1', 1, False, None),
+    ]
+
+def test_inflight_window():
+    registry = MetricsRegistry()
+    client = AckingClient(registry)
+    router = MQTTRouter(client, 'homeassistant', metrics_registry=registry, max_inflight=2)
+
+    async def run():
+        # Broker allows less messages in flight
+        router.on_connect({'receive_maximum': [3]})
+        router.on_connect({'receive_maximum': [1]})
+        router.publish('a', '1', qos=1)
+        router.publish('b', '1', qos=1)
+        router.publish('c', '1', qos=1)
+        # Waiting message is replaced by newer one, QoS 0 messages are not limited
+        router.publish('b', '2', qos=1)
+        router.publish('d', '1', qos=0)
+        assert client.published == [Published('a', '1', 1, False, None), Published('d', '1', 0, False, None)]
+        assert registry.gauge('mqtt_inflight_waiting', client='homeassistant').value == 2
+
+        await client.ack(1)
+        assert client.published[2:] == [Published('b', '2', 1, False, None)]
+        await client.ack(2)
+        assert client.published[3:] == [Published('c', '1', 1, False, None)]
+        await client.ack(3)
+        assert registry.gauge('mqtt_inflight', client='homeassistant').value == 0
+        assert registry.gauge('mqtt_inflight_waiting', client='homeassistant').value == 0
+        assert registry.counter('mqtt_inflight_superseded', client='homeassistant').value == 1
+        assert registry.summary('mqtt_ack_latency', client='homeassistant').count == 3
+    asyncio.run(run())
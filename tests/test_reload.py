@@ -0,0 +1,60 @@
+import asyncio
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ha_wb_discovery.homeassistant import HomeAssistant, HomeAssistantDiscoveryCustomizer
+from ha_wb_discovery.mappers import WirenControlType
+from ha_wb_discovery.mqtt_conn.mqtt_client import MQTTRouter
+from ha_wb_discovery.wirenboard_registry import WirenBoardDeviceRegistry
+from tests.mqtt_clients import RecordingClient
+
+def fill_registry(registry: WirenBoardDeviceRegistry):
+    for device_id, control_ids in [('wb-mr6c_1', ['K1', 'K2']), ('wb-mr6c_2', ['K1']), ('wb-mr6c_3', ['K1'])]:
+        device = registry.get_device(device_id)
+        device.name = device_id
+        for control_id in control_ids:
+            control = device.get_control(control_id)
+            control.apply_type(WirenControlType.switch)
+            control.apply_error(False)
+            control.state = b'1'
+
+def test_reload_customizer_publishes_only_changes():
+    client = RecordingClient()
+    registry = WirenBoardDeviceRegistry()
+    fill_registry(registry)
+    ha = HomeAssistant(MQTTRouter(client, 'homeassistant'), registry, HomeAssistantDiscoveryCustomizer(), 0, 0)
+
+    async def run():
+        for device in registry.devices().values():
+            ha.publish_device_config(device)
+        await asyncio.sleep(0.05)
+        assert len([topic for topic, _ in client.messages() if topic.endswith('/config')]) == 4
+
+        client.published.clear()
+        ha.reload_customizer(HomeAssistantDiscoveryCustomizer(
+            ignored_device_control_ids=['wb_mr6c_1_k2'],
+            splitted_device_ids=['wb_mr6c_2'],
+        ))
+        await asyncio.sleep(0.05)
+        published = dict(client.messages())
+        assert published.keys() == {
+            'homeassistant/switch/wb_mr6c_1/k2/config',
+            'homeassistant/switch/wb_mr6c_2/k1/config',
+            'homeassistant/switch/wb_mr6c_2_k1/k1/config',
+            '/devices/wb-mr6c_2/controls/K1/availability',
+            '/devices/wb-mr6c_2/controls/K1',
+        }
+        # Removed and moved entities are deleted by empty config
+        assert published['homeassistant/switch/wb_mr6c_1/k2/config'] == ''
+        assert published['homeassistant/switch/wb_mr6c_2/k1/config'] == ''
+
+        client.published.clear()
+        ha.reload_customizer(HomeAssistantDiscoveryCustomizer())
+        await asyncio.sleep(0.05)
+        published = dict(client.messages())
+        assert published['homeassistant/switch/wb_mr6c_2_k1/k1/config'] == ''
+        assert published['homeassistant/switch/wb_mr6c_1/k2/config'] != ''
+        assert published['homeassistant/switch/wb_mr6c_2/k1/config'] != ''
+        assert not any(topic.startswith('homeassistant/switch/wb_mr6c_3/') for topic in published)
+    asyncio.run(run())
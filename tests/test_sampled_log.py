@@ -0,0 +1,28 @@
+import logging
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ha_wb_discovery.sampled_log import SampledLogger, configure_sampling
+
+def test_sampled_logger(caplog):
+    sampled_logger = SampledLogger(logging.getLogger('test_sampled_log'), 'test')
+    configure_sampling({'test': 3})
+    try:
+        with caplog.at_level(logging.DEBUG, logger='test_sampled_log'):
+            for i in range(7):
+                sampled_logger.debug('message %d', i)
+    finally:
+        configure_sampling({})
+    assert [r.getMessage() for r in caplog.records] == ['message 2 (2 skipped)', 'message 5 (2 skipped)']
+    assert sampled_logger.every == 1
+
+def test_sampled_logger_disabled_level(caplog):
+    class Unformattable:
+        def __str__(self):
+            raise AssertionError('message must not be formatted')
+
+    sampled_logger = SampledLogger(logging.getLogger('test_sampled_log'), 'test')
+    with caplog.at_level(logging.INFO, logger='test_sampled_log'):
+        sampled_logger.debug('message %s', Unformattable())
+    assert caplog.records == []
@@ -0,0 +1,176 @@
+import asyncio
+import json
+import os
+import socket
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ha_wb_discovery.app import App
+from ha_wb_discovery.config import config_schema_builder, general_config
+from ha_wb_discovery.homeassistant import HomeAssistantDiscoveryCustomizer
+from ha_wb_discovery.metrics import MetricsRegistry
+from ha_wb_discovery.mqtt_conn.local_mqtt import LocalMQTTClient
+from ha_wb_discovery.mqtt_conn.shard_mqtt import ShardLink
+from ha_wb_discovery.sharding import ShardedApp, _Worker, device_id_from_topic, shard_index
+
+class DeferredReplayClient(LocalMQTTClient):
+    """
+    Workers subscribe asynchronously after connect, so input is replayed only after all subscriptions are made,
+    as broker sends retained messages after subscribe.
+    """
+    def __init__(self, input_file: str, output_file: str, subscriptions: int):
+        super().__init__(input_file, output_file)
+        self._expected_subscriptions = subscriptions
+
+    async def connect(self, *args, **kwargs):
+        if self.on_connect is not None:
+            self.on_connect(self)
+        while len(self._subscriptions) < self._expected_subscriptions:
+            await asyncio.sleep(0.01)
+        await self.replay()
+
+def test_device_id_from_topic():
+    assert device_id_from_topic('/devices/wb-mr3_16/controls/K1') == 'wb-mr3_16'
+    assert device_id_from_topic('/devices/wb-mr3_16/meta/name') == 'wb-mr3_16'
+    assert device_id_from_topic('hass/status') is None
+
+def test_shard_index_is_stable():
+    assert shard_index('wb-mr3_16', 4) == shard_index('wb-mr3_16', 4)
+    assert {shard_index(f'wb-mr6c_{i}', 4) for i in range(100)} == {0, 1, 2, 3}
+
+def write_wb_input(path: str):
+    # Control ids are unique across devices: publish tasks are keyed by control id,
+    # so updates of same named controls of different devices may cancel each other depending on timing.
+    with open(path, 'wt') as f:
+        for d in range(8):
+            device_id = f'wb-mr6c_{d}'
+            f.write(json.dumps({'topic': f'/devices/{device_id}/meta/name', 'payload': f'WB-MR6C {d}'}) + '\n')
+            for c in range(3):
+                control_id = f'K{d}{c}'
+                f.write(json.dumps({'topic': f'/devices/{device_id}/controls/{control_id}/meta/type', 'payload': 'switch'}) + '\n')
+                f.write(json.dumps({'topic': f'/devices/{device_id}/controls/{control_id}/meta/error', 'payload': ''}) + '\n')
+        for r in range(3):
+            for d in range(8):
+                for c in range(3):
+                    f.write(json.dumps({'topic': f'/devices/wb-mr6c_{d}/controls/K{d}{c}', 'payload': str((r + c) % 2)}) + '\n')
+
+def read_final_states(path: str) -> dict[str, str]:
+    result = {}
+    with open(path) as f:
+        for line in f:
+            msg = json.loads(line)
+            result[msg['topic']] = msg['payload']
+    return result
+
+def run_app(app, wb_mqtt_client, ha_mqtt_client):
+    completed = 0
+    async def on_disconnect(a, b):
+        nonlocal completed
+        completed += 1
+        if completed == 2:
+            await app.stop()
+
+    wb_mqtt_client.on_disconnect = on_disconnect
+    ha_mqtt_client.on_disconnect = on_disconnect
+    return app.run()
+
+def test_sharded_app_publishes_same_states(tmp_path):
+    options = {
+        "homeassistant": {'broker_host': 'localhost', 'config_first_publish_delay': 0},
+        "wirenboard": {'broker_host': 'localhost'},
+        "general.watchdog_interval": 0,
+    }
+    wb_input_file = os.path.join(tmp_path, 'wb.input.txt')
+    ha_input_file = os.path.join(tmp_path, 'ha.input.txt')
+    write_wb_input(wb_input_file)
+    with open(ha_input_file, 'wt') as f:
+        f.write(json.dumps({'topic': '/devices/wb-mr6c_1/controls/K10/on', 'payload': '1'}) + '\n')
+        f.write(json.dumps({'topic': '/devices/wb-mr6c_2/controls/K21/on', 'payload': '0'}) + '\n')
+
+    cfg = config_schema_builder({})(options)
+    async def run_single():
+        wb_mqtt_client = LocalMQTTClient(wb_input_file, os.path.join(tmp_path, 'wb.single.txt'))
+        ha_mqtt_client = LocalMQTTClient(ha_input_file, os.path.join(tmp_path, 'ha.single.txt'))
+        app = App(cfg["homeassistant"], cfg["wirenboard"], ha_mqtt_client, wb_mqtt_client,
+                  HomeAssistantDiscoveryCustomizer.from_config(cfg), general_config(cfg))
+        await run_app(app, wb_mqtt_client, ha_mqtt_client)
+    asyncio.run(run_single())
+
+    cfg = config_schema_builder({})({**options, "general.workers": 3})
+    async def run_sharded():
+        wb_mqtt_client = DeferredReplayClient(wb_input_file, os.path.join(tmp_path, 'wb.sharded.txt'), 3)
+        ha_mqtt_client = DeferredReplayClient(ha_input_file, os.path.join(tmp_path, 'ha.sharded.txt'), 2)
+        app = ShardedApp(cfg, ha_mqtt_client, wb_mqtt_client)
+        await run_app(app, wb_mqtt_client, ha_mqtt_client)
+    asyncio.run(run_sharded())
+
+    # Order of messages from different workers is not defined, so only last message in every topic is compared
+    ha_states = read_final_states(os.path.join(tmp_path, 'ha.sharded.txt'))
+    assert len(ha_states) == 8 * 3 * 3  # config, availability and state of every control
+    assert ha_states == read_final_states(os.path.join(tmp_path, 'ha.single.txt'))
+    # Commands are routed to workers owning the devices and published to Wiren Board
+    assert read_final_states(os.path.join(tmp_path, 'wb.sharded.txt')) == {
+        '/devices/wb-mr6c_1/controls/K10/on': '1',
+        '/devices/wb-mr6c_2/controls/K21/on': '0',
+    }
+
+def test_shard_link_backpressure():
+    async def run():
+        registry = MetricsRegistry()
+        ingress_sock, worker_sock = socket.socketpair()
+        reader, writer = await asyncio.open_unix_connection(sock=ingress_sock)
+        ingress = ShardLink(reader, writer, max_pending=3, metrics_registry=registry)
+        worker = await ShardLink.open(worker_sock)
+        state_topic = '/devices/wb-mr6c_1/controls/K1'
+        ingress.send(('message', 'wirenboard', state_topic, b'x' * 1024 * 1024, 0))
+        # Worker does not read, so link waits until written batch is taken
+        await asyncio.sleep(0.05)
+        for i in range(10):
+            ingress.send(('message', 'wirenboard', state_topic, bytes([i]) * 1024 * 1024, 0))
+        # Above limit states are coalesced by topic, meta and control items are always sent
+        ingress.send(('message', 'wirenboard', '/devices/wb-mr6c_1/controls/K2/meta/type', b'switch', 0))
+        ingress.send(('message', 'wirenboard', '/devices/wb-mr6c_1/controls/K3', b'1', 0))
+        ingress.send(('stop',))
+        assert registry.counter('shard_link_superseded').value == 7
+        assert registry.counter('shard_link_dropped').value == 1
+
+        received = []
+        while len(received) < 6:
+            batch = await worker.receive()
+            assert batch is not None
+            received.extend(batch)
+        assert [item[0] for item in received] == ['message'] * 5 + ['stop']
+        assert [item[2] for item in received[1:5]] == [state_topic] * 3 + ['/devices/wb-mr6c_1/controls/K2/meta/type']
+        assert received[3][3][0] == 9
+        await ingress.close()
+        await worker.close()
+    asyncio.run(run())
+
+class IdleClient:
+    async def disconnect(self):
+        pass
+
+class ExitedProcess:
+    name = 'shard-0'
+    exitcode = -9
+
+    def join(self, timeout=None):
+        pass
+
+def test_worker_exit_stops_sharded_app():
+    cfg = config_schema_builder({})({
+        "homeassistant": {'broker_host': 'localhost'},
+        "wirenboard": {'broker_host': 'localhost'},
+        "general.workers": 2,
+    })
+
+    async def run():
+        app = ShardedApp(cfg, IdleClient(), IdleClient())
+        ingress_sock, worker_sock = socket.socketpair()
+        worker = _Worker(ExitedProcess(), await ShardLink.open(ingress_sock))
+        app._workers.append(worker)
+        worker.reader = asyncio.get_running_loop().create_task(app._read_worker(worker))
+        # Worker process is killed
+        worker_sock.close()
+        await asyncio.wait_for(app._stoper.wait(), 5)
+    asyncio.run(run())
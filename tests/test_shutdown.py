@@ -0,0 +1,125 @@
+import asyncio
+import os
+import sys
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ha_wb_discovery.app import App
+from ha_wb_discovery.config import config_schema_builder, general_config
+from ha_wb_discovery.homeassistant import HomeAssistant, HomeAssistantDiscoveryCustomizer
+from ha_wb_discovery.mappers import WirenControlType
+from ha_wb_discovery.metrics import MetricsRegistry
+from ha_wb_discovery.mqtt_conn.mqtt_client import MQTTRouter
+from ha_wb_discovery.wirenboard_registry import WirenBoardDeviceRegistry
+from tests.mqtt_clients import AckingClient, RecordingClient
+
+class UnreachableClient(RecordingClient):
+    """Broker, which never accepts connection."""
+    async def connect(self, *args, **kwargs):
+        await asyncio.Event().wait()
+
+    async def disconnect(self):
+        pass
+
+def test_drain_publishes_delayed_discovery_before_deadline():
+    client = RecordingClient()
+    registry = WirenBoardDeviceRegistry()
+    device = registry.get_device('wb-msw-v3_21')
+    device.name = 'WB-MSW v.3'
+    control = device.get_control('Temperature')
+    control.apply_type(WirenControlType.temperature)
+    control.apply_error(False)
+    control.state = b'21.5'
+    ha = HomeAssistant(MQTTRouter(client, 'homeassistant'), registry, HomeAssistantDiscoveryCustomizer(), 10, 0)
+
+    async def run():
+        ha.publish_control_config(device, control)
+        await asyncio.sleep(0.01)
+        assert client.published == []
+
+        # Delay of first publish is cut short, config is published with last state
+        started = time.monotonic()
+        await ha.drain(1)
+        assert time.monotonic() - started < 0.5
+        topics = [m.topic for m in client.published]
+        assert 'homeassistant/sensor/wb_msw_v3_21/temperature/config' in topics
+        assert ('/devices/wb-msw-v3_21/controls/Temperature', b'21.5') in client.messages()
+
+        # Publishes, which are not completed before deadline, are cancelled
+        async def stuck():
+            await asyncio.sleep(10)
+        ha._run_task('stuck', stuck())
+        task = ha._async_tasks['stuck']
+        started = time.monotonic()
+        await ha.drain(0.1)
+        assert time.monotonic() - started < 0.5
+        await asyncio.wait([task])
+        assert task.cancelled()
+        assert ha._async_tasks == {}
+    asyncio.run(run())
+
+def test_drain_waits_for_inflight_window():
+    metrics_registry = MetricsRegistry()
+    client = AckingClient(metrics_registry, ack_delay=0.005)
+    router = MQTTRouter(client, 'homeassistant', metrics_registry=metrics_registry, max_inflight=2)
+    registry = WirenBoardDeviceRegistry()
+    ha = HomeAssistant(router, registry, HomeAssistantDiscoveryCustomizer(), 0, 0, metrics_registry=metrics_registry)
+    states = {}
+    for i in range(20):
+        device = registry.get_device(f'wb-mr6c_{i}')
+        control = device.get_control('K1')
+        control.apply_type(WirenControlType.switch)
+        control.state = b'1'
+        states[f'/devices/wb-mr6c_{i}/controls/K1'] = b'1'
+
+    async def run():
+        router.on_connect({})
+        for device in registry.devices().values():
+            ha.publish_control_state(device, device.controls['K1'])
+        # Messages above window are sent after acknowledgements, before drain returns
+        await ha.drain(1)
+        assert router.unacknowledged() == 0
+        assert dict(client.messages()) == states
+    asyncio.run(run())
+
+def test_stop_while_connecting():
+    ha_config = {'broker_host': 'localhost', 'broker_port': 1883}
+    wb_config = {'broker_host': 'localhost', 'broker_port': 1883}
+
+    async def run():
+        app = App(ha_config, wb_config, UnreachableClient(), UnreachableClient(), HomeAssistantDiscoveryCustomizer(),
+                  {'watchdog_interval': 0, 'shutdown_timeout': 1})
+        task = asyncio.get_running_loop().create_task(app.run())
+        await asyncio.sleep(0.05)
+        await app.stop()
+        await asyncio.wait_for(task, 1)
+    asyncio.run(run())
+
+def test_stop_publishes_states_queued_behind_unacknowledged_messages():
+    cfg = config_schema_builder({})({
+        "homeassistant": {'broker_host': 'localhost', 'config_first_publish_delay': 0, 'max_inflight': 2},
+        "wirenboard": {'broker_host': 'localhost'},
+        "general.watchdog_interval": 0,
+        "general.shutdown_timeout": 1,
+    })
+    wb_client, ha_client = RecordingClient(), AckingClient(MetricsRegistry(), ack_delay=0.005)
+    app = App(cfg["homeassistant"], cfg["wirenboard"], ha_client, wb_client, HomeAssistantDiscoveryCustomizer(), general_config(cfg))
+
+    def receive(topic: str, payload: str):
+        wb_client.on_message(None, topic, payload.encode('utf-8'), 0, {})
+
+    async def run():
+        app_task = asyncio.get_running_loop().create_task(app.run())
+        await asyncio.sleep(0.01)
+        for i in range(20):
+            receive(f'/devices/wb-mr6c_{i}/controls/K1/meta/type', 'switch')
+            receive(f'/devices/wb-mr6c_{i}/controls/K1', '1')
+        await asyncio.sleep(0.05)
+        # Burst of last states is larger than window, when app is stopped
+        for i in range(20):
+            receive(f'/devices/wb-mr6c_{i}/controls/K1', '0')
+        await app.stop()
+        await asyncio.wait_for(app_task, 1)
+        last_states = dict(m for m in ha_client.messages() if m[0].endswith('/K1'))
+        assert last_states == {f'/devices/wb-mr6c_{i}/controls/K1': b'0' for i in range(20)}
+    asyncio.run(run())
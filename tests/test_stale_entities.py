@@ -0,0 +1,105 @@
+import asyncio
+import os
+import sys
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ha_wb_discovery.app import App
+from ha_wb_discovery.config import config_schema_builder, general_config
+from ha_wb_discovery.homeassistant import HomeAssistant, HomeAssistantDiscoveryCustomizer
+from ha_wb_discovery.mqtt_conn.mqtt_client import MQTTRouter
+from ha_wb_discovery.wirenboard import Wirenboard
+from ha_wb_discovery.wirenboard_registry import WirenBoardDeviceRegistry
+from tests.mqtt_clients import RecordingClient
+
+def test_removed_controls_are_evicted():
+    wb_client, ha_client = RecordingClient(), RecordingClient()
+    registry = WirenBoardDeviceRegistry()
+    ha = HomeAssistant(MQTTRouter(ha_client, 'homeassistant'), registry, HomeAssistantDiscoveryCustomizer(), 0, 0)
+    wb_router = MQTTRouter(wb_client, 'wirenboard')
+    wb = Wirenboard(wb_router, registry, ha)
+    wb.on_connect()
+
+    def receive(topic: str, payload: str):
+        wb_router._on_message(None, topic, payload.encode('utf-8'), 0, {})
+
+    async def run():
+        receive('/devices/wb-mr6c_1/meta/name', 'WB-MR6C')
+        for control_id in ('K1', 'K2'):
+            receive(f'/devices/wb-mr6c_1/controls/{control_id}/meta/type', 'switch')
+            receive(f'/devices/wb-mr6c_1/controls/{control_id}', '1')
+        await asyncio.sleep(0.05)
+
+        ha_client.published.clear()
+        # Wiren Board clears all retained topics of deleted control
+        for topic in ('meta/type', 'meta/error', 'meta/order', ''):
+            receive(f'/devices/wb-mr6c_1/controls/K1/{topic}'.rstrip('/'), '')
+        await asyncio.sleep(0.05)
+        assert ha_client.messages() == [
+            ('homeassistant/switch/wb_mr6c_1/k1/config', ''),
+            ('/devices/wb-mr6c_1/controls/K1/availability', ''),
+        ]
+        assert list(registry.get_device('wb-mr6c_1').controls) == ['K2']
+
+        receive('/devices/wb-mr6c_1/controls/K2/meta/type', '')
+        receive('/devices/wb-mr6c_1/meta/name', '')
+        await asyncio.sleep(0.05)
+        # Device without controls is removed too, nothing is left for it
+        assert registry.devices() == {}
+        assert ha._async_tasks == {}
+        assert ha._published_configs == {}
+        assert ha._first_published_configs == {}
+        assert ha._ratelimiter == {}
+    asyncio.run(run())
+
+def test_stale_devices():
+    registry = WirenBoardDeviceRegistry()
+    registry.get_device('wb-mr6c_1').last_seen = time.monotonic() - 100
+    registry.get_device('wb-mr6c_2')
+    assert [d.device_id for d in registry.stale_devices(time.monotonic() - 50)] == ['wb-mr6c_1']
+
+def test_stale_device_is_discovered_again():
+    cfg = config_schema_builder({})({
+        "homeassistant": {'broker_host': 'localhost', 'config_first_publish_delay': 0},
+        "wirenboard": {'broker_host': 'localhost'},
+        "general.watchdog_interval": 0,
+        "general.stale_device_timeout": 0.2,
+    })
+    wb_client, ha_client = RecordingClient(), RecordingClient()
+    app = App(cfg["homeassistant"], cfg["wirenboard"], ha_client, wb_client, HomeAssistantDiscoveryCustomizer(), general_config(cfg))
+    config_topic = 'homeassistant/switch/wb_mr6c_1/k1/config'
+    retained = [
+        ('/devices/wb-mr6c_1/meta/name', 'WB-MR6C'),
+        ('/devices/wb-mr6c_1/controls/K1/meta/type', 'switch'),
+        ('/devices/wb-mr6c_1/controls/K1', '1'),
+    ]
+
+    def receive(topic: str, payload: str):
+        wb_client.on_message(None, topic, payload.encode('utf-8'), 0, {})
+
+    async def run():
+        app_task = asyncio.get_running_loop().create_task(app.run())
+        await asyncio.sleep(0.01)
+        for topic, payload in retained:
+            receive(topic, payload)
+        await asyncio.sleep(0.05)
+        assert config_topic in [topic for topic, _ in ha_client.messages()]
+
+        # Device is evicted after timeout and check interval
+        await asyncio.sleep(0.4)
+        assert (config_topic, '') in ha_client.messages()
+        assert app._registry.devices() == {}
+
+        # Device is back with state only, its retained meta is fetched again
+        ha_client.published.clear()
+        receive('/devices/wb-mr6c_1/controls/K1', '0')
+        assert '/devices/wb-mr6c_1/controls/+/meta/+' in wb_client.subscriptions
+        for topic, payload in retained[:2]:
+            receive(topic, payload)
+        await asyncio.sleep(0.05)
+        assert config_topic in [topic for topic, payload in ha_client.messages() if payload]
+        assert ('/devices/wb-mr6c_1/controls/K1', b'0') in ha_client.messages()
+
+        await app.stop()
+        await app_task
+    asyncio.run(run())
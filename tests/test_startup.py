@@ -0,0 +1,36 @@
+import logging
+import os
+import subprocess
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ha_wb_discovery.metrics import MetricsRegistry
+from ha_wb_discovery.startup import StartupTimer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_startup_imports_are_lazy():
+    # Clean interpreter is needed, because tests import everything
+    code = (
+        "import importlib.util, sys\n"
+        "spec = importlib.util.spec_from_file_location('main', 'ha-wb-discovery.py')\n"
+        "spec.loader.exec_module(importlib.util.module_from_spec(spec))\n"
+        "print(' '.join(sorted(sys.modules)))\n"
+    )
+    modules = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True).stdout.split()
+    assert 'ha_wb_discovery.app' in modules
+    for lazy in ('yaml', 'ha_wb_discovery.mqtt_conn.local_mqtt', 'ha_wb_discovery.sharding', 'multiprocessing'):
+        assert lazy not in modules
+
+def test_startup_timer(caplog):
+    registry = MetricsRegistry()
+    startup = StartupTimer(0, registry)
+    with caplog.at_level(logging.INFO, logger='ha_wb_discovery.startup'):
+        startup.mark('imports', 1)
+        startup.mark('connect', 3)
+        startup.mark('connect', 5)
+    assert [r.getMessage() for r in caplog.records] == [
+        'startup: imports in 1.000s, 1.000s since start',
+        'startup: connect in 2.000s, 3.000s since start',
+    ]
+    assert [g['value'] for g in registry.snapshot()['gauges']['startup_seconds']] == [1, 3]
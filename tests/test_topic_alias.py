@@ -0,0 +1,55 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ha_wb_discovery.metrics import MetricsRegistry
+from ha_wb_discovery.mqtt_conn.mqtt_client import MQTTRouter
+from ha_wb_discovery.mqtt_conn.topic_alias import TopicAliases
+from tests.mqtt_clients import RecordingClient
+
+def aliases(client: RecordingClient) -> list[tuple[str, int | None]]:
+    return [(m.topic, m.topic_alias) for m in client.published]
+
+def test_router_topic_aliases():
+    client = RecordingClient()
+    registry = MetricsRegistry()
+    router = MQTTRouter(client, 'homeassistant', topic_alias_maximum=10, metrics_registry=registry)
+    topic = '/devices/wb-msw-v3_21/controls/Temperature'
+
+    # MQTT 3.1.1 broker does not allow aliases
+    router.on_connect({})
+    router.publish(topic, '21.5')
+    assert aliases(client) == [(topic, None)]
+
+    # gmqtt passes CONNACK properties as lists, broker limit is applied
+    client.published.clear()
+    router.on_connect({'topic_alias_maximum': [1]})
+    router.publish(topic, '21.5')
+    router.publish(topic, '21.6')
+    router.publish('/devices/wb-msw-v3_21/controls/Humidity', '40')
+    # QoS 1 messages are resent by gmqtt after reconnect, so they are never aliased
+    router.publish(topic, '21.7', qos=1)
+    assert aliases(client) == [
+        (topic, 1),
+        ('', 1),
+        ('/devices/wb-msw-v3_21/controls/Humidity', None),
+        (topic, None),
+    ]
+    assert registry.counter('mqtt_topic_alias_saved_bytes', client='homeassistant').value == len(topic)
+
+    # Aliases of previous connection are not valid anymore
+    client.published.clear()
+    router.on_connect({'topic_alias_maximum': [1]})
+    router.publish(topic, '21.5')
+    assert aliases(client) == [(topic, 1)]
+
+def test_alias_is_moved_to_most_published_topic():
+    aliases = TopicAliases(1)
+    assert aliases.alias('a') == ('a', 1)
+    assert aliases.alias('a') == ('', 1)
+    for _ in range(4):
+        assert aliases.alias('b') == ('b', None)
+    # Published more than twice as often as aliased topic
+    assert aliases.alias('b') == ('b', 1)
+    assert aliases.alias('b') == ('', 1)
+    assert aliases.alias('a') == ('a', None)
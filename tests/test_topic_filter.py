@@ -0,0 +1,57 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from ha_wb_discovery.mqtt_conn.topic_filter import TopicFilterIndex
+
+@pytest.mark.parametrize('topic_filter, topic, matched', [
+    ('/devices/+/controls/+', '/devices/wb-mr6c_1/controls/K1', True),
+    # No prefix matching
+    ('/devices/+/controls/+', '/devices/wb-mr6c_1/controls/K1/meta/type', False),
+    ('/devices/+/controls/+', '/devices/wb-mr6c_1/controls', False),
+    ('/devices/+/controls/+', '/devices/wb-mr6c_1/controls/', True),
+    ('/devices/#', '/devices/wb-mr6c_1/controls/K1', True),
+    # '#' matches parent level too
+    ('/devices/#', '/devices', True),
+    ('/devices/#', '/device', False),
+    ('#', 'hass/status', True),
+    ('+/status', 'hass/status', True),
+    # Wildcards at first level do not match system topics
+    ('#', '$SYS/broker/uptime', False),
+    ('+/broker/uptime', '$SYS/broker/uptime', False),
+    ('$SYS/#', '$SYS/broker/uptime', True),
+])
+def test_match(topic_filter, topic, matched):
+    index: TopicFilterIndex[str] = TopicFilterIndex()
+    index.add(topic_filter, topic_filter)
+    assert bool(index.match(topic)) == matched
+
+def test_order_and_replace():
+    index: TopicFilterIndex[str] = TopicFilterIndex()
+    index.add('/devices/+/controls/+/meta/+', 'meta')
+    index.add('/devices/#', 'all')
+    index.add('/devices/+/controls/+', 'state')
+    assert index.match('/devices/d/controls/c/meta/type') == ['meta', 'all']
+    assert index.first('/devices/d/controls/c') == 'all'
+    # Resubscription replaces value, order is kept
+    index.add('/devices/#', 'all again')
+    assert len(index) == 3
+    assert index.match('/devices/d/controls/c') == ['all again', 'state']
+    assert index.first('hass/status') is None
+
+@pytest.mark.parametrize('topic_filter', ['/devices/#/controls', '/devices/a+', '/devices/#a'])
+def test_invalid_filter(topic_filter):
+    with pytest.raises(ValueError):
+        TopicFilterIndex().add(topic_filter, None)
+
+def test_remove():
+    index: TopicFilterIndex[str] = TopicFilterIndex()
+    index.add('homeassistant/+/+/+/config', 'config')
+    index.add('/devices/#', 'all')
+    index.remove('homeassistant/+/+/+/config')
+    index.remove('/devices/+')
+    assert index.first('homeassistant/switch/d/c/config') is None
+    assert index.first('/devices/d') == 'all'
+    assert len(index) == 1
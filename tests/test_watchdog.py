@@ -0,0 +1,71 @@
+import asyncio
+import os
+import sys
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ha_wb_discovery.app import App
+from ha_wb_discovery.homeassistant import HomeAssistantDiscoveryCustomizer
+from ha_wb_discovery.metrics import MetricsRegistry
+from ha_wb_discovery.watchdog import LoopWatchdog
+from tests.mqtt_clients import RecordingClient
+
+def test_slow_callback_reported():
+    registry = MetricsRegistry()
+    watchdog = LoopWatchdog(interval=0, slow_callback_threshold=0.01, registry=registry)
+
+    def slow_handler(topic: str, payload: bytes):
+        time.sleep(0.02)
+
+    def fast_handler(topic: str, payload: bytes):
+        pass
+
+    watchdog.call('wirenboard', '/devices/a/controls/b', slow_handler, '/devices/a/controls/b', b'1')
+    watchdog.call('wirenboard', '/devices/a/controls/b', fast_handler, '/devices/a/controls/b', b'1')
+
+    counters = registry.snapshot()['counters']['slow_callbacks_total']
+    assert len(counters) == 1
+    assert counters[0]['labels']['handler'].endswith('slow_handler')
+    assert counters[0]['value'] == 1
+
+def test_slow_task_step_reported():
+    registry = MetricsRegistry()
+    watchdog = LoopWatchdog(interval=0, slow_callback_threshold=0.01, registry=registry)
+
+    async def task():
+        await asyncio.sleep(0.05)  # awaiting does not block loop
+        time.sleep(0.02)
+        return 42
+
+    async def run():
+        return await asyncio.get_running_loop().create_task(watchdog.wrap_task('homeassistant', 'task_id', task()))
+
+    assert asyncio.run(run()) == 42
+    summaries = registry.snapshot()['summaries']['slow_callback_duration']
+    assert len(summaries) == 1
+    assert summaries[0]['count'] == 1
+    assert 0.02 <= summaries[0]['max'] < 0.05
+
+def test_cancelled_task_is_not_reported():
+    registry = MetricsRegistry()
+    watchdog = LoopWatchdog(interval=0, slow_callback_threshold=0.01, registry=registry)
+
+    async def run():
+        t = asyncio.get_running_loop().create_task(watchdog.wrap_task('homeassistant', 'task_id', asyncio.sleep(10)))
+        await asyncio.sleep(0)
+        t.cancel()
+        await asyncio.gather(t, return_exceptions=True)
+        return t.cancelled()
+
+    assert asyncio.run(run())
+    assert 'slow_callbacks_total' not in registry.snapshot()['counters']
+
+def test_disabled_watchdog_does_not_wrap():
+    watchdog = LoopWatchdog(slow_callback_threshold=0, registry=MetricsRegistry())
+    coro = asyncio.sleep(0)
+    assert watchdog.wrap_task('homeassistant', 'task_id', coro) is coro
+    coro.close()
+
+    app = App({'broker_host': 'localhost', 'broker_port': 1883}, {'broker_host': 'localhost', 'broker_port': 1883},
+              RecordingClient(), RecordingClient(), HomeAssistantDiscoveryCustomizer(), {'watchdog_interval': 0})
+    assert app._watchdog is None